@@ -0,0 +1,38 @@
+"""
+AskOGMS request validation shared by the Flask (app.py) and ASGI (asgi.py) front ends.
+Each validator returns (value, None) or (None, error message); callers answer 400 on an error.
+"""
+import os
+
+from result_summary import ANSWER_MODES
+
+# Largest accepted /api/batch request
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+
+
+def answer_mode(data: dict):
+    """Requested answer mode ("auto", "template", "llm"; None = ANSWER_MODE) and an error message if invalid."""
+    mode = data.get("answer_mode")
+    if mode is not None and mode not in ANSWER_MODES:
+        return None, f"'answer_mode' must be one of {', '.join(ANSWER_MODES)}"
+    return mode, None
+
+
+def batch_request(data):
+    """Validated (questions, max_concurrency, answer_mode) from a batch request body, or an error message."""
+    if not isinstance(data, dict):
+        return None, "Request body must be a JSON object"
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return None, "'questions' must be a non-empty list of strings"
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return None, f"At most {BATCH_MAX_QUESTIONS} questions per batch"
+    max_concurrency = data.get("max_concurrency")
+    # bool is an int subclass; true/false is not a concurrency
+    if max_concurrency is not None and (isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int)
+                                        or max_concurrency < 1):
+        return None, "'max_concurrency' must be a positive integer"
+    mode, error = answer_mode(data)
+    if error:
+        return None, error
+    return (questions, max_concurrency, mode), None
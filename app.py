@@ -1,15 +1,34 @@
-from query_engine import chain_code
-from langchain_community.chat_message_histories import ChatMessageHistory
-from flask import Flask, request, jsonify, render_template_string
+from query_engine import chain_code, chain_code_batch, stream_chain_code, engine
+from api_requests import answer_mode as _answer_mode, batch_request as _batch_request
+from chat_sessions import SessionStore
+from instrumentation import metrics
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
 from flask_cors import CORS
 import os
 import csv
-from dotenv import load_dotenv
+import json
+import re
+import uuid
 
 app = Flask(__name__)
 CORS(app)
 
-history = ChatMessageHistory()
+# Conversation history per browser session (cookie), bounded by a token window
+sessions = SessionStore(
+    window_tokens=int(os.getenv("CHAT_HISTORY_TOKENS", "2000")),
+    max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", "1000")),
+    idle_seconds=float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "3600")),
+    summarizer=engine.summarize_history if os.getenv("CHAT_HISTORY_SUMMARY", "false").lower() == "true" else None,
+)
+SESSION_COOKIE = "askogms_session"
+_SESSION_ID_RE = re.compile(r"[0-9a-f]{32}")  # uuid4().hex, as issued by _session_id
+
+# Build the query engine off the request path (ENGINE_WARMUP=background|eager|lazy)
+_warmup = os.getenv("ENGINE_WARMUP", "background").lower()
+if _warmup == "eager":
+    engine.warm_up()
+elif _warmup == "background":
+    engine.warm_up(background=True)
 
 @app.route('/')
 def index():
@@ -282,7 +301,12 @@ def index():
         }
         .message-row .message {
             transition: transform 0.2s ease, box-shadow 0.2s ease;
+            overflow-x: auto;
         }
+        .message ul { margin: 0.35rem 0 0.35rem 1.25rem; padding: 0; }
+        .answer-table { border-collapse: collapse; margin: 0.5rem 0; font-size: 0.875rem; }
+        .answer-table th, .answer-table td { border: 1px solid var(--surface-border); padding: 0.3rem 0.6rem; text-align: left; }
+        .answer-table th { font-weight: 600; }
         .message-row:hover .message {
             transform: translateY(-1px);
         }
@@ -296,6 +320,7 @@ def index():
             animation: msgSlide 0.35s ease-out;
         }
         .typing-wrap.show { display: flex; }
+        .typing-stage { color: var(--text-muted); font-size: 0.8125rem; }
         .typing-dots {
             display: flex;
             gap: 5px;
@@ -412,6 +437,7 @@ def index():
             <div class="typing-wrap" id="typing">
                 <div class="message-avatar">A</div>
                 <div class="typing-dots"><span></span><span></span><span></span></div>
+                <div class="typing-stage" id="typingStage"></div>
             </div>
             <div class="input-area">
                 <div class="input-wrap">
@@ -426,6 +452,7 @@ def index():
         var welcome = document.getElementById('welcome');
         var messagesEl = document.getElementById('messages');
         var typingEl = document.getElementById('typing');
+        var typingStageEl = document.getElementById('typingStage');
         var inputEl = document.getElementById('input');
         var btnEl = document.getElementById('btn');
 
@@ -445,7 +472,8 @@ def index():
             var row = document.createElement('div');
             row.className = 'message-row ' + type;
             var avatar = type === 'user' ? 'You' : 'OGMS';
-            row.innerHTML = '<div class="message-avatar">' + avatar.charAt(0) + '</div><div class="message">' + escapeHtml(text) + '</div>';
+            var body = type === 'bot' ? renderAnswer(text) : linkResults(escapeHtml(text));
+            row.innerHTML = '<div class="message-avatar">' + avatar.charAt(0) + '</div><div class="message">' + body + '</div>';
             messagesEl.appendChild(row);
             scrollToBottom();
         }
@@ -454,15 +482,119 @@ def index():
             d.textContent = s;
             return d.innerHTML;
         }
+        // Template answers use a little markdown: **bold**, "- " bullets and pipe tables
+        function renderAnswer(text) {
+            var lines = escapeHtml(text).split('\\n'), blocks = [], i = 0;
+            var rowPattern = /^\\|.*\\|\\s*$/, rulePattern = /^\\|(\\s*-+\\s*\\|)+\\s*$/;
+            function cells(line, tag) {
+                return line.trim().slice(1, -1).replace(/\\\\\\|/g, '\\u0000').split('|').map(function(cell) {
+                    return '<' + tag + '>' + cell.trim().replace(/\\u0000/g, '|') + '</' + tag + '>';
+                }).join('');
+            }
+            while (i < lines.length) {
+                if (rowPattern.test(lines[i]) && rulePattern.test(lines[i + 1] || '')) {
+                    var table = '<table class="answer-table"><thead><tr>' + cells(lines[i], 'th') + '</tr></thead><tbody>';
+                    for (i += 2; i < lines.length && rowPattern.test(lines[i]); i++) table += '<tr>' + cells(lines[i], 'td') + '</tr>';
+                    blocks.push({ html: table + '</tbody></table>' });
+                } else if (lines[i].indexOf('- ') === 0) {
+                    var items = '';
+                    for (; i < lines.length && lines[i].indexOf('- ') === 0; i++) items += '<li>' + lines[i].slice(2) + '</li>';
+                    blocks.push({ html: '<ul>' + items + '</ul>' });
+                } else {
+                    var last = blocks[blocks.length - 1];
+                    if (!lines[i]) blocks.push({ html: '' });  // A blank line ends the paragraph
+                    else if (last && last.text !== undefined) last.text += '<br>' + lines[i];
+                    else blocks.push({ text: lines[i] });
+                    i++;
+                }
+            }
+            var html = blocks.map(function(block) { return block.text !== undefined ? '<div>' + block.text + '</div>' : block.html; }).join('');
+            return linkResults(html.replace(/\\*\\*(.+?)\\*\\*/g, '<strong>$1</strong>'));
+        }
+        // Summarized answers end with a CSV download path for the full result
+        function linkResults(html) {
+            return html.replace(/\/api\/results\/[0-9a-f]+\.csv/g, function(path) {
+                return '<a href="' + path + '" download>Download CSV</a>';
+            });
+        }
 
         function setTyping(show) {
             if (show) {
                 if (welcome && welcome.classList) welcome.classList.add('hidden');
                 typingEl.classList.add('show');
             } else typingEl.classList.remove('show');
+            typingStageEl.textContent = '';
             scrollToBottom();
         }
 
+        function stageText(name, data) {
+            if (name === 'tables') return 'Tables: ' + (data.tables || []).join(', ');
+            if (name === 'sql') return 'SQL generated';
+            if (name === 'executed') return data.error ? 'Query failed, answering...' : 'Query returned ' + data.row_count + ' rows';
+            return '';
+        }
+
+        // Read Server-Sent Events from /api/stream; returns false if streaming is unsupported
+        function askStream(text) {
+            if (!window.ReadableStream || !window.TextDecoder) return false;
+            var bubble = null, answer = '', buffer = '';
+            var decoder = new TextDecoder();
+
+            function handle(name, data) {
+                if (name === 'token') {
+                    if (!bubble) {
+                        setTyping(false);
+                        addMsg('', 'bot');
+                        bubble = messagesEl.lastChild.querySelector('.message');
+                    }
+                    answer += data.text;
+                    bubble.textContent = answer;
+                    scrollToBottom();
+                } else if (name === 'done') {
+                    if (!bubble) { setTyping(false); addMsg(data.answer || '', 'bot'); }
+                    else bubble.innerHTML = renderAnswer(answer);
+                } else if (name === 'error') {
+                    setTyping(false);
+                    addMsg('Error: ' + data.error, 'bot');
+                } else {
+                    typingStageEl.textContent = stageText(name, data);
+                }
+            }
+
+            fetch('/api/stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ question: text })
+            })
+            .then(function(r) {
+                var reader = r.body.getReader();
+                function pump() {
+                    return reader.read().then(function(chunk) {
+                        if (chunk.done) return;
+                        buffer += decoder.decode(chunk.value, { stream: true });
+                        var frames = buffer.split('\\n\\n');
+                        buffer = frames.pop();
+                        frames.forEach(function(frame) {
+                            var name = 'message', data = '';
+                            frame.split('\\n').forEach(function(line) {
+                                if (line.indexOf('event: ') === 0) name = line.slice(7);
+                                else if (line.indexOf('data: ') === 0) data += line.slice(6);
+                            });
+                            if (data) handle(name, JSON.parse(data));
+                        });
+                        return pump();
+                    });
+                }
+                return pump();
+            })
+            .catch(function(err) {
+                setTyping(false);
+                addMsg('Error: ' + err.message, 'bot');
+            })
+            .finally(function() { setTyping(false); btnEl.disabled = false; });
+            return true;
+        }
+
         function ask() {
             var text = inputEl.value.trim();
             if (!text) return;
@@ -470,6 +602,7 @@ def index():
             inputEl.value = '';
             setTyping(true);
             btnEl.disabled = true;
+            if (askStream(text)) return;
 
             fetch('/api', {
                 method: 'POST',
@@ -496,6 +629,25 @@ def index():
 </html>
     """)
 
+def _session_id() -> tuple:
+    """
+    Return (session_id, is_new): the server-issued session cookie, or a new id.
+
+    A "session_id" in the request body is ignored: it would let any caller read
+    and extend someone else's history.
+    """
+    session_id = request.cookies.get(SESSION_COOKIE, "")
+    if _SESSION_ID_RE.fullmatch(session_id):
+        return session_id, False
+    return uuid.uuid4().hex, True
+
+
+def _with_session_cookie(response, session_id: str, is_new: bool):
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="Lax")
+    return response
+
+
 @app.route('/api', methods=['POST'])
 def api():
     try:
@@ -503,14 +655,15 @@ def api():
         q = data.get('question')
         if not q:
             return jsonify({"error": "Missing 'question'"}), 400
+        answer_mode, error = _answer_mode(data)
+        if error:
+            return jsonify({"error": error}), 400
 
-        history.add_user_message(q)
-        formatted_messages = [
-            {"role": "user" if msg.type == "user" else "assistant", "content": msg.content}
-            for msg in history.messages
-        ]
+        session_id, is_new = _session_id()
+        sessions.add(session_id, "user", q)
+        formatted_messages = sessions.messages(session_id)
 
-        res = chain_code(q, formatted_messages)
+        res = chain_code(q, formatted_messages, answer_mode)
 
         if isinstance(res, str):
             answer_text = res
@@ -521,85 +674,169 @@ def api():
         else:
             answer_text = str(res) if res is not None else "No response generated."
 
-        history.add_ai_message(answer_text)
-        return jsonify({"answer": answer_text})
+        sessions.add(session_id, "assistant", answer_text)
+        return _with_session_cookie(jsonify({"answer": answer_text}), session_id, is_new)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def _get_db_connection():
-    """Return a psycopg2 connection using .env (PostgreSQL only)."""
-    load_dotenv()
-    import psycopg2
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST", "localhost"),
-        port=os.getenv("DB_PORT", "5432"),
-        user=os.getenv("DB_USER", "postgres"),
-        password=os.getenv("DB_PASSWORD", ""),
-        database=os.getenv("DB_NAME", "ogms"),
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """Answer many questions in one call: {"questions": [...], "max_concurrency"?, "answer_mode"?} -> {"results": [...]}"""
+    parsed, error = _batch_request(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        return jsonify({"results": chain_code_batch(*parsed)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/stream', methods=['POST'])
+def api_stream():
+    """Server-Sent Events: stage events (tables, sql, executed), answer tokens, then done."""
+    data = request.get_json(silent=True) or {}
+    q = data.get('question')
+    if not q:
+        return jsonify({"error": "Missing 'question'"}), 400
+    answer_mode, error = _answer_mode(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    session_id, is_new = _session_id()
+    sessions.add(session_id, "user", q)
+    formatted_messages = sessions.messages(session_id)
+
+    def events():
+        for event in stream_chain_code(q, formatted_messages, answer_mode):
+            if event["event"] == "done":
+                sessions.add(session_id, "assistant", event["answer"])
+            yield f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+    return _with_session_cookie(response, session_id, is_new)
+
+
+@app.route('/api/sessions')
+def api_sessions():
+    """Chat history store usage: live sessions, retained turns/tokens/bytes, evictions."""
+    return jsonify(sessions.stats())
+
+
+@app.route('/api/results/<result_id>.csv')
+def api_result_csv(result_id):
+    """Download the full rows behind a summarized answer."""
+    csv_text = engine.result_store.to_csv(result_id)
+    if csv_text is None:
+        return jsonify({"error": "Result expired or not found"}), 404
+    return Response(csv_text, mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename=result-{result_id[:8]}.csv"})
+
+
+@app.route('/api/cache')
+def api_cache():
+    """Question cache and SQL result cache hit/miss counters."""
+    question_cache = engine.question_cache
+    result_cache = engine.result_cache
+    stats = {"enabled": True, **question_cache.stats()} if question_cache else {"enabled": False}
+    stats["results"] = {"enabled": True, **result_cache.stats()} if result_cache else {"enabled": False}
+    return jsonify(stats)
+
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def api_cache_invalidate():
+    """Drop cached query results for the given tables (or all), e.g. after a data load."""
+    data = request.get_json(silent=True) or {}
+    tables = data.get("tables")
+    return jsonify({"invalidated": tables or "all", "entries": engine.invalidate_results(tables)})
+
+
+@app.route('/api/router')
+def api_router():
+    """Routing decisions per strategy and each route's success rate, table accuracy and latency."""
+    return jsonify(engine.router.stats())
+
+
+@app.route('/api/llm')
+def api_llm():
+    """LLM scheduler budget, queue depth and grants/timeouts per priority class (waits: /api/metrics)."""
+    scheduler = engine.llm_scheduler
+    return jsonify(scheduler.stats() if scheduler else {"enabled": False})
+
+
+@app.route('/api/models')
+def api_models():
+    """Model per stage, the escalation model and escalation counts/rates per stage and reason."""
+    return jsonify(engine.model_tiers.stats())
+
+
+@app.route('/api/prompts')
+def api_prompts():
+    """Prompt token budgets and mean estimated tokens per section, with compaction counts."""
+    return jsonify({"budgets": engine.prompt_budget.stats(), "prompts": metrics.snapshot()["prompts"]})
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latency histograms, token, cache and row counters (Prometheus text format)."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Per-stage count, mean and p50/p95/p99 latency over recent questions."""
+    return jsonify(metrics.snapshot())
+
+
+@app.route('/api/engine')
+def api_engine():
+    """Query engine readiness, per-phase init timings (seconds) and connection pool usage."""
+    return jsonify({"ready": engine.ready, "init_timings": engine.init_timings, "pool": engine.pool_stats()})
+
+
+@app.route('/api/schema/refresh', methods=['POST'])
+def api_schema_refresh():
+    """Invalidate cached table info for the given tables (or all tables)."""
+    data = request.get_json(silent=True) or {}
+    tables = data.get("tables")
+    engine.invalidate_schema(tables)
+    return jsonify({"invalidated": tables or "all"})
 
 
 @app.route('/api/schema')
 def api_schema():
     """Return list of tables, or schema (columns, PK, FK) for one table."""
     try:
-        conn = _get_db_connection()
-        cur = conn.cursor()
+        tables = engine.schema_catalog.tables()
         table_name = request.args.get("table")
-        schema = "public"
-
         if not table_name:
-            cur.execute("""
-                SELECT table_name FROM information_schema.tables
-                WHERE table_schema = %s AND table_type = 'BASE TABLE'
-                ORDER BY table_name
-            """, (schema,))
-            tables = [row[0] for row in cur.fetchall()]
-            conn.close()
-            return jsonify({"tables": tables})
-
-        # Columns
-        cur.execute("""
-            SELECT column_name, data_type, is_nullable
-            FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-            ORDER BY ordinal_position
-        """, (schema, table_name))
-        columns = [{"name": r[0], "type": r[1], "nullable": r[2] == "YES"} for r in cur.fetchall()]
-
-        # Primary key columns
-        cur.execute("""
-            SELECT kcu.column_name
-            FROM information_schema.table_constraints tc
-            JOIN information_schema.key_column_usage kcu
-                ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema
-            WHERE tc.table_schema = %s AND tc.table_name = %s AND tc.constraint_type = 'PRIMARY KEY'
-            ORDER BY kcu.ordinal_position
-        """, (schema, table_name))
-        pk_columns = [r[0] for r in cur.fetchall()]
-
-        # Foreign keys: column -> (referenced_table, referenced_column)
-        cur.execute("""
-            SELECT kcu.column_name, ccu.table_name AS ref_table, ccu.column_name AS ref_column
-            FROM information_schema.table_constraints tc
-            JOIN information_schema.key_column_usage kcu
-                ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema
-            JOIN information_schema.constraint_column_usage ccu
-                ON tc.constraint_name = ccu.constraint_name AND tc.table_schema = ccu.table_schema
-            WHERE tc.table_schema = %s AND tc.table_name = %s AND tc.constraint_type = 'FOREIGN KEY'
-        """, (schema, table_name))
-        fk_map = {r[0]: {"table": r[1], "column": r[2]} for r in cur.fetchall()}
-
-        for col in columns:
-            col["pk"] = col["name"] in pk_columns
-            col["fk"] = fk_map.get(col["name"])
-
-        conn.close()
-        return jsonify({"table": table_name, "columns": columns})
+            return jsonify({"tables": sorted(tables)})
+        if table_name not in tables:
+            return jsonify({"error": f"Unknown table: {table_name}"}), 404
+        return jsonify({"table": table_name, "columns": tables[table_name]["columns"]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/schema/catalog')
+def api_schema_catalog():
+    """Columns, PK and FK for every table in one payload; revalidated with ETag / If-None-Match."""
+    try:
+        payload, etag = engine.schema_catalog.payload()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(payload, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.route('/tables')
@@ -732,10 +969,13 @@ def table_descriptions():
     <script>
         var allTables = [];
         var selectedTable = null;
+        var catalog = {};
 
-        fetch('/api/schema').then(function(r){ return r.json(); }).then(function(data){
+        // One request for the whole catalog; the browser revalidates it with the ETag
+        fetch('/api/schema/catalog').then(function(r){ return r.json(); }).then(function(data){
             if (data.error) { document.getElementById('errorMsg').textContent = data.error; document.getElementById('errorMsg').style.display = 'block'; return; }
-            allTables = data.tables || [];
+            catalog = data.tables || {};
+            allTables = Object.keys(catalog).sort();
             renderTableList(allTables);
         }).catch(function(e){ document.getElementById('errorMsg').textContent = 'Failed to load tables.'; document.getElementById('errorMsg').style.display = 'block'; });
 
@@ -760,20 +1000,19 @@ def table_descriptions():
             selectedTable = name;
             renderTableList(document.getElementById('search').value.trim() ? allTables.filter(function(t){ return t.toLowerCase().indexOf(document.getElementById('search').value.trim().toLowerCase()) >= 0; }) : allTables);
             document.getElementById('errorMsg').style.display = 'none';
-            fetch('/api/schema?table=' + encodeURIComponent(name)).then(function(r){ return r.json(); }).then(function(data){
-                if (data.error) { document.getElementById('errorMsg').textContent = data.error; document.getElementById('errorMsg').style.display = 'block'; document.getElementById('schemaCard').innerHTML = ''; return; }
-                var cols = data.columns || [];
-                var html = '<div class="schema-card"><h2>' + name + ' — columns &amp; keys</h2><table class="schema-table"><thead><tr><th>Column</th><th>Type</th><th>Nullable</th><th>Key</th></tr></thead><tbody>';
-                cols.forEach(function(c){
-                    var keys = [];
-                    if (c.pk) keys.push('<span class="badge badge-pk">PK</span>');
-                    if (c.fk) keys.push('<span class="badge badge-fk">FK → ' + c.fk.table + '.' + c.fk.column + '</span>');
-                    if (!keys.length) keys.push('<span class="badge-null">—</span>');
-                    html += '<tr><td class="col-name">' + c.name + '</td><td class="col-type">' + c.type + '</td><td>' + (c.nullable ? 'Yes' : 'No') + '</td><td>' + keys.join(' ') + '</td></tr>';
-                });
-                html += '</tbody></table></div>';
-                document.getElementById('schemaCard').innerHTML = html;
+            var data = catalog[name];
+            if (!data) { document.getElementById('errorMsg').textContent = 'Unknown table: ' + name; document.getElementById('errorMsg').style.display = 'block'; document.getElementById('schemaCard').innerHTML = ''; return; }
+            var cols = data.columns || [];
+            var html = '<div class="schema-card"><h2>' + name + ' — columns &amp; keys</h2><table class="schema-table"><thead><tr><th>Column</th><th>Type</th><th>Nullable</th><th>Key</th></tr></thead><tbody>';
+            cols.forEach(function(c){
+                var keys = [];
+                if (c.pk) keys.push('<span class="badge badge-pk">PK</span>');
+                if (c.fk) keys.push('<span class="badge badge-fk">FK → ' + c.fk.table + '.' + c.fk.column + '</span>');
+                if (!keys.length) keys.push('<span class="badge-null">—</span>');
+                html += '<tr><td class="col-name">' + c.name + '</td><td class="col-type">' + c.type + '</td><td>' + (c.nullable ? 'Yes' : 'No') + '</td><td>' + keys.join(' ') + '</td></tr>';
             });
+            html += '</tbody></table></div>';
+            document.getElementById('schemaCard').innerHTML = html;
         }
     </script>
 </body>
@@ -0,0 +1,109 @@
+"""
+AskOGMS ASGI server (async engine).
+Run: uvicorn asgi:app --host 127.0.0.1 --port 8000
+Each worker answers many questions concurrently on one event loop; the Flask
+app (app.py) remains the UI server.
+"""
+import asyncio
+import json
+import os
+
+from instrumentation import metrics
+from query_engine import achain_code, chain_code_batch, engine
+from api_requests import answer_mode, batch_request
+
+
+async def _read_json(receive) -> dict:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return json.loads(body or b"{}")
+
+
+async def _send_json(send, status: int, payload: dict) -> None:
+    body = json.dumps(payload, default=str).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if os.getenv("ENGINE_WARMUP", "background").lower() != "lazy":
+                engine.warm_up(background=True)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if engine._async_runner is not None:
+                await engine._async_runner.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    POST /api         {"question": ..., "messages": [...], "answer_mode"?} -> {"answer": ...}
+    POST /api/batch   {"questions": [...], "max_concurrency"?, "answer_mode"?} -> {"results": [...]}
+    GET  /api/engine  readiness, init timings and pool usage
+    GET  /metrics     stage metrics (Prometheus text format)
+    """
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"].rstrip("/") or "/", scope["method"]
+    if path == "/api" and method == "POST":
+        try:
+            data = await _read_json(receive)
+        except ValueError:
+            await _send_json(send, 400, {"error": "Invalid JSON body"})
+            return
+        q = data.get("question")
+        if not q:
+            await _send_json(send, 400, {"error": "Missing 'question'"})
+            return
+        mode, error = answer_mode(data)
+        if error:
+            await _send_json(send, 400, {"error": error})
+            return
+        try:
+            answer = await achain_code(q, data.get("messages") or [], mode)
+            await _send_json(send, 200, {"answer": answer if isinstance(answer, str) else str(answer)})
+        except Exception as e:
+            await _send_json(send, 500, {"error": str(e)})
+    elif path == "/api/batch" and method == "POST":
+        try:
+            data = await _read_json(receive)
+        except ValueError:
+            await _send_json(send, 400, {"error": "Invalid JSON body"})
+            return
+        parsed, error = batch_request(data)
+        if error:
+            await _send_json(send, 400, {"error": error})
+            return
+        try:
+            # The batch pipeline blocks (Runnable.batch threads, one pooled connection); keep it off the loop
+            results = await asyncio.to_thread(chain_code_batch, *parsed)
+            await _send_json(send, 200, {"results": results})
+        except Exception as e:
+            await _send_json(send, 500, {"error": str(e)})
+    elif path == "/api/engine" and method == "GET":
+        await _send_json(send, 200, {"ready": engine.ready, "init_timings": engine.init_timings,
+                                     "async_driver": engine.ready and engine.async_runner.is_native,
+                                     "pool": engine.pool_stats()})
+    elif path == "/metrics" and method == "GET":
+        body = metrics.render_prometheus().encode("utf-8")
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain; version=0.0.4"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+    else:
+        await _send_json(send, 404, {"error": "Not found"})
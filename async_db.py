@@ -0,0 +1,104 @@
+"""
+AskOGMS async database access.
+Runs generated SQL on a SQLAlchemy async engine (asyncpg / aiosqlite / aiomysql)
+so the async pipeline never blocks the event loop on the database.
+"""
+import asyncio
+from contextlib import suppress
+from typing import Callable, Optional
+
+from db_pool import pool_options
+from query_results import QueryResult, acollect_rows
+
+# Sync driver URI prefix -> async driver
+_ASYNC_DRIVERS = {
+    "postgresql": ("postgresql+asyncpg", "asyncpg"),
+    "sqlite": ("sqlite+aiosqlite", "aiosqlite"),
+    "mysql+pymysql": ("mysql+aiomysql", "aiomysql"),
+}
+
+
+def async_database_uri(database_uri: str) -> Optional[str]:
+    """Map a sync SQLAlchemy URI to its async-driver form, or None if the driver is missing."""
+    scheme, _, rest = database_uri.partition("://")
+    mapping = _ASYNC_DRIVERS.get(scheme)
+    if not mapping:
+        return None
+    async_scheme, module = mapping
+    try:
+        __import__(module)
+        __import__("greenlet")  # required by sqlalchemy.ext.asyncio
+    except ImportError:
+        return None
+    return f"{async_scheme}://{rest}"
+
+
+class AsyncQueryRunner:
+    """
+    Executes SQL on an async engine, created on first use.
+
+    When no async driver is installed, queries run on `sync_fallback` in a worker
+    thread instead, so callers can always await run().
+    """
+
+    def __init__(self, database_uri: str, sync_fallback: Callable[[str], QueryResult], policy=None):
+        self.database_uri = database_uri
+        self.sync_fallback = sync_fallback
+        self.policy = policy
+        self._engine = None
+        self._async_uri = async_database_uri(database_uri)
+        if not self._async_uri:
+            print("No async database driver installed; async queries run in worker threads")
+
+    @property
+    def is_native(self) -> bool:
+        return self._async_uri is not None
+
+    def _get_engine(self):
+        if self._engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            # aiosqlite has no server to pool connections to; QueuePool sizing applies to the network drivers
+            # only, and an in-memory database must stay on its one connection (as in db_pool.create_pooled_engine)
+            options = {} if self._async_uri.startswith("sqlite") else pool_options()
+            self._engine = create_async_engine(self._async_uri, **options)
+        return self._engine
+
+    async def run(self, sql_query: str) -> QueryResult:
+        """Execute SQL with a streaming cursor under the execution policy, fetching at most the row/byte budget."""
+        if not self.is_native:
+            return await asyncio.to_thread(self.sync_fallback, sql_query)
+        from sqlalchemy import text
+        policy = self.policy
+        engine = self._get_engine()
+        dialect = engine.dialect.name
+        prepared = policy.prepare(sql_query) if policy else sql_query
+        async with engine.connect() as conn:
+            try:
+                async with conn.begin():
+                    estimate = None
+                    if policy:
+                        for statement in policy.session_statements(dialect):
+                            await conn.exec_driver_sql(statement)
+                        explain = policy.explain_sql(dialect, prepared)
+                        if explain:
+                            estimate = policy.check_plan(dialect, (await conn.execute(text(explain))).scalar())
+                    result = await conn.stream(text(prepared))
+                    try:
+                        rows = await acollect_rows(result.keys(), result)
+                    finally:
+                        await result.close()
+                    rows.limit_added = prepared is not sql_query
+                    rows.plan_estimate = estimate
+                    return rows
+            finally:
+                if policy:
+                    # Connection-level settings must not leak into the pool
+                    with suppress(Exception):
+                        for statement in policy.reset_statements(dialect):
+                            await conn.exec_driver_sql(statement)
+                        await conn.commit()
+
+    async def dispose(self) -> None:
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
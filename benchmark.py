@@ -0,0 +1,465 @@
+"""
+AskOGMS offline benchmark.
+Runs the NL -> SQL pipeline against askdb_local.db with a deterministic replay
+LLM (canned table selections, SQL and answers from benchmark_questions.jsonl,
+with simulated latency), and reports p50/p95/p99 per stage, questions per second
+at several concurrency levels and peak RSS. No Gemini or network access needed.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --latency 0.2 --concurrency 1 4 16 --rounds 3 --json bench.json
+    python benchmark.py --async --compare bench.json
+    python benchmark.py --extract          # SQL extractor corpus, fuzz check and micro-benchmark
+    TABLE_SELECTOR=llm python benchmark.py --speculative
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+# The benchmark always runs on the local SQLite database with remote tracing off;
+# these must be set before query_engine reads its configuration at import.
+os.environ["LANGCHAIN_TRACING_V2"] = "false"
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from chat_sessions import estimate_tokens
+
+DEFAULT_RECORDING = "benchmark_questions.jsonl"
+DEFAULT_EXTRACT_CORPUS = "sql_extract_corpus.jsonl"
+
+# Wrappers the model has been seen to put around SQL; used to fuzz the extractor
+_FENCE_TAGS = ["sql", "SQL", "SQLQuery", "postgresql", ""]
+_PREFIXES = ["", "SQLQuery: ", "SQL Query: ", "SQL:", "Here is the query:\n", "Answer:\n\n"]
+_SUFFIXES = ["", "\n", "\n\nThis query returns the requested rows.", "\nLet me know if you need changes."]
+
+
+def load_recording(path: str) -> List[dict]:
+    """Recorded questions: {"question", "tables", "sql", optional "broken_sql", optional "answer"}."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _prompt_text(value) -> str:
+    """Flatten a prompt (string, message list or PromptValue) into one string."""
+    if hasattr(value, "to_messages"):
+        value = value.to_messages()
+    if isinstance(value, list):
+        return "\n".join(str(getattr(message, "content", message)) for message in value)
+    return str(value)
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for Gemini.
+
+    Finds the recorded question inside each prompt and replays its table
+    selection, SQL (wrapped in a ```sql fence like the real model), correction
+    or answer, after sleeping `latency` +/- `jitter` seconds. Token usage is
+    estimated from the prompt and reply so token metrics stay populated.
+    """
+
+    recording: List[dict]
+    latency: float = 0.0
+    jitter: float = 0.0
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _delay(self, text: str) -> float:
+        if not self.latency:
+            return 0.0
+        # Same prompt -> same delay, so runs are comparable
+        spread = random.Random(f"{self.seed}:{text}").uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency + spread)
+
+    def _entry(self, text: str) -> Dict[str, Any]:
+        matches = [entry for entry in self.recording if entry["question"] in text]
+        if not matches:
+            raise ValueError(f"No recorded response for prompt: {text[-200:]!r}")
+        return max(matches, key=lambda entry: len(entry["question"]))
+
+    def _reply(self, text: str) -> str:
+        entry = self._entry(text)
+        if "Database Query Result" in text:
+            return entry.get("answer", f"Here is the answer to: {entry['question']}")
+        if "Failed Query:" in text:
+            return entry["sql"]
+        return f"```sql\n{entry.get('broken_sql') or entry['sql']}\n```"
+
+    def _message(self, text: str, reply: str) -> AIMessage:
+        prompt_tokens, completion_tokens = estimate_tokens(text), estimate_tokens(reply)
+        return AIMessage(content=reply, usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = _prompt_text(messages)
+        reply = self._reply(text)
+        time.sleep(self._delay(text))
+        return ChatResult(generations=[ChatGeneration(message=self._message(text, reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = _prompt_text(messages)
+        reply = self._reply(text)
+        await asyncio.sleep(self._delay(text))
+        return ChatResult(generations=[ChatGeneration(message=self._message(text, reply))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = _prompt_text(messages)
+        words = self._reply(text).split(" ")
+        delay = self._delay(text) / max(1, len(words))
+        for word in words:
+            time.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    def with_structured_output(self, schema, **kwargs):
+        def select(prompt):
+            text = _prompt_text(prompt)
+            time.sleep(self._delay(text))
+            return schema(name=self._entry(text)["tables"])
+
+        async def aselect(prompt):
+            text = _prompt_text(prompt)
+            await asyncio.sleep(self._delay(text))
+            return schema(name=self._entry(text)["tables"])
+
+        return RunnableLambda(select, afunc=aselect)
+
+
+def _percentiles(values: List[float], unit: str = "ms") -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    scale = {"ms": 1000, "us": 1000000}[unit]
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * scale, 2)
+
+    return {"count": len(ordered), f"p50_{unit}": pick(0.50), f"p95_{unit}": pick(0.95), f"p99_{unit}": pick(0.99),
+            f"mean_{unit}": round(sum(ordered) / len(ordered) * scale, 2)}
+
+
+def _stage_durations(traces: List[dict]) -> Dict[str, List[float]]:
+    stages: Dict[str, List[float]] = {}
+    for record in traces:
+        for span in record["spans"]:
+            stages.setdefault(span["name"], []).append(span["duration_ms"] / 1000)
+    return stages
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run_level(engine, questions: List[str], concurrency: int, mode: str) -> dict:
+    """
+    Answer every question once at the given concurrency; return latency, QPS and stage stats.
+
+    mode is "threads" (chain_code per question), "async" (achain_code) or "batch"
+    (one chain_code_batch call; latency is then the whole call).
+    """
+    import instrumentation
+
+    traces: List[dict] = []
+    latencies: List[float] = []
+
+    def one(question: str):
+        with instrumentation.trace("benchmark", question) as record:
+            start = time.perf_counter()
+            engine.chain_code(question, [])
+            latencies.append(time.perf_counter() - start)
+        traces.append(record)
+
+    async def aone(question: str, semaphore):
+        async with semaphore:
+            with instrumentation.trace("benchmark", question) as record:
+                start = time.perf_counter()
+                await engine.achain_code(question, [])
+                latencies.append(time.perf_counter() - start)
+            traces.append(record)
+
+    async def arun():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(aone(question, semaphore) for question in questions), return_exceptions=True)
+
+    start = time.perf_counter()
+    if mode == "batch":
+        with instrumentation.trace("benchmark", f"{len(questions)} questions") as record:
+            outcomes = [RuntimeError(result["error"]) if result["error"] else None
+                        for result in engine.chain_code_batch(questions, concurrency)]
+        latencies.append(time.perf_counter() - start)
+        traces.append(record)
+    elif mode == "async":
+        outcomes = asyncio.run(arun())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = [future.exception() for future in [pool.submit(one, question) for question in questions]]
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for outcome in outcomes if isinstance(outcome, BaseException))
+
+    return {
+        "concurrency": concurrency,
+        "questions": len(questions),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "qps": round(len(questions) / elapsed, 2) if elapsed else None,
+        "latency": _percentiles(latencies),
+        "stages": {stage: _percentiles(values) for stage, values in sorted(_stage_durations(traces).items())},
+        "tokens": {
+            kind: sum(span["attrs"].get(f"{kind}_tokens", 0) for record in traces for span in record["spans"])
+            for kind in ("prompt", "completion")
+        },
+        "routes": dict(Counter(span["attrs"].get("route") for record in traces for span in record["spans"]
+                               if span["name"] == "routing")),
+        "speculation": {
+            outcome: sum(1 for record in traces for span in record["spans"]
+                         if span["name"] == "speculation" and span["attrs"].get("speculation_hit") is kept)
+            for outcome, kept in (("hits", True), ("misses", False))
+        },
+        "escalations": dict(Counter(span["attrs"]["escalation"] for record in traces for span in record["spans"]
+                                    if span["attrs"].get("escalation"))),
+        "llm_queue_wait_ms": round(sum(span["attrs"].get("queue_wait_ms", 0)
+                                       for record in traces for span in record["spans"]), 1),
+        "prompt_sections": dict(sum((Counter(span["attrs"]["prompt_sections"]) for record in traces
+                                     for span in record["spans"] if span["attrs"].get("prompt_sections")), Counter())),
+        "prompts_compacted": sum(1 for record in traces for span in record["spans"]
+                                 if span["attrs"].get("prompt_compaction")),
+    }
+
+
+def _fuzz_variants(sql: str, rng: random.Random, count: int) -> List[str]:
+    """Wrap canonical extractor output in random fences, prefixes, prose and whitespace."""
+    variants = []
+    for _ in range(count):
+        body = sql.replace("\n", rng.choice(["\n", " ", "\n    ", "  \n", "\t"]))
+        fenced = rng.random() < 0.6
+        # Prose after an unterminated, unfenced statement would be part of it
+        suffix = rng.choice(_SUFFIXES) if fenced or sql.endswith(";") else ""
+        if fenced:
+            body = f"```{rng.choice(_FENCE_TAGS)}\n{body}\n```"
+        variants.append(rng.choice(_PREFIXES) + body + suffix)
+    return variants
+
+
+def run_extract_benchmark(corpus_path: str, fuzz: int = 50, iterations: int = 200) -> dict:
+    """
+    Check the SQL extractor against its corpus and fuzzed wrappings, then time it.
+
+    Every corpus input must produce its expected output, and every fuzzed
+    wrapping of an expected output must extract back to it unchanged.
+    """
+    from sql_extract import extract_sql
+
+    with open(corpus_path, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    failures = [case["input"] for case in corpus if extract_sql(case["input"]) != case["expected"]]
+
+    rng = random.Random(0)
+    fuzzed = [(variant, case["expected"]) for case in corpus for variant in _fuzz_variants(case["expected"], rng, fuzz)]
+    fuzz_failures = [variant for variant, expected in fuzzed if extract_sql(variant) != expected]
+
+    inputs = [case["input"] for case in corpus] + [variant for variant, _ in fuzzed]
+    timings = []
+    for _ in range(iterations):
+        for text in inputs[:len(corpus)]:
+            start = time.perf_counter()
+            extract_sql(text)
+            timings.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for text in inputs:
+        extract_sql(text)
+    throughput = len(inputs) / (time.perf_counter() - start)
+
+    return {
+        "commit": _git_commit(),
+        "corpus": len(corpus),
+        "corpus_failures": failures,
+        "fuzz_cases": len(fuzzed),
+        "fuzz_failures": fuzz_failures[:20],
+        "fuzz_failure_count": len(fuzz_failures),
+        "per_call_us": _percentiles(timings, unit="us"),
+        "calls_per_second": round(throughput),
+    }
+
+
+def print_extract_report(report: dict) -> None:
+    timing = report["per_call_us"]
+    print(f"\nSQL extractor @ {report['commit']}: corpus {report['corpus'] - len(report['corpus_failures'])}"
+          f"/{report['corpus']} ok, fuzz {report['fuzz_cases'] - report['fuzz_failure_count']}/{report['fuzz_cases']} ok")
+    print(f"  per call: p50 {timing['p50_us']}us p95 {timing['p95_us']}us p99 {timing['p99_us']}us, "
+          f"{report['calls_per_second']} calls/s")
+    for text in report["corpus_failures"] + report["fuzz_failures"]:
+        print(f"  FAILED: {text!r}")
+
+
+def print_report(report: dict) -> None:
+    print(f"\nAskOGMS benchmark @ {report['commit']} ({report['mode']}, latency {report['llm_latency']}s, "
+          f"{report['questions']} questions x {report['rounds']} rounds)")
+    for level in report["levels"]:
+        latency = level["latency"]
+        print(f"\nconcurrency {level['concurrency']}: {level['qps']} q/s, "
+              f"p50 {latency.get('p50_ms')}ms p95 {latency.get('p95_ms')}ms p99 {latency.get('p99_ms')}ms, "
+              f"errors {level['errors']}, tokens {level['tokens']['prompt']}+{level['tokens']['completion']}")
+        print(f"  {'stage':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, stats in level["stages"].items():
+            print(f"  {stage:<20}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+        if level.get("routes"):
+            print("  routes: " + ", ".join(f"{route} {count}" for route, count in sorted(level["routes"].items())))
+        speculation = level.get("speculation", {})
+        if speculation.get("hits") or speculation.get("misses"):
+            print(f"  speculative SQL kept {speculation['hits']}/{speculation['hits'] + speculation['misses']}")
+        if level.get("escalations"):
+            print("  escalated to strong model: " + ", ".join(f"{reason} {count}" for reason, count
+                                                             in sorted(level["escalations"].items())))
+        if level.get("llm_queue_wait_ms"):
+            print(f"  LLM scheduler queue wait {level['llm_queue_wait_ms']}ms total")
+        if level.get("prompt_sections"):
+            print("  prompt tokens (estimated): " + ", ".join(f"{section} {tokens}" for section, tokens
+                                                          in sorted(level["prompt_sections"].items()))
+                  + f"; {level['prompts_compacted']} prompts compacted")
+    print(f"\nstartup {report['startup_ms']}ms, peak RSS {report['peak_rss_mb']} MB")
+
+
+def print_comparison(report: dict, baseline: dict) -> None:
+    """p95 deltas per level and stage against a previous --json report."""
+    print(f"\nCompared with {baseline.get('commit', '?')}:")
+    for key in ("mode", "llm_latency", "questions", "rounds"):
+        if baseline.get(key) != report[key]:
+            print(f"  note: {key} differs ({baseline.get(key)} vs {report[key]}); numbers are not like for like")
+    previous = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    for level in report["levels"]:
+        before = previous.get(level["concurrency"])
+        if not before:
+            continue
+        rows = [("total", level["latency"], before["latency"])]
+        rows += [(stage, stats, before["stages"].get(stage, {})) for stage, stats in level["stages"].items()]
+        print(f"  concurrency {level['concurrency']}: qps {before['qps']} -> {level['qps']}")
+        for name, now, then in rows:
+            if then.get("p95_ms") and now.get("p95_ms"):
+                change = (now["p95_ms"] - then["p95_ms"]) / then["p95_ms"] * 100
+                print(f"    {name:<20} p95 {then['p95_ms']:>9} -> {now['p95_ms']:>9} ms ({change:+.1f}%)")
+    print(f"  peak RSS {baseline.get('peak_rss_mb')} -> {report['peak_rss_mb']} MB")
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Offline NL -> SQL pipeline benchmark with a replay LLM")
+    parser.add_argument("--recording", default=DEFAULT_RECORDING, help="Recorded questions (JSON Lines)")
+    parser.add_argument("--db", default="askdb_local.db", help="SQLite database file")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per LLM call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds added to each LLM call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over the recorded questions per level")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use achain_code on one event loop")
+    parser.add_argument("--rpm", type=float, default=0, help="LLM scheduler requests-per-minute limit (0 = none)")
+    parser.add_argument("--tpm", type=float, default=0, help="LLM scheduler tokens-per-minute limit (0 = none)")
+    parser.add_argument("--batch", action="store_true", help="Answer each level's questions with one chain_code_batch call")
+    parser.add_argument("--prompt-budget", type=int,
+                        help="PROMPT_TOKEN_BUDGET for the SQL prompt (0 = unlimited; default: the setting)")
+    parser.add_argument("--cache", action="store_true", help="Keep the question -> SQL and SQL result caches enabled")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Generate SQL speculatively during LLM table selection (use with TABLE_SELECTOR=llm)")
+    parser.add_argument("--llm-cache", action="store_true",
+                        help="Let repeated prompts hit query_engine's in-memory LLM cache")
+    parser.add_argument("--json", dest="json_path", help="Write the report to this file")
+    parser.add_argument("--compare", help="Previous --json report to diff against")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own log output")
+    parser.add_argument("--extract", action="store_true", help="Only check and time the SQL extractor")
+    parser.add_argument("--extract-corpus", default=DEFAULT_EXTRACT_CORPUS)
+    args = parser.parse_args(argv)
+
+    if args.extract:
+        report = run_extract_benchmark(args.extract_corpus)
+        print_extract_report(report)
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return report
+
+    os.environ["DB_TYPE"] = "sqlite"
+    os.environ["DB_NAME"] = args.db
+    os.environ.setdefault("ROUTER_LOG", "off")  # replayed runs are not training data
+    if not args.cache:
+        os.environ["QUERY_CACHE_ENABLED"] = "false"
+        os.environ["RESULT_CACHE_ENABLED"] = "false"
+    if args.speculative:
+        os.environ["SPECULATIVE_SQL"] = "true"
+    if args.prompt_budget is not None:
+        os.environ["PROMPT_TOKEN_BUDGET"] = str(args.prompt_budget)
+
+    mode = "batch" if args.batch else "async" if args.use_async else "threads"
+
+    from instrumentation import TokenUsageCallback
+    from llm_scheduler import scheduler_from_env
+    import query_engine
+
+    recording = load_recording(args.recording)
+    # cache=False bypasses the global InMemoryCache so every round pays the simulated latency
+    os.environ["LLM_REQUESTS_PER_MINUTE"] = str(args.rpm)
+    os.environ["LLM_TOKENS_PER_MINUTE"] = str(args.tpm)
+    scheduler = scheduler_from_env()
+    llm = ReplayChatModel(recording=recording, latency=args.latency, jitter=args.jitter,
+                          cache=None if args.llm_cache else False, rate_limiter=scheduler,
+                          callbacks=[TokenUsageCallback()] + ([scheduler.callback] if scheduler else []))
+    engine = query_engine.QueryEngine(llm=llm)
+    engine.llm_scheduler = scheduler
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with quiet:
+        start = time.perf_counter()
+        engine.warm_up()
+        startup_ms = round((time.perf_counter() - start) * 1000, 1)
+        questions = [entry["question"] for entry in recording] * args.rounds
+        levels = [run_level(engine, questions, concurrency, mode) for concurrency in args.concurrency]
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "mode": mode,
+        "llm_latency": args.latency,
+        "questions": len(recording),
+        "rounds": args.rounds,
+        "startup_ms": startup_ms,
+        "init_timings": engine.init_timings,
+        "levels": levels,
+    }
+    report["peak_rss_mb"] = _peak_rss_mb()
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json_path}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+AskOGMS chat sessions.
+Keeps each browser session's conversation in a token-budgeted sliding window,
+optionally folding older turns into a rolling summary, and evicts idle sessions
+so memory stays flat however long the process runs.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting prompts and history."""
+    return len(text) // 4 + 1
+
+
+class ChatSession:
+    """One conversation: recent turns within the token budget plus a summary of older ones."""
+
+    __slots__ = ("turns", "tokens", "summary", "last_seen", "summary_lock")
+
+    def __init__(self):
+        self.turns = deque()  # (role, content, tokens)
+        self.tokens = 0
+        self.summary = ""
+        self.last_seen = time.monotonic()
+        self.summary_lock = threading.Lock()  # one summarization at a time, so none overwrites another
+
+    def messages(self) -> List[dict]:
+        messages = [{"role": "system", "content": f"Earlier in this conversation: {self.summary}"}] if self.summary else []
+        messages.extend({"role": role, "content": content} for role, content, _ in self.turns)
+        return messages
+
+
+class SessionStore:
+    """
+    In-memory, session-keyed chat history.
+
+    Each session keeps only the most recent turns that fit in `window_tokens`;
+    turns that fall out of the window are passed to `summarizer` (if given) to
+    update the session's rolling summary, otherwise dropped. The summarizer runs
+    on a background worker so a request never waits on its LLM call; the next
+    turn sees the summary once it is ready. Sessions idle for
+    `idle_seconds` are evicted, and at most `max_sessions` are kept (least
+    recently used first out).
+
+    Args:
+        window_tokens (int): Token budget for the turns kept per session
+        max_sessions (int): Upper bound on live sessions
+        idle_seconds (float): Idle time after which a session is evicted
+        summarizer (callable, optional): (previous_summary, dropped_messages) -> new summary
+        background (bool): Summarize on a worker thread (False = in the calling thread)
+    """
+
+    def __init__(self, window_tokens: int = 2000, max_sessions: int = 1000, idle_seconds: float = 3600,
+                 summarizer: Optional[Callable[[str, List[dict]], str]] = None, background: bool = True):
+        self.window_tokens = window_tokens
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.summarizer = summarizer
+        self.evicted = 0
+        self.summaries = 0
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._summary_pool = ThreadPoolExecutor(1, thread_name_prefix="history-summary") if background else None
+
+    def _evict(self, now: float) -> None:
+        # Sessions are kept in last-used order, so idle ones are at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.idle_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    def _session(self, session_id: str) -> ChatSession:
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = ChatSession()
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_seen = now
+        self._evict(now)
+        return session
+
+    def add(self, session_id: str, role: str, content: str) -> None:
+        """Append a turn ("user" or "assistant") and trim the session to its token budget."""
+        dropped = []
+        with self._lock:
+            session = self._session(session_id)
+            tokens = estimate_tokens(content)
+            session.turns.append((role, content, tokens))
+            session.tokens += tokens
+            # Always keep the newest turn, even if it alone exceeds the budget
+            while session.tokens > self.window_tokens and len(session.turns) > 1:
+                old_role, old_content, old_tokens = session.turns.popleft()
+                session.tokens -= old_tokens
+                dropped.append({"role": old_role, "content": old_content})
+        if dropped and self.summarizer:
+            if self._summary_pool:
+                self._summary_pool.submit(self._summarize, session, dropped)
+            else:
+                self._summarize(session, dropped)
+
+    def _summarize(self, session: ChatSession, dropped: List[dict]) -> None:
+        # Outside the store lock (it calls the LLM) but one at a time per session, each
+        # folding its turns into the summary the previous one wrote
+        with session.summary_lock:
+            with self._lock:
+                summary = session.summary
+            try:
+                summary = self.summarizer(summary, dropped)
+            except Exception as e:
+                print(f"History summary failed: {e}")
+                return
+            with self._lock:
+                session.summary = summary
+                self.summaries += 1
+
+    def messages(self, session_id: str) -> List[dict]:
+        """Conversation window for a session as [{"role", "content"}] (summary first, if any)."""
+        with self._lock:
+            return self._session(session_id).messages()
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        """Live sessions, retained turns/tokens and approximate bytes held."""
+        with self._lock:
+            self._evict(time.monotonic())
+            sessions = list(self._sessions.values())
+            return {
+                "sessions": len(sessions),
+                "turns": sum(len(session.turns) for session in sessions),
+                "tokens": sum(session.tokens for session in sessions),
+                "bytes": sum(len(session.summary) + sum(len(content) for _, content, _ in session.turns)
+                             for session in sessions),
+                "evicted": self.evicted,
+                "summaries": self.summaries,
+                "window_tokens": self.window_tokens,
+            }
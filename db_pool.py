@@ -0,0 +1,61 @@
+"""
+AskOGMS database connection pool.
+One SQLAlchemy engine per process, shared by query execution, the schema API and
+the table viewer, so requests reuse open connections instead of paying TCP/TLS
+and authentication on every hit.
+"""
+import os
+
+
+def pool_options() -> dict:
+    """
+    Engine pool keyword arguments from the DB_POOL_* settings.
+
+    Returns:
+        dict: pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping
+    """
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_POOL_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        # Cloud SQL / proxies drop idle connections; recycle before they do
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+
+def create_pooled_engine(database_uri: str):
+    """
+    Create the shared SQLAlchemy engine with a QueuePool sized from the environment.
+
+    SQLite file databases get the same pool; in-memory SQLite keeps SQLAlchemy's
+    default single-connection pool (a second connection would see an empty database).
+
+    Args:
+        database_uri (str): SQLAlchemy URI
+
+    Returns:
+        sqlalchemy.engine.Engine
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import QueuePool
+
+    if database_uri in ("sqlite://", "sqlite:///:memory:"):
+        return create_engine(database_uri)
+    options = pool_options()
+    if database_uri.startswith("sqlite"):
+        # Pooled SQLite connections are handed between request threads
+        options["connect_args"] = {"check_same_thread": False}
+    return create_engine(database_uri, poolclass=QueuePool, **options)
+
+
+def pool_stats(sql_engine) -> dict:
+    """Current pool usage: configured size, checked in/out connections and overflow."""
+    pool = sql_engine.pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    stats["status"] = pool.status()
+    return stats
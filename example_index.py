@@ -0,0 +1,86 @@
+"""
+AskOGMS few-shot example index.
+Keeps question -> SQL examples in a persistent local Chroma collection so each
+SQL-generation prompt carries only the k most similar examples.
+"""
+import hashlib
+import json
+import os
+from typing import List
+
+from local_embeddings import HashingEmbeddings
+
+
+def load_examples(base_examples: List[dict], path: str = None) -> List[dict]:
+    """
+    Combine FEW_SHOT_EXAMPLES with curated examples from a JSON / JSON Lines file.
+
+    Args:
+        base_examples (list): Examples from prompts_config
+        path (str, optional): File of {"input": ..., "query": ...} objects
+
+    Returns:
+        List[dict]: De-duplicated examples (first occurrence wins)
+    """
+    examples = list(base_examples)
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            content = f.read().strip()
+        if content.startswith("["):
+            examples.extend(json.loads(content))
+        else:
+            examples.extend(json.loads(line) for line in content.splitlines() if line.strip())
+    unique = {}
+    for example in examples:
+        unique.setdefault((example["input"], example["query"]), {"input": example["input"], "query": example["query"]})
+    return list(unique.values())
+
+
+def _example_id(example: dict) -> str:
+    return hashlib.sha1(f"{example['input']}\x00{example['query']}".encode("utf-8")).hexdigest()
+
+
+def embeddings_from_name(name: str):
+    """Embedding function for the index: hashing (offline, default) or google."""
+    if (name or "hashing").lower() == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004"))
+    return HashingEmbeddings()
+
+
+def build_example_selector(examples: List[dict], embeddings, persist_directory: str, k: int = 4,
+                           collection_name: str = "askdb_examples"):
+    """
+    Open (or create) the persistent example collection and sync it with `examples`.
+
+    Only examples that are new since the last run are embedded; removed ones are
+    deleted, so restarts cost one id lookup instead of re-embedding everything.
+
+    Returns:
+        SemanticSimilarityExampleSelector
+    """
+    import chromadb
+    from langchain_chroma import Chroma
+    from langchain_core.example_selectors import SemanticSimilarityExampleSelector
+
+    vectorstore = Chroma(
+        collection_name=collection_name,
+        embedding_function=embeddings,
+        persist_directory=persist_directory,
+        client_settings=chromadb.config.Settings(anonymized_telemetry=False, is_persistent=True,
+                                                 persist_directory=persist_directory),
+    )
+    wanted = {_example_id(example): example for example in examples}
+    existing = set(vectorstore.get(include=[])["ids"])
+    new_ids = [example_id for example_id in wanted if example_id not in existing]
+    stale_ids = [example_id for example_id in existing if example_id not in wanted]
+    if stale_ids:
+        vectorstore.delete(ids=stale_ids)
+    if new_ids:
+        vectorstore.add_texts(
+            texts=[wanted[example_id]["input"] for example_id in new_ids],
+            metadatas=[wanted[example_id] for example_id in new_ids],
+            ids=new_ids,
+        )
+    print(f"Example index: {len(wanted)} examples ({len(new_ids)} embedded, {len(stale_ids)} removed)")
+    return SemanticSimilarityExampleSelector(vectorstore=vectorstore, k=k, input_keys=["input"])
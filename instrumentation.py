@@ -0,0 +1,347 @@
+"""
+AskOGMS pipeline instrumentation.
+Records a trace of timed spans per question (table selection, SQL generation,
+cleaning, execution, corrections, answer) with token, row and cache attributes,
+aggregates them into Prometheus-style metrics, and optionally writes each trace
+as a JSON log line. Works without LangSmith or any network service.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Histogram bucket upper bounds (seconds)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Recent durations kept per stage for percentile estimates
+RESERVOIR_SIZE = 1000
+
+_current_trace = contextvars.ContextVar("askogms_trace", default=None)
+_current_span = contextvars.ContextVar("askogms_span", default=None)
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count", "recent")
+
+    def __init__(self):
+        self.counts = [0] * len(DURATION_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds: float) -> None:
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+
+class Metrics:
+    """Process-wide aggregates of finished spans and traces."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages = defaultdict(_Histogram)
+            self.requests = _Histogram()
+            self.errors = defaultdict(int)
+            self.tokens = defaultdict(int)  # (stage, "prompt" | "completion") -> count
+            self.cache = defaultdict(int)  # (stage, "hit" | "miss") -> count
+            self.rows = defaultdict(int)
+            self.speculation = defaultdict(int)  # "hit" | "miss" -> count
+            self.llm_waits = defaultdict(_Histogram)  # priority -> LLM scheduler queue wait
+            self.llm_queue = defaultdict(int)  # (priority, "granted" | "timeout") -> count
+            self.llm_queue_depth = defaultdict(int)  # priority -> calls waiting now
+            self.llm_throttled = 0  # 429 / RESOURCE_EXHAUSTED responses
+            self.model_choices = defaultdict(int)  # (stage, model) -> calls routed there
+            self.escalations = defaultdict(int)  # (stage, reason) -> escalations to the strong model
+            self.prompt_builds = defaultdict(int)  # prompt -> prompts rendered
+            self.prompt_tokens = defaultdict(int)  # (prompt, section) -> estimated tokens
+            self.prompt_compactions = defaultdict(int)  # (prompt, action) -> prompts trimmed that way
+
+    def observe_span(self, span: dict) -> None:
+        stage, attrs = span["name"], span["attrs"]
+        with self._lock:
+            self.stages[stage].observe(span["duration_ms"] / 1000)
+            if attrs.get("error"):
+                self.errors[stage] += 1
+            for kind in ("prompt", "completion"):
+                if attrs.get(f"{kind}_tokens"):
+                    self.tokens[(stage, kind)] += attrs[f"{kind}_tokens"]
+            if "hit" in attrs:
+                self.cache[(stage, "hit" if attrs["hit"] else "miss")] += 1
+            if attrs.get("rows"):
+                self.rows[stage] += attrs["rows"]
+            if "speculation_hit" in attrs:
+                self.speculation["hit" if attrs["speculation_hit"] else "miss"] += 1
+
+    def observe_request(self, seconds: float) -> None:
+        with self._lock:
+            self.requests.observe(seconds)
+
+    def observe_llm_wait(self, priority: str, seconds: float, outcome: str) -> None:
+        """One LLM call leaving the scheduler queue ("granted" or "timeout") after `seconds`."""
+        with self._lock:
+            self.llm_waits[priority].observe(seconds)
+            self.llm_queue[(priority, outcome)] += 1
+
+    def set_llm_queue_depth(self, priority: str, depth: int) -> None:
+        with self._lock:
+            self.llm_queue_depth[priority] = depth
+
+    def observe_llm_throttle(self) -> None:
+        with self._lock:
+            self.llm_throttled += 1
+
+    def observe_model_choice(self, stage: str, model: str, escalation: Optional[str] = None) -> None:
+        """One model-tier decision; `escalation` is the reason when it went to the strong model."""
+        with self._lock:
+            self.model_choices[(stage, model)] += 1
+            if escalation:
+                self.escalations[(stage, escalation)] += 1
+
+    def observe_prompt(self, prompt: str, sections: dict, compactions=()) -> None:
+        """One rendered prompt: estimated tokens per section and the budget compactions applied."""
+        with self._lock:
+            self.prompt_builds[prompt] += 1
+            for section, tokens in sections.items():
+                self.prompt_tokens[(prompt, section)] += tokens
+            for action in compactions:
+                self.prompt_compactions[(prompt, action)] += 1
+
+    def snapshot(self) -> dict:
+        """Per-stage count, mean, p50/p95/p99 (ms) over recent spans, plus token totals, speculation hit rate,
+        LLM queue waits per priority, model escalation rates and mean prompt tokens per section."""
+        with self._lock:
+            def summary(histogram):
+                if not histogram.count:
+                    return {"count": 0}
+                recent = list(histogram.recent)
+                return {
+                    "count": histogram.count,
+                    "mean_ms": round(histogram.total / histogram.count * 1000, 2),
+                    "p50_ms": round(_percentile(recent, 0.50) * 1000, 2),
+                    "p95_ms": round(_percentile(recent, 0.95) * 1000, 2),
+                    "p99_ms": round(_percentile(recent, 0.99) * 1000, 2),
+                }
+            stages = {stage: summary(histogram) for stage, histogram in self.stages.items()}
+            for (stage, kind), count in self.tokens.items():
+                stages[stage][f"{kind}_tokens"] = count
+            speculations = self.speculation["hit"] + self.speculation["miss"]
+            speculation = {"hits": self.speculation["hit"], "misses": self.speculation["miss"],
+                           "hit_rate": round(self.speculation["hit"] / speculations, 4) if speculations else 0.0}
+            llm_queue = {priority: {**summary(histogram), "waiting": self.llm_queue_depth[priority],
+                                    "timeouts": self.llm_queue[(priority, "timeout")]}
+                         for priority, histogram in self.llm_waits.items()}
+            escalation = {}
+            for (stage, _), count in self.model_choices.items():
+                escalation.setdefault(stage, {"decisions": 0, "escalated": 0})["decisions"] += count
+            for (stage, _), count in self.escalations.items():
+                escalation[stage]["escalated"] += count
+            for counts in escalation.values():
+                counts["rate"] = round(counts["escalated"] / counts["decisions"], 4)
+            prompts = {prompt: {"builds": builds, "mean_tokens": {}, "compactions": {}}
+                       for prompt, builds in self.prompt_builds.items()}
+            for (prompt, section), tokens in self.prompt_tokens.items():
+                prompts[prompt]["mean_tokens"][section] = round(tokens / self.prompt_builds[prompt], 1)
+            for (prompt, action), count in self.prompt_compactions.items():
+                prompts[prompt]["compactions"][action] = count
+            return {"requests": summary(self.requests), "stages": stages, "speculation": speculation,
+                    "llm_queue": llm_queue, "llm_throttled": self.llm_throttled, "escalation": escalation,
+                    "prompts": prompts}
+
+    def render_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def label_text(labels: dict) -> str:
+            return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}" if labels else ""
+
+        def histogram(name, help_text, series):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in series:
+                for bound, count in zip(DURATION_BUCKETS, hist.counts):
+                    lines.append(f"{name}_bucket{label_text({**labels, 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{label_text({**labels, 'le': '+Inf'})} {hist.count}")
+                lines.append(f"{name}_sum{label_text(labels)} {hist.total:.6f}")
+                lines.append(f"{name}_count{label_text(labels)} {hist.count}")
+
+        def counter(name, help_text, series, kind="counter"):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                lines.append(f"{name}{label_text(labels)} {value}")
+
+        with self._lock:
+            histogram("askogms_request_duration_seconds", "End-to-end question latency.", [({}, self.requests)])
+            histogram("askogms_stage_duration_seconds", "Pipeline stage latency.",
+                      [({"stage": stage}, hist) for stage, hist in sorted(self.stages.items())])
+            counter("askogms_llm_tokens_total", "LLM tokens by stage and kind.",
+                    [({"stage": stage, "kind": kind}, count) for (stage, kind), count in sorted(self.tokens.items())])
+            counter("askogms_cache_lookups_total", "Cache lookups by stage and result.",
+                    [({"stage": stage, "result": result}, count) for (stage, result), count in sorted(self.cache.items())])
+            counter("askogms_stage_errors_total", "Failed stage executions.",
+                    [({"stage": stage}, count) for stage, count in sorted(self.errors.items())])
+            counter("askogms_rows_total", "Rows returned by stage.",
+                    [({"stage": stage}, count) for stage, count in sorted(self.rows.items())])
+            counter("askogms_speculation_total", "Speculative SQL generations by outcome (kept or regenerated).",
+                    [({"result": result}, count) for result, count in sorted(self.speculation.items())])
+            histogram("askogms_llm_queue_wait_seconds", "Time LLM calls waited in the scheduler queue.",
+                      [({"priority": priority}, hist) for priority, hist in sorted(self.llm_waits.items())])
+            counter("askogms_llm_queue_total", "LLM calls leaving the scheduler queue by priority and outcome.",
+                    [({"priority": priority, "outcome": outcome}, count)
+                     for (priority, outcome), count in sorted(self.llm_queue.items())])
+            counter("askogms_llm_queue_depth", "LLM calls currently waiting in the scheduler queue.",
+                    [({"priority": priority}, depth) for priority, depth in sorted(self.llm_queue_depth.items())],
+                    kind="gauge")
+            counter("askogms_llm_throttled_total", "LLM calls rejected with 429 / RESOURCE_EXHAUSTED.",
+                    [({}, self.llm_throttled)])
+            counter("askogms_llm_model_choices_total", "Model-tier decisions by stage and model.",
+                    [({"stage": stage, "model": model}, count) for (stage, model), count in sorted(self.model_choices.items())])
+            counter("askogms_llm_escalations_total", "Escalations to the strong model by stage and reason.",
+                    [({"stage": stage, "reason": reason}, count) for (stage, reason), count in sorted(self.escalations.items())])
+            counter("askogms_prompt_builds_total", "Prompts rendered by the prompt budget.",
+                    [({"prompt": prompt}, count) for prompt, count in sorted(self.prompt_builds.items())])
+            counter("askogms_prompt_tokens_total", "Estimated prompt tokens by prompt and section.",
+                    [({"prompt": prompt, "section": section}, count)
+                     for (prompt, section), count in sorted(self.prompt_tokens.items())])
+            counter("askogms_prompt_compactions_total", "Prompts trimmed to fit their token budget, by action.",
+                    [({"prompt": prompt, "action": action}, count)
+                     for (prompt, action), count in sorted(self.prompt_compactions.items())])
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class _TraceLog:
+    """Writes finished traces as JSON lines to stdout or a file (TRACE_LOG)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        target = os.getenv("TRACE_LOG", "").strip()
+        if not target or target.lower() == "off":
+            return
+        line = json.dumps(record, default=str)
+        if target.lower() == "stdout":
+            print(line)
+            return
+        with self._lock, open(target, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+_trace_log = _TraceLog()
+
+
+@contextmanager
+def trace(operation: str, question: str = ""):
+    """
+    Collect spans for one question. Nested calls join the outer trace.
+
+    Yields:
+        dict: The trace record (request_id, operation, spans, ...)
+    """
+    if _current_trace.get() is not None:
+        yield _current_trace.get()
+        return
+    record = {"request_id": uuid.uuid4().hex[:12], "operation": operation, "question": question[:200], "spans": []}
+    token = _current_trace.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = str(e)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        record["duration_ms"] = round(seconds * 1000, 2)
+        _current_trace.reset(token)
+        metrics.observe_request(seconds)
+        _trace_log.write(record)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time one pipeline stage. Attributes can be added to the yielded dict's
+    "attrs" (rows, hit, attempt, ...); LLM token usage is attached automatically.
+    """
+    parent = _current_span.get()
+    record = {"name": name, "parent": parent["name"] if parent else None, "attrs": dict(attrs)}
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["attrs"]["error"] = str(e)
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        _current_span.reset(token)
+        current = _current_trace.get()
+        if current is not None:
+            current["spans"].append(record)
+        metrics.observe_span(record)
+
+
+def annotate(**attrs) -> None:
+    """Set attributes (rows, hit, direct, ...) on the innermost open span."""
+    current: Optional[dict] = _current_span.get()
+    if current is not None:
+        current["attrs"].update(attrs)
+
+
+def record_tokens(prompt_tokens: int, completion_tokens: int) -> None:
+    """Add LLM token usage to the innermost open span."""
+    current: Optional[dict] = _current_span.get()
+    if current is None:
+        return
+    attrs = current["attrs"]
+    attrs["prompt_tokens"] = attrs.get("prompt_tokens", 0) + prompt_tokens
+    attrs["completion_tokens"] = attrs.get("completion_tokens", 0) + completion_tokens
+    attrs["llm_calls"] = attrs.get("llm_calls", 0) + 1
+
+
+def record_queue_wait(seconds: float) -> None:
+    """Add LLM scheduler queue time to the innermost open span."""
+    current: Optional[dict] = _current_span.get()
+    if current is not None:
+        current["attrs"]["queue_wait_ms"] = round(current["attrs"].get("queue_wait_ms", 0) + seconds * 1000, 2)
+
+
+def response_usage(response) -> Tuple[int, int]:
+    """(prompt, completion) tokens from an LLMResult's usage_metadata."""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt_tokens += usage.get("input_tokens", 0)
+            completion_tokens += usage.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """LangChain callback that attributes each LLM call's usage_metadata to the current span."""
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        record_tokens(*response_usage(response))
+
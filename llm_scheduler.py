@@ -0,0 +1,272 @@
+"""
+AskOGMS LLM scheduler.
+One token-bucket limiter in front of the shared Gemini client, plugged in as the
+chat model's rate_limiter so every stage (table selection, SQL generation,
+correction, answer) goes through it. Requests and tokens per minute are budgeted
+centrally, waiting calls are granted strictly by priority class (interactive
+before correction retries before batch jobs), each class has a queue deadline,
+and a 429 pauses all calls instead of letting each caller retry on its own.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from instrumentation import metrics, record_queue_wait, response_usage
+
+# Highest priority first
+PRIORITIES = ("interactive", "correction", "batch")
+_RANK = {name: rank for rank, name in enumerate(PRIORITIES)}
+
+# Seconds a call may wait in the queue before LLMQueueTimeout (0 = no deadline)
+DEFAULT_DEADLINES = {"interactive": 30.0, "correction": 30.0, "batch": 600.0}
+
+# Bucket capacity: this many seconds of budget can be spent in one burst
+_BURST_SECONDS = 10.0
+
+# Async waiters are not woken by the condition variable; they re-check this often
+_ASYNC_POLL_SECONDS = 0.02
+
+_priority = contextvars.ContextVar("askogms_llm_priority", default="interactive")
+
+
+class LLMQueueTimeout(Exception):
+    """Raised when an LLM call waited in the queue past its priority class's deadline."""
+
+
+@contextmanager
+def llm_priority(name: str):
+    """
+    Run LLM calls in this block at `name`, or at the current class if that is lower
+    (a batch job's correction retries stay batch).
+    """
+    current = _priority.get()
+    token = _priority.set(name if _RANK[name] > _RANK[current] else current)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_throttled(error: BaseException) -> bool:
+    """Whether an LLM error is a rate-limit rejection (HTTP 429 / RESOURCE_EXHAUSTED)."""
+    text = f"{type(error).__name__} {error}"
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "ResourceExhausted" in text
+
+
+class _Bucket:
+    """Token bucket refilled continuously; token charges made after a call may put it in debt."""
+
+    __slots__ = ("rate", "capacity", "level", "updated")
+
+    def __init__(self, per_minute: float, now: float):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * _BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it already is)."""
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class _UsageCallback(BaseCallbackHandler):
+    """Charges each call's token usage to the scheduler and reports 429s."""
+
+    def __init__(self, scheduler: "LLMScheduler"):
+        self.scheduler = scheduler
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        self.scheduler.charge(sum(response_usage(response)))
+
+    def on_llm_error(self, error, **kwargs) -> None:
+        if is_throttled(error):
+            self.scheduler.throttle()
+
+
+class LLMScheduler(BaseRateLimiter):
+    """
+    Priority queue with request and token budgets for one LLM client.
+
+    A call starts when it is first in line (by priority class, then arrival) and
+    both buckets have budget left. Token usage is only known afterwards, so it is
+    charged when the call ends (via `callback`); a long answer can put the token
+    bucket in debt, which delays the next calls. Pass the scheduler as the chat
+    model's `rate_limiter` and `callback` in its callbacks; choose a call's
+    class with llm_priority().
+
+    Args:
+        requests_per_minute (float): Request budget (0 = unlimited)
+        tokens_per_minute (float): Prompt + completion token budget (0 = unlimited)
+        deadlines (Dict[str, float], optional): Max queue wait per priority class (0 = none)
+        throttle_backoff (float): Seconds all calls are held after a 429
+        clock (callable): Monotonic time source in seconds (tests pass a fake one)
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 deadlines: Optional[Dict[str, float]] = None, throttle_backoff: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.requests = _Bucket(requests_per_minute, clock()) if requests_per_minute else None
+        self.tokens = _Bucket(tokens_per_minute, clock()) if tokens_per_minute else None
+        self.deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+        self.throttle_backoff = throttle_backoff
+        self.callback = _UsageCallback(self)
+        self.granted = defaultdict(int)
+        self.timeouts = defaultdict(int)
+        self.throttled = 0
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (rank, arrival) tickets
+        self._depth = defaultdict(int)
+        self._arrivals = itertools.count()
+        self._paused_until = 0.0
+
+    @property
+    def limited(self) -> bool:
+        """Whether any request or token budget is configured."""
+        return self.requests is not None or self.tokens is not None
+
+    def charge(self, tokens: int) -> None:
+        """Take a finished call's token usage out of the token budget."""
+        if self.tokens is None or not tokens:
+            return
+        with self._cond:
+            self.tokens.refill(self._clock())
+            self.tokens.level -= tokens
+
+    def throttle(self) -> None:
+        """Hold every call for throttle_backoff seconds after the API rejected one."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, self._clock() + self.throttle_backoff)
+            self.throttled += 1
+        metrics.observe_llm_throttle()
+        print(f"LLM rate limited (429); holding calls for {self.throttle_backoff:.0f}s")
+
+    def _enqueue(self, priority: str) -> tuple:
+        ticket = (_RANK[priority], next(self._arrivals))
+        heapq.heappush(self._waiting, ticket)
+        self._depth[priority] += 1
+        metrics.set_llm_queue_depth(priority, self._depth[priority])
+        return ticket
+
+    def _leave(self, ticket: tuple, priority: str) -> None:
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._depth[priority] -= 1
+            metrics.set_llm_queue_depth(priority, self._depth[priority])
+            self._cond.notify_all()
+
+    def _poll(self, ticket: tuple, priority: str, enqueued: float, blocking: bool):
+        """
+        One scheduling decision (caller holds the lock).
+
+        Returns:
+            True if the call may start, False if not and blocking is off, else the
+            seconds to wait before asking again
+
+        Raises:
+            LLMQueueTimeout: If the priority class's deadline has passed
+        """
+        now = self._clock()
+        ready_in = None  # Not first in line: wait to be woken
+        if self._waiting[0] == ticket:
+            ready_in = max(0.0, self._paused_until - now)
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+                    ready_in = max(ready_in, bucket.wait_for(1))
+        if ready_in == 0:
+            if self.requests is not None:
+                self.requests.level -= 1
+            self._leave(ticket, priority)
+            self.granted[priority] += 1
+            metrics.observe_llm_wait(priority, now - enqueued, "granted")
+            record_queue_wait(now - enqueued)
+            return True
+        if not blocking:
+            return False
+        deadline = self.deadlines.get(priority) or float("inf")
+        remaining = enqueued + deadline - now
+        if remaining <= 0:
+            self.timeouts[priority] += 1
+            metrics.observe_llm_wait(priority, now - enqueued, "timeout")
+            raise LLMQueueTimeout(f"LLM call timed out after {deadline:g}s in the {priority} queue "
+                                  f"(rate limit reached); try again shortly")
+        return min(remaining, ready_in if ready_in is not None else remaining)
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        """Wait for this call's turn and budget (called by the chat model before each request)."""
+        priority, enqueued = _priority.get(), self._clock()
+        with self._cond:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    outcome = self._poll(ticket, priority, enqueued, blocking)
+                    if isinstance(outcome, bool):
+                        return outcome
+                    self._cond.wait(None if outcome == float("inf") else outcome)
+            finally:
+                self._leave(ticket, priority)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        """Async acquire: polls instead of blocking the event loop."""
+        priority, enqueued = _priority.get(), self._clock()
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    outcome = self._poll(ticket, priority, enqueued, blocking)
+                if isinstance(outcome, bool):
+                    return outcome
+                await asyncio.sleep(min(outcome, _ASYNC_POLL_SECONDS))
+        finally:
+            with self._cond:
+                self._leave(ticket, priority)
+
+    def stats(self) -> dict:
+        """Limits, remaining budget, queue depth and grant/timeout counts per priority class."""
+        with self._cond:
+            now = self._clock()
+            budget = {}
+            for name, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    budget[name] = {"per_minute": round(bucket.rate * 60, 2), "available": round(bucket.level, 2)}
+            return {
+                "enabled": True,
+                "budget": budget,
+                "paused_seconds": round(max(0.0, self._paused_until - now), 2),
+                "throttled": self.throttled,
+                "priorities": {priority: {"waiting": self._depth[priority], "granted": self.granted[priority],
+                                          "timeouts": self.timeouts[priority],
+                                          "deadline_seconds": self.deadlines.get(priority)}
+                               for priority in PRIORITIES},
+            }
+
+
+def scheduler_from_env() -> Optional[LLMScheduler]:
+    """Scheduler from LLM_SCHEDULER, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_QUEUE_DEADLINE_*, LLM_THROTTLE_BACKOFF."""
+    if os.getenv("LLM_SCHEDULER", "true").lower() != "true":
+        return None
+    return LLMScheduler(
+        requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+        tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+        deadlines={priority: float(os.getenv(f"LLM_QUEUE_DEADLINE_{priority.upper()}", str(seconds)))
+                   for priority, seconds in DEFAULT_DEADLINES.items()},
+        throttle_backoff=float(os.getenv("LLM_THROTTLE_BACKOFF", "5")),
+    )
@@ -0,0 +1,72 @@
+"""
+AskOGMS local embeddings.
+Deterministic, offline text vectors so retrieval (table selection, few-shot
+examples) works without calling the Gemini embeddings API.
+"""
+import hashlib
+import math
+import re
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text and SQL identifiers into lowercase word tokens.
+
+    snake_case and camelCase are split ("student_programs" -> student, program),
+    and a trailing plural "s" is dropped so "advisors" matches "advisor".
+
+    Args:
+        text (str): Free text, table or column names
+
+    Returns:
+        List[str]: Tokens
+    """
+    text = _CAMEL_BOUNDARY.sub(" ", text or "").lower()
+    tokens = []
+    for token in _NON_WORD.split(text):
+        if not token:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Feature-hashed bag of words (unigrams + bigrams), L2-normalized.
+
+    No fitting step and a fixed dimension, so vectors stay compatible as the
+    corpus grows and can live in any vector store.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def _bucket(self, feature: str):
+        digest = hashlib.md5(feature.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % self.dimensions
+        sign = 1.0 if digest[4] & 1 else -1.0
+        return index, sign
+
+    def _embed(self, text: str) -> List[float]:
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = [0.0] * self.dimensions
+        for feature in features:
+            index, sign = self._bucket(feature)
+            vector[index] += sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
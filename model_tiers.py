@@ -0,0 +1,149 @@
+"""
+AskOGMS model tiers.
+Chooses the Gemini model per pipeline stage: a fast model for table selection
+and answer rephrasing, the default model for SQL generation, and a stronger
+model only when a question looks hard or a generated query failed to execute.
+Every escalation decision is counted so the escalation rate can be watched.
+"""
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+from instrumentation import metrics
+
+# Stages with their own model setting (GEMINI_MODEL_<SUFFIX>); unset stages use GEMINI_MODEL
+STAGES = {"table_selection": "TABLES", "sql_generation": "SQL", "correction": "CORRECTION", "answer": "ANSWER"}
+
+# Markers of SQL that needs more than joins and a GROUP BY: window functions, correlated
+# subqueries / anti-joins, period comparisons and ratios of two aggregates. Each matching
+# group adds one point; everyday words ("by", "per", "not", "top") deliberately do not count.
+_DIFFICULTY_SIGNALS = {
+    "window": re.compile(r"\b(?:running total|cumulative|moving average|rolling \w+|percentile|median"
+                         r"|(?:year|month|week|quarter) over (?:year|month|week|quarter)"
+                         r"|rank(?:ed|ing)? (?:within|in each|for each)"
+                         r"|(?:top|bottom) \d+ [\w ]+? (?:per|in each|for each|within each|within every) \w+)\b"),
+    "subquery": re.compile(r"\b(?:(?:above|below|more than|less than|higher than|lower than|greater than) "
+                           r"(?:the )?(?:overall |company |team )?(?:average|mean|median)"
+                           r"|never|have not|has not|haven't|hasn't|did not|didn't|without any|not in any)\b"),
+    "comparison": re.compile(r"\b(?:compared? (?:to|with)|versus|vs\.?|difference between)\b"),
+    "change": re.compile(r"\b(?:trend|growth|change|increase|decrease) (?:in|of|from|since|between)\b"),
+    "ratio": re.compile(r"\b(?:ratio|percentage of|percent of|proportion of|share of|conversion rate)\b"),
+    "multi_metric": re.compile(r"\b(?:average|avg|mean|median|sum|total|count|number of)\b.+\b(?:and|with)\b"
+                               r".+\b(?:average|avg|mean|median|sum|total|count|number of)\b"),
+}
+# Questions at least this long (words) get one more point
+_LONG_QUESTION_WORDS = 25
+
+
+def question_difficulty(question: str) -> Tuple[int, List[str]]:
+    """
+    Score how hard a question is likely to be for SQL generation.
+
+    Args:
+        question (str): The user's question
+
+    Returns:
+        (int, List[str]): Score and the signals that matched
+    """
+    text = question.lower()
+    signals = [name for name, pattern in _DIFFICULTY_SIGNALS.items() if pattern.search(text)]
+    if len(text.split()) >= _LONG_QUESTION_WORDS:
+        signals.append("long")
+    return len(signals), signals
+
+
+class ModelTiers:
+    """
+    Per-stage model names and the escalation policy.
+
+    Args:
+        default_model (str): Model for stages without their own setting
+        stage_models (dict, optional): {stage: model} overrides (keys from STAGES)
+        strong_model (str, optional): Escalation target; no escalation when unset
+        escalate_hard (bool): Generate SQL with the strong model for hard questions
+        escalate_on_failure (bool): Correct failed SQL with the strong model
+        hard_score (int): question_difficulty score (plus one when routed to LLM
+            table selection) from which a question counts as hard
+    """
+
+    def __init__(self, default_model: str, stage_models: Optional[dict] = None, strong_model: Optional[str] = None,
+                 escalate_hard: bool = True, escalate_on_failure: bool = True, hard_score: int = 2):
+        self.default_model = default_model
+        self.stage_models = {stage: model for stage, model in (stage_models or {}).items() if model}
+        self.strong_model = strong_model or None
+        self.escalate_hard = escalate_hard
+        self.escalate_on_failure = escalate_on_failure
+        self.hard_score = hard_score
+        self._lock = threading.Lock()
+        self._decisions = defaultdict(int)  # stage -> decisions
+        self._escalations = defaultdict(int)  # (stage, reason) -> count
+
+    @classmethod
+    def from_env(cls, default_model: str) -> "ModelTiers":
+        """Tiers from GEMINI_MODEL_<STAGE>, GEMINI_MODEL_STRONG and ESCALATE_* settings."""
+        return cls(
+            default_model,
+            stage_models={stage: os.getenv(f"GEMINI_MODEL_{suffix}", "").strip() for stage, suffix in STAGES.items()},
+            strong_model=os.getenv("GEMINI_MODEL_STRONG", "").strip(),
+            escalate_hard=os.getenv("ESCALATE_HARD_QUESTIONS", "true").lower() == "true",
+            escalate_on_failure=os.getenv("ESCALATE_ON_FAILURE", "true").lower() == "true",
+            hard_score=int(os.getenv("ESCALATE_HARD_SCORE", "2")),
+        )
+
+    def model_for(self, stage: str) -> str:
+        """Configured model for a stage (GEMINI_MODEL when the stage has no override)."""
+        return self.stage_models.get(stage, self.default_model)
+
+    def models(self) -> List[str]:
+        """Every model name the tiers can hand out."""
+        names = [self.default_model, *self.stage_models.values(), self.strong_model]
+        return list(dict.fromkeys(name for name in names if name))
+
+    def _decide(self, stage: str, reason: Optional[str]) -> Tuple[str, Optional[str]]:
+        escalate = reason is not None and self.strong_model is not None
+        model = self.strong_model if escalate else self.model_for(stage)
+        with self._lock:
+            self._decisions[stage] += 1
+            if escalate:
+                self._escalations[(stage, reason)] += 1
+        metrics.observe_model_choice(stage, model, reason if escalate else None)
+        if escalate:
+            print(f"Escalating {stage} to {model} ({reason})")
+        return model, reason if escalate else None
+
+    def sql_model(self, question: str, llm_routed: bool = False) -> Tuple[str, Optional[str]]:
+        """
+        Model for SQL generation.
+
+        Args:
+            question (str): The user's question
+            llm_routed (bool): The router sent the question to LLM table selection
+                (the local index was unsure), which counts as one difficulty point
+
+        Returns:
+            (str, str | None): Model name and the escalation reason ("hard_question") or None
+        """
+        score, _ = question_difficulty(question)
+        hard = self.escalate_hard and score + int(llm_routed) >= self.hard_score
+        return self._decide("sql_generation", "hard_question" if hard else None)
+
+    def correction_model(self) -> Tuple[str, Optional[str]]:
+        """Model for correcting SQL that failed to execute ("failed_execution" escalation)."""
+        return self._decide("correction", "failed_execution" if self.escalate_on_failure else None)
+
+    def stats(self) -> dict:
+        """Models per stage and escalations per stage and reason, with the escalation rate."""
+        with self._lock:
+            escalation = {}
+            for stage, decisions in self._decisions.items():
+                reasons = {reason: count for (name, reason), count in self._escalations.items() if name == stage}
+                escalated = sum(reasons.values())
+                escalation[stage] = {"decisions": decisions, "escalated": escalated, "reasons": reasons,
+                                     "rate": round(escalated / decisions, 4) if decisions else 0.0}
+            return {
+                "models": {stage: self.model_for(stage) for stage in STAGES},
+                "strong_model": self.strong_model,
+                "escalation": escalation,
+            }
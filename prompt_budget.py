@@ -0,0 +1,354 @@
+"""
+AskOGMS prompt budget.
+Renders the variable sections of the table-selection and SQL-generation prompts
+(table descriptions, table info, few-shot examples, chat history) under token
+budgets, and logs and counts the estimated tokens each section takes. When the
+SQL prompt is over budget, sample rows are trimmed first, then columns the
+question does not use, then the least relevant tables.
+"""
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from chat_sessions import estimate_tokens
+from instrumentation import annotate, metrics
+from local_embeddings import tokenize
+
+# Columns kept when unused columns are pruned: identifiers and labels used for filters and joins
+DEFAULT_KEEP_COLUMNS = r"^geo_|(?:^|_)(?:id|code|fips|name)$"
+
+# Table info as rendered by SQLDatabase.get_table_info: CREATE TABLE plus an optional sample-row comment
+_CREATE_TABLE = re.compile(r'^CREATE TABLE\s+(?:\S+\.)?["`]?([^\s"`(]+)["`]?\s*\($')
+_CONSTRAINT = re.compile(r"^(?:PRIMARY KEY|FOREIGN KEY|UNIQUE|CONSTRAINT|CHECK)\b", re.IGNORECASE)
+_SAMPLE_HEADER = re.compile(r"^\d+ rows from .+ table:$")
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def render_table_details(descriptions: Dict[str, str]) -> str:
+    """The table-selection prompt's DATABASE TABLES section for {table_name: description}."""
+    return "".join(f"Table Name:{name}\nTable Description:{description}\n\n"
+                   for name, description in descriptions.items())
+
+
+class TableInfo:
+    """
+    One table's rendered info split into column lines, constraints and sample rows,
+    so it can be re-rendered with fewer rows or columns.
+    """
+
+    __slots__ = ("name", "text", "columns", "constraints", "sample_columns", "sample_rows")
+
+    def __init__(self, name: str, text: str, columns: List[Tuple[str, str]], constraints: List[str],
+                 sample_columns: List[str], sample_rows: List[str]):
+        self.name = name
+        self.text = text
+        self.columns = columns  # (column name, definition line)
+        self.constraints = constraints
+        self.sample_columns = sample_columns
+        self.sample_rows = sample_rows
+
+    @classmethod
+    def parse(cls, name: str, text: str) -> Optional["TableInfo"]:
+        """Split SQLDatabase's rendering; None if the text is not in that shape."""
+        body, _, sample = text.strip("\n").partition("\n\n/*\n")
+        lines = body.split("\n")
+        if len(lines) < 3 or not _CREATE_TABLE.match(lines[0]) or lines[-1] != ")":
+            return None
+        columns, constraints = [], []
+        for line in lines[1:-1]:
+            definition = line.strip().rstrip(",").rstrip()
+            if _CONSTRAINT.match(definition):
+                constraints.append(definition)
+            elif definition:
+                columns.append((definition.split()[0].strip('"`'), definition))
+        sample_columns, sample_rows = [], []
+        if sample:
+            sample_lines = sample.rstrip().removesuffix("*/").rstrip("\n").split("\n")
+            if not _SAMPLE_HEADER.match(sample_lines[0]) or len(sample_lines) < 2:
+                return None
+            sample_columns, sample_rows = sample_lines[1].split("\t"), sample_lines[2:]
+        return cls(name, text, columns, constraints, sample_columns, sample_rows)
+
+    def key_columns(self) -> set:
+        """Lower-cased columns named in PRIMARY KEY / FOREIGN KEY / UNIQUE constraints."""
+        return {word.lower() for constraint in self.constraints
+                for word in _IDENTIFIER.findall(constraint.split("REFERENCES")[0])}
+
+    def render(self, sample_rows: int, keep: Optional[set] = None) -> str:
+        """
+        Table info with at most `sample_rows` sample rows and, if `keep` is given,
+        only the columns whose lower-cased names are in it.
+        """
+        columns = self.columns if keep is None else [c for c in self.columns if c[0].lower() in keep]
+        items = [definition for _, definition in columns] + self.constraints
+        omitted = f"\n\t-- {len(self.columns) - len(columns)} more columns not shown" if len(columns) < len(self.columns) else ""
+        text = f"\n{self.create_line}\n\t" + ", \n\t".join(items) + omitted + "\n)"
+        rows = self.sample_rows[:sample_rows]
+        if rows:
+            indexes = [i for i, column in enumerate(self.sample_columns) if keep is None or column.lower() in keep]
+
+            def project(cells: List[str]) -> str:
+                return "\t".join(cells[i] for i in indexes if i < len(cells))
+
+            text += (f"\n\n/*\n{len(rows)} rows from {self.name} table:\n{project(self.sample_columns)}\n"
+                     + "\n".join(project(row.split("\t")) for row in rows) + "\n*/")
+        return text
+
+    @property
+    def create_line(self) -> str:
+        return self.text.strip("\n").split("\n", 1)[0]
+
+
+class PromptBudget:
+    """
+    Token budgets for the variable prompt sections. Tokens are estimated
+    (chat_sessions.estimate_tokens, ~4 characters each), so leave some headroom.
+
+    Args:
+        total (int): SQL-generation prompt, every section included (0 = unlimited)
+        table_info (int): Cap on the SQL prompt's table info (0 = whatever the total leaves)
+        examples (int): Few-shot examples in the SQL prompt (0 = unlimited)
+        descriptions (int): Table descriptions in the table-selection prompt (0 = unlimited)
+        history (int): Chat history in the SQL prompt (0 = none)
+        keep_columns (str): Regex of columns never pruned (case-insensitive)
+    """
+
+    def __init__(self, total: int = 0, table_info: int = 0, examples: int = 0, descriptions: int = 0,
+                 history: int = 0, keep_columns: str = DEFAULT_KEEP_COLUMNS):
+        self.total = total
+        self.table_info = table_info
+        self.examples = examples
+        self.descriptions = descriptions
+        self.history = history
+        self.keep_columns = re.compile(keep_columns, re.IGNORECASE)
+
+    @classmethod
+    def from_env(cls) -> "PromptBudget":
+        """Budgets from PROMPT_TOKEN_BUDGET, PROMPT_BUDGET_* and PROMPT_KEEP_COLUMNS."""
+        return cls(
+            total=int(os.getenv("PROMPT_TOKEN_BUDGET", "12000")),
+            table_info=int(os.getenv("PROMPT_BUDGET_TABLE_INFO", "0")),
+            examples=int(os.getenv("PROMPT_BUDGET_EXAMPLES", "1500")),
+            descriptions=int(os.getenv("PROMPT_BUDGET_DESCRIPTIONS", "6000")),
+            history=int(os.getenv("PROMPT_BUDGET_HISTORY", "0")),
+            keep_columns=os.getenv("PROMPT_KEEP_COLUMNS", DEFAULT_KEEP_COLUMNS),
+        )
+
+    @staticmethod
+    def _ranked(names: List[str], question: str, relevance: Optional[Callable[[str], Dict[str, float]]],
+                texts: Optional[Dict[str, str]] = None) -> List[str]:
+        """
+        Names most relevant first: by relevance score, then by words shared between the
+        question and the name (plus its text, e.g. description), then in the given order.
+        """
+        scores = {}
+        if relevance is not None:
+            try:
+                scores = relevance(question)
+            except Exception as e:
+                print(f"Prompt budget: table relevance unavailable ({e})")
+        question_tokens = set(tokenize(question))
+
+        def overlap(name):
+            return len(question_tokens.intersection(tokenize(f"{name} {(texts or {}).get(name, '')}")))
+
+        return sorted(names, key=lambda name: (-scores.get(name, 0.0), -overlap(name)))
+
+    def _report(self, prompt: str, sections: Dict[str, int], compactions: Dict[str, str],
+                limits: Dict[str, Optional[int]]) -> None:
+        """Log and count one prompt's section tokens; `limits` holds the budgets that applied ("total" included)."""
+        total = sum(sections.values())
+        metrics.observe_prompt(prompt, sections, list(compactions))
+        annotate(prompt_sections=sections, **({"prompt_compaction": compactions} if compactions else {}))
+
+        def used(name, tokens):
+            return f"{tokens}/{limits[name]}" if limits.get(name) is not None else str(tokens)
+
+        usage = ", ".join(f"{section} {used(section, tokens)}" for section, tokens in sections.items())
+        trimmed = "; " + ", ".join(f"{action} {detail}" for action, detail in compactions.items()) if compactions else ""
+        print(f"{prompt} prompt ~{used('total', total)} tokens ({usage}){trimmed}")
+
+    # -- Table selection ---------------------------------------------------------
+
+    def table_details(self, question: str, instructions: str, descriptions: Dict[str, str],
+                      relevance: Optional[Callable[[str], Dict[str, float]]] = None) -> str:
+        """
+        DATABASE TABLES section for one question: every description if they fit the
+        descriptions budget, otherwise the most relevant tables' descriptions that do.
+
+        Args:
+            question (str): The user's question
+            instructions (str): The prompt template (counted as fixed overhead)
+            descriptions (Dict[str, str]): {table_name: description}
+            relevance (callable, optional): question -> {table_name: score}
+
+        Returns:
+            str: Rendered table details
+        """
+        text = render_table_details(descriptions)
+        tokens, compactions = estimate_tokens(text), {}
+        if self.descriptions and tokens > self.descriptions:
+            kept, used = set(), 0
+            for name in self._ranked(list(descriptions), question, relevance, descriptions):
+                cost = estimate_tokens(render_table_details({name: descriptions[name]}))
+                if used + cost <= self.descriptions or not kept:
+                    kept.add(name)
+                    used += cost
+            text = render_table_details({name: description for name, description in descriptions.items() if name in kept})
+            tokens = estimate_tokens(text)
+            compactions["tables"] = f"{len(kept)}/{len(descriptions)}"
+        self._report("table_selection", {"instructions": estimate_tokens(instructions), "descriptions": tokens,
+                                         "question": estimate_tokens(question)},
+                     compactions, {"descriptions": self.descriptions or None})
+        return text
+
+    # -- SQL generation ----------------------------------------------------------
+
+    def _fit_examples(self, examples: list) -> Tuple[list, Dict[str, str]]:
+        """Drop the least similar (last) question/SQL pairs until the examples fit."""
+        if not self.examples:
+            return examples, {}
+        kept = list(examples)
+        while kept and sum(estimate_tokens(str(message.content)) for message in kept) > self.examples:
+            kept = kept[:-2]
+        return kept, ({"examples": f"{len(kept) // 2}/{len(examples) // 2}"} if len(kept) < len(examples) else {})
+
+    def history_text(self, question: str, messages: Optional[List[dict]]) -> str:
+        """
+        History section of the SQL prompt: the most recent turns before the question
+        that fit the history budget, oldest first ("" when PROMPT_BUDGET_HISTORY is 0).
+        """
+        if not self.history or not messages:
+            return ""
+        turns = list(messages)
+        if turns and turns[-1].get("role") == "user" and turns[-1].get("content") == question:
+            turns.pop()  # The current question is already the prompt's input
+        lines, used = [], estimate_tokens("Conversation so far:\n")
+        for message in reversed(turns):
+            line = f"{message['role']}: {message['content']}"
+            if used + estimate_tokens(line) > self.history:
+                break
+            lines.insert(0, line)
+            used += estimate_tokens(line)
+        return "Conversation so far:\n" + "\n".join(lines) + "\n\n" if lines else ""
+
+    def _used_columns(self, question: str, context: str, table: TableInfo) -> set:
+        """Lower-cased columns of a table the question (or the examples / history) refers to, plus keys."""
+        text = f"{question}\n{context}".lower()
+        question_tokens = set(tokenize(question))
+        used = table.key_columns()
+        for name, _ in table.columns:
+            lower = name.lower()
+            if (lower in text or self.keep_columns.search(name)
+                    or any(len(token) > 2 and token in question_tokens for token in tokenize(name))):
+                used.add(lower)
+        return used
+
+    def fit_table_info(self, question: str, tables: Dict[str, str], budget: Optional[int], context: str = "",
+                       relevance: Optional[Callable[[str], Dict[str, float]]] = None) -> Tuple[str, Dict[str, str]]:
+        """
+        Table info for the SQL prompt within `budget` tokens.
+
+        Steps, each only if still over budget: fewer sample rows (down to none),
+        only the columns the question, examples or history mention (plus keys and
+        PROMPT_KEEP_COLUMNS), then the least relevant tables (the most relevant one
+        is always kept).
+
+        Args:
+            question (str): The user's question
+            tables (Dict[str, str]): {table_name: rendered table info}, most relevant first
+            budget (int | None): Token budget (None = unlimited)
+            context (str): Few-shot SQL and history text whose column names count as used
+            relevance (callable, optional): question -> {table_name: score} for dropping tables
+
+        Returns:
+            (str, Dict[str, str]): Table info and the compactions applied {action: detail}
+        """
+        def joined(texts):
+            return "\n\n".join(text for text in texts if text)  # Keep the relevance order
+
+        text = joined(tables.values())
+        if budget is None or estimate_tokens(text) <= budget:
+            return text, {}
+        parsed = {name: TableInfo.parse(name, info) for name, info in tables.items()}
+        rendered = dict(tables)
+        compactions = {}
+
+        # 1. Sample rows
+        most_rows = max((len(info.sample_rows) for info in parsed.values() if info), default=0)
+        for rows in range(most_rows - 1, -1, -1):
+            rendered = {name: info.render(rows) if info else tables[name] for name, info in parsed.items()}
+            compactions["sample_rows"] = f"{most_rows}->{rows}"
+            if estimate_tokens(joined(rendered.values())) <= budget:
+                return joined(rendered.values()), compactions
+
+        # 2. Columns the question does not use
+        pruned = 0
+        for name, info in parsed.items():
+            if info:
+                keep = self._used_columns(question, context, info)
+                rendered[name] = info.render(0, keep)
+                pruned += sum(1 for column, _ in info.columns if column.lower() not in keep)
+        if pruned:
+            compactions["columns"] = f"-{pruned}"
+            if estimate_tokens(joined(rendered.values())) <= budget:
+                return joined(rendered.values()), compactions
+
+        # 3. Least relevant tables
+        ranked = self._ranked(list(tables), question, relevance)
+        while len(ranked) > 1 and estimate_tokens(joined(rendered[name] for name in ranked)) > budget:
+            ranked.pop()
+        if len(ranked) < len(tables):
+            compactions["tables"] = f"{len(ranked)}/{len(tables)}"
+        text = joined(rendered[name] for name in ranked)
+        if estimate_tokens(text) > budget:
+            compactions["over_budget"] = f"+{estimate_tokens(text) - budget}"
+        return text, compactions
+
+    def sql_inputs(self, question: str, instructions: str, tables: Dict[str, str], examples: list,
+                   messages: Optional[List[dict]] = None,
+                   relevance: Optional[Callable[[str], Dict[str, float]]] = None) -> dict:
+        """
+        Variables for the SQL-generation prompt within the budget.
+
+        Examples and history are fitted to their own budgets first; table info gets
+        its cap or what the total leaves after the instructions, examples, history
+        and question, whichever is smaller.
+
+        Args:
+            question (str): The user's question
+            instructions (str): The system prompt template (counted as fixed overhead)
+            tables (Dict[str, str]): {table_name: rendered table info}, most relevant first
+            examples (list): Few-shot messages (human/ai pairs, most similar first)
+            messages (List[dict], optional): Chat history ({"role", "content"})
+            relevance (callable, optional): question -> {table_name: score}
+
+        Returns:
+            dict: {"input", "table_info", "examples"}
+        """
+        examples, compactions = self._fit_examples(examples)
+        history = self.history_text(question, messages)
+        sections = {
+            "instructions": estimate_tokens(instructions),
+            "examples": sum(estimate_tokens(str(message.content)) for message in examples),
+            "history": estimate_tokens(history) if history else 0,
+            "question": estimate_tokens(question),
+        }
+        budget = self.table_info or None
+        if self.total:
+            remaining = max(0, self.total - sum(sections.values()))
+            budget = min(budget, remaining) if budget is not None else remaining
+        context = history + "\n".join(str(message.content) for message in examples)
+        table_info, table_compactions = self.fit_table_info(question, tables, budget, context, relevance)
+        compactions.update(table_compactions)
+        sections["table_info"] = estimate_tokens(table_info)
+        self._report("sql_generation", sections, compactions,
+                     {"total": self.total or None, "table_info": budget, "examples": self.examples or None,
+                      "history": self.history or None})
+        return {"input": f"{history}{question}\nSQLQuery: ", "table_info": table_info, "examples": examples}
+
+    def stats(self) -> dict:
+        """Configured budgets (0 = unlimited; history 0 = not sent)."""
+        return {"total": self.total, "table_info": self.table_info, "examples": self.examples,
+                "descriptions": self.descriptions, "history": self.history,
+                "keep_columns": self.keep_columns.pattern}
@@ -72,6 +72,20 @@ Database Query Result: {result}
 Provide a clear, concise answer to the user's question. Format the data nicely using markdown (**bold** for important terms, *italic* for emphasis). If the result shows no data, explain that clearly."""
 
 
+# =============================================================================
+# CONVERSATION SUMMARY PROMPT
+# =============================================================================
+
+HISTORY_SUMMARY_PROMPT = """Update the running summary of a conversation between a user and a database assistant.
+
+Current summary: {summary}
+
+Older messages to fold in:
+{messages}
+
+Return the updated summary in at most 3 sentences. Keep table names, filters, entities and numbers the user may refer back to."""
+
+
 # =============================================================================
 # FEW-SHOT EXAMPLES
 # =============================================================================
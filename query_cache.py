@@ -0,0 +1,186 @@
+"""
+AskOGMS question cache.
+Persists question -> generated SQL (+ selected tables) in SQLite so repeated
+questions skip table selection and SQL generation entirely.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+# Quoted literals keep their case: 'CA' and 'ca' can produce different SQL
+_QUOTED_PATTERN = re.compile(r"('[^']*'|\"[^\"]*\")")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for cache lookups.
+
+    Lowercases text outside quotes, collapses whitespace and drops trailing
+    punctuation, so "How many  cases?" and "how many cases" share an entry.
+
+    Args:
+        question (str): The user's question
+
+    Returns:
+        str: Normalized question
+    """
+    parts = _QUOTED_PATTERN.split(question or "")
+    text = "".join(p if i % 2 else p.lower() for i, p in enumerate(parts))
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!. ").strip()
+
+
+def schema_fingerprint(*parts) -> str:
+    """Hash everything the generated SQL depends on (schema, prompts, model)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+class QuestionCache:
+    """
+    Disk-backed question -> SQL cache with TTL and LRU eviction.
+
+    Entries are keyed on the normalized question plus a schema fingerprint, so a
+    schema or prompt change never serves stale SQL, and on the chat history the
+    SQL prompt contained, so a follow-up is never answered with another
+    conversation's SQL. Safe to share between threads;
+    separate worker processes can point at the same file.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int = 604800, max_entries: int = 2000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS question_cache (
+                key TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                query TEXT NOT NULL,
+                tables TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_question_cache_access ON question_cache (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(question: str, fingerprint: str, context: str = "") -> str:
+        key = f"{fingerprint}:{normalize_question(question)}"
+        if context:
+            key += "\x00" + context  # Questions asked without history keep their existing keys
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, question: str, fingerprint: str, context: str = "") -> Optional[dict]:
+        """
+        Look up cached SQL for a question.
+
+        Args:
+            question (str): The user's question (normalized internally)
+            fingerprint (str): Current schema fingerprint
+            context (str): Chat history included in the SQL prompt ("" = none)
+
+        Returns:
+            dict | None: {"query": str, "tables": List[str]} or None on a miss
+        """
+        key = self._key(question, fingerprint, context)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT query, tables, created_at FROM question_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl_seconds and now - row[2] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM question_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE question_cache SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?",
+                (now, key),
+            )
+            self._conn.commit()
+            self.hits += 1
+        return {"query": row[0], "tables": json.loads(row[1])}
+
+    def put(self, question: str, fingerprint: str, query: str, tables: Optional[List[str]] = None,
+            context: str = "") -> None:
+        """Store SQL for a question (and prompt history `context`), evicting least recently used entries over the cap."""
+        key = self._key(question, fingerprint, context)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO question_cache
+                   (key, question, fingerprint, query, tables, created_at, last_access, hit_count)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, 0)""",
+                (key, normalize_question(question), fingerprint, query, json.dumps(list(tables or [])), now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM question_cache").fetchone()[0]
+            if self.max_entries and count > self.max_entries:
+                overflow = count - self.max_entries
+                self._conn.execute(
+                    """DELETE FROM question_cache WHERE key IN (
+                           SELECT key FROM question_cache ORDER BY last_access ASC LIMIT ?)""",
+                    (overflow,),
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def invalidate(self, fingerprint: Optional[str] = None) -> int:
+        """Drop entries for one fingerprint (or all entries). Returns rows removed."""
+        with self._lock:
+            if fingerprint:
+                cur = self._conn.execute("DELETE FROM question_cache WHERE fingerprint = ?", (fingerprint,))
+            else:
+                cur = self._conn.execute("DELETE FROM question_cache")
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process plus the current entry count."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM question_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def cache_from_env() -> Optional[QuestionCache]:
+    """Build the cache from QUERY_CACHE_* settings, or None when disabled."""
+    if os.getenv("QUERY_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    path = os.getenv("QUERY_CACHE_PATH", "askdb_query_cache.db")
+    try:
+        return QuestionCache(
+            path,
+            ttl_seconds=int(os.getenv("QUERY_CACHE_TTL", "604800")),
+            max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2000")),
+        )
+    except Exception as e:
+        print(f"Question cache disabled ({path}): {e}")
+        return None
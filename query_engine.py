@@ -1,7 +1,4 @@
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from langchain_community.utilities.sql_database import SQLDatabase
 try:
     from langchain_core.globals import set_llm_cache
     from langchain_core.caches import InMemoryCache
@@ -13,25 +10,20 @@ except Exception:
         set_llm_cache(InMemoryCache())
     except Exception:
         pass  # caching optional
+import asyncio
+import contextvars
 import os
-import re
+import threading
+import time
 import warnings
 # Suppress SQLAlchemy cycle warning (e.g. user_roles/users FK); harmless for query generation
 warnings.filterwarnings("ignore", message=".*Cannot correctly sort tables.*unresolvable cycles.*", category=Warning)
-try:
-    from langchain.chains import create_sql_query_chain
-except ModuleNotFoundError:
-    from langchain_classic.chains import create_sql_query_chain
-from langchain_google_genai import ChatGoogleGenerativeAI  # Replace with actual Google Gemini module
-from langchain_community.tools import QuerySQLDatabaseTool
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder,FewShotChatMessagePromptTemplate,PromptTemplate
-from langchain_chroma import Chroma
-from langchain_core.example_selectors import SemanticSimilarityExampleSelector
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, FewShotChatMessagePromptTemplate, MessagesPlaceholder
 from operator import itemgetter
 from pydantic import BaseModel, Field
-from typing import List
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from dotenv import load_dotenv
 
 # Enable in-memory caching for LLM responses (optional)
@@ -41,8 +33,30 @@ from prompts_config import (
     SQL_GENERATION_PROMPT,
     TABLE_SELECTION_PROMPT,
     ANSWER_GENERATION_PROMPT,
+    HISTORY_SUMMARY_PROMPT,
     FEW_SHOT_EXAMPLES
 )
+from sql_extract import extract_sql
+try:
+    from sql_repair import referenced_tables, validate_and_repair
+except ImportError:  # sqlglot not installed: generated SQL goes straight to the database
+    referenced_tables = validate_and_repair = None
+from query_cache import cache_from_env, normalize_question, schema_fingerprint
+from result_cache import ResultCache
+from schema_cache import SchemaInfoCache
+from schema_catalog import SchemaCatalog
+from async_db import AsyncQueryRunner
+from query_results import execute_bounded, execute_many
+from query_guard import ExecutionPolicy
+from db_pool import create_pooled_engine, pool_stats
+from instrumentation import TokenUsageCallback, annotate, span, trace
+from llm_scheduler import llm_priority, scheduler_from_env
+from model_tiers import ModelTiers
+from prompt_budget import PromptBudget, render_table_details
+from result_summary import ANSWER_MODES, ResultStore, needs_summary, summarize, template_answer
+from example_index import build_example_selector, embeddings_from_name, load_examples
+from table_selector import LocalTableSelector, backend_from_name, table_documents
+from query_router import RouteDecision, router_from_env
 
 # Load environment variables from .env file
 load_dotenv()
@@ -55,38 +69,6 @@ db_host = os.getenv("DB_HOST", "localhost")
 db_port = os.getenv("DB_PORT", "5432")
 db_name = os.getenv("DB_NAME", "ogms")
 
-# Construct database URI based on type
-if db_type.lower() == "sqlite":
-    database_uri = f"sqlite:///{db_name}"
-    print(f"Connecting to SQLite: {db_name}")
-elif db_type.lower() == "postgresql":
-    # URL encode the password to handle special characters
-    from urllib.parse import quote_plus
-    encoded_password = quote_plus(db_password) if db_password else ""
-    database_uri = f"postgresql://{db_user}:{encoded_password}@{db_host}:{db_port}/{db_name}"
-    print(f"Connecting to PostgreSQL at {db_host}:{db_port}/{db_name}")
-else:
-    # URL encode the password to handle special characters
-    from urllib.parse import quote_plus
-    encoded_password = quote_plus(db_password) if db_password else ""
-    database_uri = f"mysql+pymysql://{db_user}:{encoded_password}@{db_host}:{db_port}/{db_name}"
-    print(f"Connecting to MySQL at {db_host}:{db_port}/{db_name}")
-
-try:
-    db = SQLDatabase.from_uri(database_uri)
-    print("Database connection successful.")
-except Exception as e:
-    print(f"Database connection failed: {e}")
-    print("Configure your database in .env file:")
-    if db_type.lower() == "sqlite":
-        print("   - DB_NAME=your_database_file.db")
-    else:
-        print("   - DB_HOST=your_cloud_sql_ip")
-        print("   - DB_USER=your_username")
-        print("   - DB_PASSWORD=your_password")
-        print("   - DB_NAME=your_database")
-    raise
-
 # Set API keys from environment variables
 os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY", "")
 
@@ -107,167 +89,90 @@ if os.environ["LANGCHAIN_TRACING_V2"].lower() == "true":
 else:
     print("LangChain tracing disabled")
 
-# Initialize Google Gemini LLM (GEMINI_MODEL in .env; gemini-2.0-flash works, gemini-3-flash-preview if quota)
+# Google Gemini settings (GEMINI_MODEL in .env; gemini-2.0-flash works, gemini-3-flash-preview if quota)
 _gemini_model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 _llm_timeout = int(os.getenv("GEMINI_TIMEOUT", "90"))  # Default 90s for complex queries
-llm = ChatGoogleGenerativeAI(
-    model=_gemini_model,
-    temperature=0,
-    max_retries=3,  # Increased retries for timeout recovery
-    timeout=_llm_timeout
-)
-print(f"Gemini LLM initialized: {_gemini_model}")
 
+# Seconds between catalog signature checks for the cached table info (0 = every question)
+_schema_check_interval = float(os.getenv("SCHEMA_CACHE_CHECK_INTERVAL", "300"))
 
+# Few-shot examples: semantic (k most similar from a local Chroma index) or all
+_few_shot_selector = os.getenv("FEW_SHOT_SELECTOR", "semantic").lower()
+_few_shot_k = int(os.getenv("FEW_SHOT_K", "4"))
+_few_shot_examples_path = os.getenv("FEW_SHOT_EXAMPLES_PATH", "few_shot_examples.jsonl")
 
+# Answer stage: results above these sizes are summarized locally before the LLM sees them
+_summary_max_rows = int(os.getenv("SUMMARY_MAX_ROWS", "50"))
+_summary_max_bytes = int(os.getenv("SUMMARY_MAX_BYTES", "8000"))
+_scalar_answers = os.getenv("SCALAR_ANSWERS", "true").lower() == "true"
+# Answer mode when a request does not pick one (result_summary.ANSWER_MODES); SCALAR_ANSWERS=false keeps
+# the old always-LLM behaviour unless ANSWER_MODE is set
+_answer_mode = os.getenv("ANSWER_MODE", "auto" if _scalar_answers else "llm").lower()
+if _answer_mode not in ANSWER_MODES:
+    print(f"Unknown ANSWER_MODE {_answer_mode!r}; using auto")
+    _answer_mode = "auto"
+_template_max_items = int(os.getenv("TEMPLATE_MAX_ITEMS", "20"))
+_template_max_rows = int(os.getenv("TEMPLATE_MAX_ROWS", "20"))
+_template_max_columns = int(os.getenv("TEMPLATE_MAX_COLUMNS", "6"))
 
-def clean_sql_query(text: str) -> str:
-    """
-    Clean SQL query by removing code block syntax, various SQL tags, backticks,
-    prefixes, and unnecessary whitespace while preserving the core SQL query.
-
-    Args:
-        text (str): Raw SQL query text that may contain code blocks, tags, and backticks
-
-    Returns:
-        str: Cleaned SQL query
-    """
-    # Step 1: Remove code block syntax and any SQL-related tags
-    # This handles variations like ```sql, ```SQL, ```SQLQuery, etc.
-    block_pattern = r"```(?:sql|SQL|SQLQuery|mysql|postgresql)?\s*(.*?)\s*```"
-    text = re.sub(block_pattern, r"\1", text, flags=re.DOTALL)
-
-    # Step 2: Handle "SQLQuery:" prefix and similar variations
-    # This will match patterns like "SQLQuery:", "SQL Query:", "MySQL:", etc.
-    prefix_pattern = r"^(?:SQL\s*Query|SQLQuery|MySQL|PostgreSQL|SQL)\s*:\s*"
-    text = re.sub(prefix_pattern, "", text, flags=re.IGNORECASE)
+# Validate generated SQL against the schema catalog and repair it locally before execution
+_sql_repair = os.getenv("SQL_REPAIR", "true").lower() == "true"
 
-    # Step 3: Extract the first SQL statement if there's random text after it
-    # Look for a complete SQL statement ending with semicolon
-    sql_statement_pattern = r"(SELECT.*?;)"
-    sql_match = re.search(sql_statement_pattern, text, flags=re.IGNORECASE | re.DOTALL)
-    if sql_match:
-        text = sql_match.group(1)
+# SQL result cache (in memory, keyed on canonical SQL): on/off, byte cap, TTL, table-change check interval
+_result_cache_enabled = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
 
-    # Step 4: Remove backticks around identifiers
-    text = re.sub(r'`([^`]*)`', r'\1', text)
+# Table selection: llm (always Gemini), local (embedding index only), hybrid (local, Gemini when unsure)
+_table_selector_mode = os.getenv("TABLE_SELECTOR", "hybrid").lower()
 
-    # Step 5: Normalize whitespace
-    # Replace multiple spaces with single space
-    text = re.sub(r'\s+', ' ', text)
+# Speculative SQL: generate on the local index's best-guess tables while Gemini selects tables
+_speculative_sql = os.getenv("SPECULATIVE_SQL", "false").lower() == "true"
+_speculative_workers = int(os.getenv("SPECULATIVE_WORKERS", "8"))
 
-    # Step 6: Preserve newlines for main SQL keywords to maintain readability
-    keywords = ['SELECT', 'FROM', 'WHERE', 'GROUP BY', 'HAVING', 'ORDER BY',
-               'LIMIT', 'JOIN', 'LEFT JOIN', 'RIGHT JOIN', 'INNER JOIN',
-               'OUTER JOIN', 'UNION', 'VALUES', 'INSERT', 'UPDATE', 'DELETE']
+# Batch API: LLM calls in flight per stage (table selection, SQL generation, answers, corrections)
+_batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
 
-    # Case-insensitive replacement for keywords
-    pattern = '|'.join(r'\b{}\b'.format(k) for k in keywords)
-    text = re.sub(f'({pattern})', r'\n\1', text, flags=re.IGNORECASE)
+# Row limit the SQL prompt asks for ({top_k}; create_sql_query_chain's default)
+_SQL_TOP_K = 5
 
-    # Step 7: Final cleanup
-    # Remove leading/trailing whitespace and extra newlines
-    text = text.strip()
-    text = re.sub(r'\n\s*\n', '\n', text)
 
-    return text
-
-
-execute_query = QuerySQLDatabaseTool(db=db)
-
-
-
-
-
-# Load answer generation prompt from config
-answer_prompt = PromptTemplate.from_template(ANSWER_GENERATION_PROMPT)
-
-# Create a simple wrapper to format the answer
-def format_answer(input_dict: dict) -> str:
-    """Format the answer by invoking the prompt with the result"""
-    question = input_dict.get("question", "")
-    result = input_dict.get("result", "")
-    
-    # Debug: print what we're receiving
-    
-    # If result is empty, provide a default message
-    if not result or result.strip() == "":
-        result = "No data returned from the database query."
-    
-    # Format the prompt message
-    message = ANSWER_GENERATION_PROMPT.format(question=question, result=result)
-    
-    # Get LLM response - create a message object (with timeout handling)
-    from langchain_core.messages import HumanMessage
-    try:
-        response = llm.invoke([HumanMessage(content=message)])
-    except Exception as e:
-        error_str = str(e)
-        if "DEADLINE_EXCEEDED" in error_str or "timeout" in error_str.lower() or "504" in error_str:
-            return f"The query took too long to process. The database query returned: {result}. Please try rephrasing your question or breaking it into smaller parts."
-        raise  # Re-raise other errors
-    
-    # Extract content (always return a string for the API/frontend)
-    if isinstance(response, str):
-        return response
-    if hasattr(response, 'content'):
-        content = response.content
-        if isinstance(content, str):
-            return content
-        if isinstance(content, dict) and content.get("text"):
-            return content["text"]
-        if isinstance(content, list) and content:
-            part = content[0]
-            if isinstance(part, dict) and part.get("text"):
-                return part["text"]
-            return getattr(part, 'text', part) if hasattr(part, 'text') else str(part)
-        return str(content) if content is not None else "No response."
-    if isinstance(response, dict) and response.get("text"):
-        return response["text"]
-    return str(response)
-
-rephrase_answer = RunnableLambda(format_answer)
-
-# Load examples from config
-examples = FEW_SHOT_EXAMPLES
-
-
-
-example_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("human", "{input}\nSQLQuery:"),
-        ("ai", "{query}"),
-    ]
-)
-few_shot_prompt = FewShotChatMessagePromptTemplate(
-    example_prompt=example_prompt,
-    examples=examples,
-    input_variables=["input"],
-)
+def get_database_uri() -> str:
+    """Build the SQLAlchemy URI from the DB_* settings."""
+    # Construct database URI based on type
+    if db_type.lower() == "sqlite":
+        return f"sqlite:///{db_name}"
+    # URL encode the password to handle special characters
+    from urllib.parse import quote_plus
+    encoded_password = quote_plus(db_password) if db_password else ""
+    if db_type.lower() == "postgresql":
+        return f"postgresql://{db_user}:{encoded_password}@{db_host}:{db_port}/{db_name}"
+    return f"mysql+pymysql://{db_user}:{encoded_password}@{db_host}:{db_port}/{db_name}"
 
 
+def clean_sql_query(text: str) -> str:
+    """
+    Clean SQL query by removing code block syntax, various SQL tags, backticks,
+    prefixes, and unnecessary whitespace while preserving the core SQL query.
 
-# Temporarily disable semantic similarity due to API quota limits
-# Use simple few-shot prompt without selector
-few_shot_prompt = FewShotChatMessagePromptTemplate(
-    example_prompt=example_prompt,
-    examples=examples,
-    input_variables=["input"],
-)
+    Args:
+        text (str): Raw SQL query text that may contain code blocks, tags, and backticks
 
+    Returns:
+        str: Cleaned SQL query
+    """
+    # Single tokenizer pass (sql_extract): literals, quoted identifiers and CTEs survive intact
+    return extract_sql(text, identifier_quote='"' if db_type.lower() in ("postgresql", "sqlite") else "`")
 
 
 def get_table_details():
-    # Read the CSV file into a DataFrame
-    table_description = pd.read_csv("database_table_descriptions.csv")
-    table_docs = []
+    """Every table's description as the table-selection prompt lists them."""
+    return render_table_details(get_table_descriptions())
 
-    # Iterate over the DataFrame rows to create Document objects
-    table_details = ""
-    for index, row in table_description.iterrows():
-        table_details = table_details + "Table Name:" + row['table_name'] + "\n" + "Table Description:" + row['description'] + "\n\n"
 
-    return table_details
+def get_table_descriptions() -> dict:
+    """Map table_name -> description from database_table_descriptions.csv."""
+    import csv
+    with open("database_table_descriptions.csv", newline="", encoding="utf-8") as f:
+        return {row["table_name"]: row["description"] for row in csv.DictReader(f)}
 
 
 class Table(BaseModel):
@@ -275,24 +180,6 @@ class Table(BaseModel):
 
     name: List[str] = Field(description="List of Name of tables in SQL database.")
 
-# table_names = "\n".join(db.get_usable_table_names())
-table_details = get_table_details()
-if "_RUN_FIRST" in table_details:
-    print("Run: python generate_table_descriptions.py then edit database_table_descriptions.csv")
-
-# Load table selection prompt from config
-table_details_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", TABLE_SELECTION_PROMPT),
-            ("human", "{question}")
-        ]
-    )
-
-structured_llm = llm.with_structured_output(Table)
-
-table_chain = table_details_prompt | structured_llm
-
-
 
 def get_tables(table_response: Table) -> List[str]:
     """
@@ -307,78 +194,9 @@ def get_tables(table_response: Table) -> List[str]:
     return table_response.name
 
 
-select_table = {"question": itemgetter("question"), "table_details": itemgetter("table_details")} | table_chain | get_tables
-
-
-
-# Load SQL generation prompt from config
-final_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", SQL_GENERATION_PROMPT),
-        few_shot_prompt,
-        ("human", "{input}"),
-    ]
-)
-
-
-# from langchain_community.chat_message_histories import ChatMessageHistory
-# history = ChatMessageHistory()
-
-generate_query = create_sql_query_chain(llm, db,final_prompt)
-
-chain = (
-RunnablePassthrough.assign(table_names_to_use=select_table) |
-RunnablePassthrough.assign(query=generate_query | RunnableLambda(clean_sql_query)).assign(
-    result=itemgetter("query") | execute_query
-)
-| rephrase_answer
-)
-
-
-def execute_query_with_retry(inputs: dict) -> dict:
-    """
-    Custom LangChain runnable that executes SQL with retry logic.
-    This keeps everything in a single trace.
-    
-    Args:
-        inputs: Dict with 'query', 'question', 'table_details'
-    
-    Returns:
-        Dict with 'result' or 'error'
-    """
-    sql_query = inputs.get("query")
-    question = inputs.get("question")
-    max_retries = 2
-    attempt = 0
-    
-    print(f"Executing: {sql_query}")
-    
-    while attempt < max_retries:
-        try:
-            result = execute_query.invoke(sql_query)
-            print(f"Query OK (attempt {attempt + 1})")
-            # Format result as string for the LLM prompt
-            if isinstance(result, list):
-                if len(result) == 0:
-                    result_str = "No records found in the database."
-                else:
-                    result_str = str(result)
-            elif result is None:
-                result_str = "No records found in the database."
-            else:
-                result_str = str(result)
-            
-            print(f"Query result: {result_str[:200]}...")
-            return {**inputs, "result": result_str, "query": sql_query, "error": None}
-        except Exception as e:
-            error_message = str(e)
-            print(f"Query failed (attempt {attempt + 1}): {error_message}")
-            attempt += 1
-            
-            if attempt < max_retries:
-                print("Attempting query correction...")
-                # Correct the query using LLM
-                correction_prompt = f"""You are a SQL expert. The following query failed with an error. Analyze the error and provide a CORRECTED query.
+def _correction_prompt(question: str, sql_query: str, error_message: str) -> str:
+    """Prompt asking the LLM to fix a query the database rejected."""
+    return f"""You are a SQL expert. The following query failed with an error. Analyze the error and provide a CORRECTED query.
 
 Original Question: {question}
 
@@ -396,83 +214,1359 @@ Common Issues to Check:
 5. deleted_status on wrong table - only use on cases, orders, tasks, student_programs, programs (NOT contacts or payments)
 
 Provide ONLY the corrected SQL query, no explanations:"""
-                
-                try:
-                    corrected = llm.invoke(correction_prompt)
-                    sql_query = clean_sql_query(corrected.content if hasattr(corrected, 'content') else str(corrected))
-                    print(f"Corrected query: {sql_query}")
-                    inputs["query"] = sql_query  # Update the query for next attempt
-                except Exception as correction_error:
-                    error_str = str(correction_error)
-                    if "DEADLINE_EXCEEDED" in error_str or "timeout" in error_str.lower() or "504" in error_str:
-                        print("Query correction timed out.")
-                        break  # Don't retry if correction itself times out
-                    print(f"Correction error: {correction_error}")
-                    break
-            else:
-                print("All retries exhausted")
-                # Return error in a format the answer chain can handle
-                error_response = f"""Query execution failed after {max_retries} attempts.
+
+
+def _failure_result(inputs: dict, sql_query: str, error_message: str, max_retries: int) -> dict:
+    """Return error in a format the answer chain can handle."""
+    error_response = f"""Query execution failed after {max_retries} attempts.
 
 Error: {error_message}
 
-Query attempted: 
+Query attempted:
 {sql_query}
 
 This might be because:
 - The column or table doesn't exist in the database
-- There's a mismatch in the schema  
+- There's a mismatch in the schema
 - The query syntax needs adjustment"""
-                return {**inputs, "result": error_response, "query": sql_query, "error": error_message}
-    
-    return {**inputs, "result": "Unable to process the query", "query": sql_query if 'sql_query' in locals() else "N/A", "error": "Max retries reached"}
+    return {**inputs, "result": error_response, "query": sql_query, "error": error_message}
 
 
-# Create the chain with retry logic integrated
-chain = (
-    RunnablePassthrough.assign(table_names_to_use=select_table) |
-    RunnablePassthrough.assign(query=generate_query | RunnableLambda(clean_sql_query)) |
-    RunnableLambda(execute_query_with_retry) |  # Custom retry logic here
-    rephrase_answer
-)
-
-
-# Optimized chain without table selection (faster for simple queries)
-# This skips 1 LLM call and reduces latency by ~30%
-def is_simple_query(question: str) -> bool:
-    """Detect if query is simple enough to skip table selection"""
-    simple_keywords = ['count', 'total', 'how many', 'show', 'list', 'all']
-    return any(keyword in question.lower() for keyword in simple_keywords)
+class QueryEngine:
+    """
+    NL -> SQL pipeline with lazy initialization.
 
+    Nothing touches the database, Gemini or the CSV until first use (or warm_up()),
+    so importing this module is cheap. Each init phase is timed in `init_timings`.
 
-def chain_code(q, m=None):
-    """
-    Execute the SQL chain to answer a question.
-    Now with integrated retry logic in a single LangChain trace.
-    
     Args:
-        q (str): The user's question
-        m (list, optional): Message history for context
-    
-    Returns:
-        str: The AI's response
+        llm (optional): Chat model to use instead of Gemini (e.g. the benchmark's replay model)
     """
-    if m is None:
-        m = []
-    
-    print(f"Processing: {q[:60]}...")
-    
-    # For simple queries, skip table selection to save ~30% latency
-    if is_simple_query(q):
-        print("Using fast path (no table selection)")
-        fast_chain = (
-            RunnablePassthrough.assign(query=generate_query | RunnableLambda(clean_sql_query)) |
-            RunnableLambda(execute_query_with_retry) |
+
+    def __init__(self, llm=None):
+        self._lock = threading.RLock()
+        self._warmup_thread = None
+        self.init_timings = {}
+        self._db = None
+        self._llm = llm
+        self._llm_injected = llm is not None
+        self._llms = {}  # model name -> client, for stages not on GEMINI_MODEL
+        # Model per stage and when to escalate to GEMINI_MODEL_STRONG
+        self.model_tiers = ModelTiers.from_env(_gemini_model)
+        self.execution_policy = ExecutionPolicy.from_env()
+        # Shared by every LLM call: request/token budget and priority queue (None when LLM_SCHEDULER=false)
+        self.llm_scheduler = scheduler_from_env()
+        # Token budgets for the table-selection and SQL prompts (PROMPT_TOKEN_BUDGET, PROMPT_BUDGET_*)
+        self.prompt_budget = PromptBudget.from_env()
+        self._table_details = None
+        self._table_descriptions = None
+        self._schema_info = None
+        self._schema_catalog = None
+        self._result_cache = None
+        self._speculation_pool = None
+        self._router = None
+        self._table_selector = None
+        self._few_shot_prompt = None
+        self._async_runner = None
+        self.result_store = ResultStore(max_entries=int(os.getenv("RESULT_STORE_MAX_ENTRIES", "50")))
+        self._chains = None
+        self._question_cache = None
+        self._schema_key = None
+        self._cache_ready = False
+
+    def _timed(self, phase: str, build):
+        """Run one init phase and record how long it took."""
+        start = time.perf_counter()
+        value = build()
+        self.init_timings[phase] = round(time.perf_counter() - start, 4)
+        return value
+
+    # -- Lazy components ---------------------------------------------------
+
+    @property
+    def db(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._timed("database", self._connect_database)
+        return self._db
+
+    def _connect_database(self):
+        from langchain_community.utilities.sql_database import SQLDatabase
+        database_uri = get_database_uri()
+        if db_type.lower() == "sqlite":
+            print(f"Connecting to SQLite: {db_name}")
+        elif db_type.lower() == "postgresql":
+            print(f"Connecting to PostgreSQL at {db_host}:{db_port}/{db_name}")
+        else:
+            print(f"Connecting to MySQL at {db_host}:{db_port}/{db_name}")
+        try:
+            # One pooled engine serves query execution and the schema API
+            db = SQLDatabase(create_pooled_engine(database_uri))
+            print("Database connection successful.")
+            return db
+        except Exception as e:
+            print(f"Database connection failed: {e}")
+            print("Configure your database in .env file:")
+            if db_type.lower() == "sqlite":
+                print("   - DB_NAME=your_database_file.db")
+            else:
+                print("   - DB_HOST=your_cloud_sql_ip")
+                print("   - DB_USER=your_username")
+                print("   - DB_PASSWORD=your_password")
+                print("   - DB_NAME=your_database")
+            raise
+
+    @property
+    def sql_engine(self):
+        """The shared, pooled SQLAlchemy engine behind `db`."""
+        return self.db._engine
+
+    def pool_stats(self) -> dict:
+        """Connection pool usage for the sync engine (and the async engine once created)."""
+        if self._db is None:
+            return {"connected": False}
+        stats = {"sync": pool_stats(self._db._engine)}
+        if self._async_runner is not None and self._async_runner._engine is not None:
+            stats["async"] = pool_stats(self._async_runner._engine.sync_engine)
+        return stats
+
+    @property
+    def schema_info(self) -> SchemaInfoCache:
+        """Per-table cache of CREATE TABLE text and sample rows for SQL generation."""
+        if self._schema_info is None:
+            with self._lock:
+                if self._schema_info is None:
+                    self._schema_info = SchemaInfoCache(self.db, check_interval=_schema_check_interval)
+        return self._schema_info
+
+    @property
+    def schema_catalog(self) -> SchemaCatalog:
+        """Whole-database columns/PK/FK snapshot served to the schema viewer."""
+        if self._schema_catalog is None:
+            with self._lock:
+                if self._schema_catalog is None:
+                    self._schema_catalog = SchemaCatalog(
+                        self.sql_engine,
+                        schema="public" if db_type.lower() == "postgresql" else None,
+                        check_interval=float(os.getenv("SCHEMA_CATALOG_CHECK_INTERVAL", "60")),
+                    )
+        return self._schema_catalog
+
+    def invalidate_schema(self, table_names: List[str] = None) -> None:
+        """Re-render table info (and re-key the question cache) after a schema change."""
+        if self._schema_info is not None:
+            self._schema_info.invalidate(table_names)
+        if self._schema_catalog is not None:
+            self._schema_catalog.invalidate()
+        if self._result_cache is not None:
+            self._result_cache.invalidate(table_names)
+        self._table_selector = None
+        self._schema_key = None
+
+    @property
+    def table_selector(self) -> LocalTableSelector:
+        """Local embedding index over table descriptions and column names."""
+        if self._table_selector is None:
+            with self._lock:
+                if self._table_selector is None:
+                    self._table_selector = self._timed("table_index", lambda: LocalTableSelector(
+                        table_documents(self.db, get_table_descriptions()),
+                        backend=backend_from_name(os.getenv("TABLE_SELECTOR_BACKEND", "tfidf")),
+                        index_path=os.getenv("TABLE_INDEX_PATH", "askdb_table_index.npz"),
+                        top_k=int(os.getenv("TABLE_SELECTOR_TOP_K", "4")),
+                        min_confidence=float(os.getenv("TABLE_SELECTOR_MIN_CONFIDENCE", "0.2")),
+                    ))
+        return self._table_selector
+
+    @property
+    def llm(self):
+        """Default chat model (GEMINI_MODEL)."""
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self._llm = self._timed("llm", lambda: self._create_llm(_gemini_model))
+        return self._llm
+
+    def llm_for(self, model: str):
+        """Chat model for a model name from the tiers (one client per name; an injected model serves all)."""
+        if self._llm_injected or model == _gemini_model:
+            return self.llm
+        if model not in self._llms:
+            with self._lock:
+                if model not in self._llms:
+                    self._llms[model] = self._create_llm(model)
+        return self._llms[model]
+
+    def stage_llm(self, stage: str):
+        """Chat model configured for a pipeline stage (model_tiers.STAGES)."""
+        return self.llm_for(self.model_tiers.model_for(stage))
+
+    def _create_llm(self, model: str):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        scheduler = self.llm_scheduler
+        # With a budget configured the scheduler paces calls and backs off on 429s, so
+        # client-side retries would only add load
+        max_retries = int(os.getenv("GEMINI_MAX_RETRIES", "1" if scheduler and scheduler.limited else "3"))
+        llm = ChatGoogleGenerativeAI(
+            model=model,
+            temperature=0,
+            max_retries=max_retries,
+            timeout=_llm_timeout,
+            rate_limiter=scheduler,
+            # token counts per pipeline stage; token budget and 429 reports for the scheduler
+            callbacks=[TokenUsageCallback()] + ([scheduler.callback] if scheduler else []),
+        )
+        print(f"Gemini LLM initialized: {model}")
+        return llm
+
+    @property
+    def table_details(self) -> str:
+        if self._table_details is None:
+            with self._lock:
+                if self._table_details is None:
+                    descriptions = self._timed("table_details", get_table_descriptions)
+                    details = render_table_details(descriptions)
+                    if "_RUN_FIRST" in details:
+                        print("Run: python generate_table_descriptions.py then edit database_table_descriptions.csv")
+                    self._table_descriptions = descriptions
+                    self._table_details = details
+        return self._table_details
+
+    @property
+    def few_shot_prompt(self):
+        """Few-shot block of the SQL prompt: k most similar examples, or all of them."""
+        if self._few_shot_prompt is None:
+            with self._lock:
+                if self._few_shot_prompt is None:
+                    self._few_shot_prompt = self._build_few_shot_prompt()
+        return self._few_shot_prompt
+
+    def _build_few_shot_prompt(self):
+        example_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("human", "{input}\nSQLQuery:"),
+                ("ai", "{query}"),
+            ]
+        )
+        examples = load_examples(FEW_SHOT_EXAMPLES, _few_shot_examples_path)
+        if _few_shot_selector == "semantic" and len(examples) > _few_shot_k:
+            backend = os.getenv("EXAMPLE_EMBEDDINGS", "hashing").lower()
+            try:
+                selector = self._timed("example_index", lambda: build_example_selector(
+                    examples,
+                    embeddings_from_name(backend),
+                    persist_directory=os.getenv("EXAMPLE_INDEX_DIR", "askdb_example_index"),
+                    k=_few_shot_k,
+                    collection_name=f"askdb_examples_{backend}",
+                ))
+                return FewShotChatMessagePromptTemplate(
+                    example_prompt=example_prompt,
+                    example_selector=selector,
+                    input_variables=["input"],
+                )
+            except Exception as e:
+                print(f"Semantic example selection unavailable ({e}); using all examples")
+        # Simple few-shot prompt without selector
+        return FewShotChatMessagePromptTemplate(
+            example_prompt=example_prompt,
+            examples=examples,
+            input_variables=["input"],
+        )
+
+    @property
+    def chains(self) -> dict:
+        if self._chains is None:
+            with self._lock:
+                if self._chains is None:
+                    # Resolve dependencies first so their phases are timed separately
+                    db, llm, _, few_shot_prompt = self.db, self.llm, self.table_details, self.few_shot_prompt
+                    self._chains = self._timed("chains", lambda: self._build_chains(db, llm, few_shot_prompt))
+        return self._chains
+
+    def _build_chains(self, db, llm, few_shot_prompt) -> dict:
+        # Load table selection prompt from config
+        table_details_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", TABLE_SELECTION_PROMPT),
+                ("human", "{question}")
+            ]
+        )
+        structured_llm = self.stage_llm("table_selection").with_structured_output(Table)
+        table_chain = table_details_prompt | structured_llm
+        llm_select_table = (
+            {"question": itemgetter("question"), "table_details": RunnableLambda(self.selection_table_details)} |
+            table_chain | get_tables
+        )
+        select_table = RunnableLambda(self.select_tables, afunc=self.aselect_tables)
+
+        # Load SQL generation prompt from config; examples, table info and input are rendered
+        # per question within the prompt budget (sql_prompt_inputs)
+        final_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", SQL_GENERATION_PROMPT),
+                MessagesPlaceholder("examples"),
+                ("human", "{input}"),
+            ]
+        ).partial(top_k=str(_SQL_TOP_K))
+        sql_prompt = RunnableLambda(self.sql_prompt_inputs) | final_prompt
+        # Table info comes from the schema cache instead of sample-row queries per question;
+        # one chain per SQL model tier, picked per question by inputs["sql_model"]
+        sql_model = self.model_tiers.model_for("sql_generation")
+        generate_queries = {
+            model: sql_prompt | self.llm_for(model).bind(stop=["\nSQLResult:"]) | StrOutputParser()
+            for model in dict.fromkeys(filter(None, [sql_model, self.model_tiers.strong_model]))
+        }
+        generate_query = generate_queries[sql_model]
+
+        rephrase_answer = RunnableLambda(self.format_answer, afunc=self.aformat_answer)
+        generate_sql = (
+            RunnableLambda(lambda inputs: generate_queries.get(inputs.get("sql_model"), generate_query)) |
+            RunnableLambda(_clean_generated_sql)
+        )
+        generation_chain = (
+            RunnablePassthrough.assign(table_names_to_use=select_table) |
+            RunnablePassthrough.assign(query=generate_sql)
+        )
+        fast_generation_chain = RunnablePassthrough.assign(query=generate_sql)
+        # Create the chain with retry logic integrated
+        chain = (
+            generation_chain |
+            RunnableLambda(self.execute_query_with_retry) |  # Custom retry logic here
             rephrase_answer
         )
-        response = fast_chain.invoke({"question": q, "messages": m, "table_details": table_details})
-    else:
-        response = chain.invoke({"question": q, "messages": m, "table_details": table_details})
-    
-    return response
+        return {
+            "few_shot_prompt": few_shot_prompt,
+            "table_chain": table_chain,
+            "llm_select_table": llm_select_table,
+            "select_table": select_table,
+            "generate_query": generate_query,
+            "generate_sql": generate_sql,
+            "rephrase_answer": rephrase_answer,
+            "generation_chain": generation_chain,
+            "fast_generation_chain": fast_generation_chain,
+            "chain": chain,
+        }
+
+    @property
+    def question_cache(self):
+        if not self._cache_ready:
+            with self._lock:
+                if not self._cache_ready:
+                    self._question_cache = self._timed("question_cache", cache_from_env)
+                    if self._question_cache:
+                        print(f"Question cache: {self._question_cache.path} ({self._question_cache.stats()['entries']} entries)")
+                    self._cache_ready = True
+        return self._question_cache
+
+    @property
+    def result_cache(self):
+        """In-memory SQL result cache, or None when RESULT_CACHE_ENABLED=false."""
+        if not _result_cache_enabled:
+            return None
+        if self._result_cache is None:
+            with self._lock:
+                if self._result_cache is None:
+                    self._result_cache = ResultCache(
+                        self.sql_engine,
+                        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                        ttl_seconds=float(os.getenv("RESULT_CACHE_TTL", "3600")),
+                        check_interval=float(os.getenv("RESULT_CACHE_CHECK_INTERVAL", "30")),
+                    )
+        return self._result_cache
+
+    def invalidate_results(self, table_names: List[str] = None) -> int:
+        """Drop cached results that read any of the given tables (or all). Returns entries removed."""
+        if self._result_cache is None:
+            return 0
+        return self._result_cache.invalidate(table_names)
+
+    @property
+    def schema_key(self) -> str:
+        # Any schema, prompt or model change starts a new question-cache namespace
+        if self._schema_key is None:
+            with self._lock:
+                if self._schema_key is None:
+                    self._schema_key = schema_fingerprint(
+                        *self.model_tiers.models(),
+                        sorted(self.db.get_usable_table_names()),
+                        self.table_details,
+                        SQL_GENERATION_PROMPT,
+                        TABLE_SELECTION_PROMPT,
+                        load_examples(FEW_SHOT_EXAMPLES, _few_shot_examples_path),
+                    )
+        return self._schema_key
+
+    # -- Warm-up -------------------------------------------------------------
+
+    def warm_up(self, background: bool = False):
+        """
+        Build every component now instead of on the first question.
+
+        Args:
+            background (bool): Run in a daemon thread and return it immediately
+
+        Returns:
+            threading.Thread | dict: The warm-up thread, or the init timings
+        """
+        if background:
+            if self._warmup_thread is None or not self._warmup_thread.is_alive():
+                self._warmup_thread = threading.Thread(target=self._warm_up, name="query-engine-warmup", daemon=True)
+                self._warmup_thread.start()
+            return self._warmup_thread
+        return self._warm_up()
+
+    def _warm_up(self) -> dict:
+        try:
+            self.chains
+            if _table_selector_mode != "llm":
+                self.table_selector
+            self.question_cache
+            self.schema_key
+        except Exception as e:
+            print(f"Query engine warm-up failed: {e}")
+            return self.init_timings
+        print(f"Query engine ready: {self.timings_report()}")
+        return self.init_timings
+
+    @property
+    def ready(self) -> bool:
+        return self._chains is not None
+
+    def timings_report(self) -> str:
+        """One-line breakdown of init time per phase."""
+        total = sum(self.init_timings.values())
+        phases = ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.init_timings.items())
+        return f"{total * 1000:.0f}ms total ({phases})"
+
+    # -- Pipeline stages -----------------------------------------------------
+
+    @property
+    def router(self):
+        """Per-question choice of table-selection stage (query_router; TABLE_SELECTOR, ROUTER_*)."""
+        if self._router is None:
+            with self._lock:
+                if self._router is None:
+                    self._router = router_from_env(_table_selector_mode)
+        return self._router
+
+    def route(self, question: str) -> RouteDecision:
+        """Decide which table-selection stage a question gets, recorded as a "routing" span."""
+        with span("routing"):
+            decision = self.router.route(question, self.table_selector if _table_selector_mode != "llm" else None)
+            annotate(route=decision.route, strategy=decision.strategy, confidence=round(decision.confidence, 4))
+        print(f"Route: {decision.route} ({decision.strategy}, {decision.confidence:.2f})")
+        return decision
+
+    def select_tables(self, inputs: dict) -> List[str]:
+        """
+        Pick tables for a question along its route.
+
+        Args:
+            inputs: Dict with 'question', 'table_details' and optionally 'route' (RouteDecision)
+
+        Returns:
+            List[str]: Table names for SQL generation
+        """
+        decision = inputs.get("route") or self.route(inputs["question"])
+        if decision.route == "llm":
+            return self.chains["llm_select_table"].invoke(inputs)
+        return self._routed_tables(decision)
+
+    def _table_relevance(self, question: str) -> dict:
+        """Local index score per table; prompt budgets drop the lowest-scored tables first."""
+        return self.table_selector.select(question)["scores"]
+
+    def selection_table_details(self, inputs: dict) -> str:
+        """Table descriptions for the table-selection prompt, within PROMPT_BUDGET_DESCRIPTIONS."""
+        if self._table_descriptions is None:
+            _ = self.table_details
+        return self.prompt_budget.table_details(inputs["question"], TABLE_SELECTION_PROMPT,
+                                                self._table_descriptions, self._table_relevance)
+
+    def sql_prompt_inputs(self, inputs: dict) -> dict:
+        """
+        Render the SQL prompt's variables within the prompt budget.
+
+        Args:
+            inputs: Dict with 'question', 'table_names_to_use' (None = every table) and optionally 'messages'
+
+        Returns:
+            dict: {"input", "table_info", "examples"} for the SQL generation prompt
+        """
+        question = inputs["question"]
+        tables = self.schema_info.table_infos(inputs.get("table_names_to_use"))
+        examples = self.few_shot_prompt.format_messages(input=question + "\nSQLQuery: ")
+        return self.prompt_budget.sql_inputs(question, SQL_GENERATION_PROMPT, tables, examples,
+                                             inputs.get("messages"), self._table_relevance)
+
+    def _routed_tables(self, decision: RouteDecision) -> List[str]:
+        """Tables for the local and fast routes (every table when the index had nothing)."""
+        if decision.tables:
+            return decision.tables
+        return list(self.db.get_usable_table_names())
+
+    def _choose_sql_model(self, inputs: dict) -> None:
+        """Set inputs["sql_model"] / ["escalation"]: hard questions may go to the strong model."""
+        decision = inputs.get("route")
+        inputs["sql_model"], inputs["escalation"] = self.model_tiers.sql_model(
+            inputs["question"], llm_routed=decision is not None and decision.route == "llm")
+
+    def _record_route(self, q: str, decision: RouteDecision, inputs: dict, executed: dict, started: float) -> None:
+        """
+        Record a routed question's outcome for route success/latency stats and, with
+        ROUTER_LOG set, log it for table accuracy and classifier training.
+        """
+        try:
+            ok = not executed.get("error")
+            index_tables = sql_tables = None
+            # The index ranking and the SQL parse only feed the log (and table accuracy); skip them without it
+            if self.router.log_path:
+                if decision.route == "local":
+                    index_tables = decision.tables
+                elif _table_selector_mode != "llm":
+                    index_tables = self.table_selector.select(q)["tables"]
+                sql_tables = referenced_tables(executed["query"], db_type) if ok and referenced_tables else None
+            chosen_tables = None if decision.route == "fast" else inputs.get("table_names_to_use")
+            self.router.record(q, decision, chosen_tables, index_tables, sql_tables, ok,
+                               executed.get("attempts", 1), time.perf_counter() - started)
+        except Exception as e:
+            print(f"Routing outcome not recorded: {e}")
+
+    def _table_guess(self, question: str) -> Optional[List[str]]:
+        """
+        Tables to generate SQL on speculatively while Gemini selects tables.
+
+        Returns:
+            List[str] | None: The local index's ranking, or None when speculation is off
+        """
+        if not _speculative_sql:
+            return None
+        return self.table_selector.select(question)["tables"] or None
+
+    @property
+    def speculation_pool(self) -> ThreadPoolExecutor:
+        if self._speculation_pool is None:
+            with self._lock:
+                if self._speculation_pool is None:
+                    self._speculation_pool = ThreadPoolExecutor(_speculative_workers, thread_name_prefix="speculative-sql")
+        return self._speculation_pool
+
+    def _generate_speculative_sql(self, inputs: dict) -> str:
+        with span("sql_generation", speculative=True, model=inputs.get("sql_model"),
+                  escalation=inputs.get("escalation")):
+            return self.chains["generate_sql"].invoke(inputs)
+
+    async def _agenerate_speculative_sql(self, inputs: dict) -> str:
+        with span("sql_generation", speculative=True, model=inputs.get("sql_model"),
+                  escalation=inputs.get("escalation")):
+            return await self.chains["generate_sql"].ainvoke(inputs)
+
+    @staticmethod
+    def _speculation_usable(guess: List[str], selected: List[str], sql_query: Optional[str]) -> bool:
+        """Keep speculative SQL if it was generated on the selected tables or only reads selected tables."""
+        selected = {table.lower() for table in selected or []}
+        if {table.lower() for table in guess} == selected:
+            return True
+        if not sql_query or referenced_tables is None:
+            return False
+        used = referenced_tables(sql_query, db_type)
+        return bool(used) and set(used) <= selected
+
+    def _start_speculation(self, inputs: dict):
+        """Start SQL generation on guessed tables in a worker thread; returns (guess, future) or None."""
+        guess = self._table_guess(inputs["question"])
+        if guess is None:
+            return None
+        print(f"Speculative SQL generation on {guess}")
+        context = contextvars.copy_context()  # keeps the speculative span in this question's trace
+        return guess, self.speculation_pool.submit(context.run, self._generate_speculative_sql,
+                                                   {**inputs, "table_names_to_use": guess})
+
+    def _resolve_speculation(self, speculation, selected: List[str]) -> Optional[str]:
+        """Speculative SQL if it fits the selected tables, else None (the caller regenerates)."""
+        guess, future = speculation
+        with span("speculation", guessed=len(guess), selected=len(selected or [])):
+            try:
+                sql_query = future.result()
+            except Exception as e:
+                print(f"Speculative SQL generation failed: {e}")
+                sql_query = None
+            hit = self._speculation_usable(guess, selected, sql_query)
+            annotate(speculation_hit=hit)
+        print("Speculative SQL kept" if hit else "Speculation missed; regenerating SQL")
+        return sql_query if hit else None
+
+    async def _aresolve_speculation(self, speculation, selected: List[str]) -> Optional[str]:
+        """Async _resolve_speculation: a guess that cannot match is cancelled instead of awaited."""
+        guess, task = speculation
+        with span("speculation", guessed=len(guess), selected=len(selected or [])):
+            sql_query = None
+            same_tables = {table.lower() for table in guess} == {table.lower() for table in selected or []}
+            # Without sqlglot only an exact table match can be kept
+            if same_tables or referenced_tables is not None:
+                try:
+                    sql_query = await task
+                except Exception as e:
+                    print(f"Speculative SQL generation failed: {e}")
+            else:
+                task.cancel()
+            hit = self._speculation_usable(guess, selected, sql_query)
+            annotate(speculation_hit=hit)
+        print("Speculative SQL kept" if hit else "Speculation missed; regenerating SQL")
+        return sql_query if hit else None
+
+    def _answer_inputs(self, input_dict: dict) -> dict:
+        """
+        Prepare the answer stage.
+
+        Returns:
+            dict: "direct" (answer that needs no LLM, or None), "result" (prompt
+            text), "message" (full prompt) and "note" (download hint to append)
+        """
+        question = input_dict.get("question", "")
+        query_result = input_dict.get("query_result")
+        mode = input_dict.get("answer_mode") or _answer_mode
+        note = ""
+        if query_result is not None:
+            # Results with a known shape (single value, short list, small table) are rendered
+            # without the LLM; in template mode every result is
+            direct = template_answer(question, query_result, max_items=_template_max_items,
+                                     max_rows=_template_max_rows, max_columns=_template_max_columns,
+                                     force=mode == "template") if mode != "llm" else None
+            if direct:
+                if query_result.truncated or query_result.row_count > _template_max_rows:
+                    note = self._download_note(query_result)
+                annotate(direct=True)
+                return {"direct": direct + note, "result": "", "message": "", "note": ""}
+            # Typed results are stringified here, at the prompt boundary; large
+            # ones are reduced to a local summary plus a CSV download
+            if needs_summary(query_result, _summary_max_rows, _summary_max_bytes):
+                result = summarize(query_result, top_n=int(os.getenv("SUMMARY_TOP_N", "10")))
+                annotate(summarized=True)
+                note = self._download_note(query_result)
+            else:
+                result = query_result.to_prompt_text()
+        elif mode == "template" and input_dict.get("error"):
+            annotate(direct=True)
+            return {"direct": f"Sorry, I could not answer that: the database query failed ({input_dict['error']}).",
+                    "result": "", "message": "", "note": ""}
+        else:
+            result = input_dict.get("result", "")
+
+        # If result is empty, provide a default message
+        if not result or result.strip() == "":
+            result = "No data returned from the database query."
+
+        # Format the prompt message
+        return {"direct": None, "result": result, "note": note,
+                "message": ANSWER_GENERATION_PROMPT.format(question=question, result=result)}
+
+    def _download_note(self, query_result) -> str:
+        """CSV download line for an answer; a result cut at QUERY_MAX_ROWS is not called the full result."""
+        label = (f"First {query_result.row_count} rows (truncated at the fetch limit)" if query_result.truncated
+                 else f"Full result ({query_result.row_count} rows)")
+        return f"\n\n{label}: /api/results/{self.result_store.put(query_result)}.csv"
+
+    @staticmethod
+    def _is_timeout(error: Exception) -> bool:
+        error_str = str(error)
+        return "DEADLINE_EXCEEDED" in error_str or "timeout" in error_str.lower() or "504" in error_str
+
+    @staticmethod
+    def _timeout_answer(result: str) -> str:
+        return f"The query took too long to process. The database query returned: {result}. Please try rephrasing your question or breaking it into smaller parts."
+
+    def format_answer(self, input_dict: dict) -> str:
+        """Format the answer by invoking the prompt with the result"""
+        with span("answer_generation"):
+            return self._format_answer(input_dict)
+
+    def _format_answer(self, input_dict: dict) -> str:
+        prepared = self._answer_inputs(input_dict)
+        if prepared["direct"]:
+            return prepared["direct"]
+
+        # Get LLM response - create a message object (with timeout handling)
+        from langchain_core.messages import HumanMessage
+        try:
+            response = self.stage_llm("answer").invoke([HumanMessage(content=prepared["message"])])
+        except Exception as e:
+            if self._is_timeout(e):
+                return self._timeout_answer(prepared["result"])
+            raise  # Re-raise other errors
+
+        return self._response_text(response) + prepared["note"]
+
+    def summarize_history(self, summary: str, messages: List[dict]) -> str:
+        """Fold chat turns that left the history window into the session's rolling summary."""
+        from langchain_core.messages import HumanMessage
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        prompt = HISTORY_SUMMARY_PROMPT.format(summary=summary or "(none)", messages=transcript)
+        return self._response_text(self.llm.invoke([HumanMessage(content=prompt)])).strip()
+
+    @staticmethod
+    def _response_text(response) -> str:
+        # Extract content (always return a string for the API/frontend)
+        if isinstance(response, str):
+            return response
+        if hasattr(response, 'content'):
+            content = response.content
+            if isinstance(content, str):
+                return content
+            if isinstance(content, dict) and content.get("text"):
+                return content["text"]
+            if isinstance(content, list) and content:
+                part = content[0]
+                if isinstance(part, dict) and part.get("text"):
+                    return part["text"]
+                return getattr(part, 'text', part) if hasattr(part, 'text') else str(part)
+            return str(content) if content is not None else "No response."
+        if isinstance(response, dict) and response.get("text"):
+            return response["text"]
+        return str(response)
+
+    def stream_answer(self, input_dict: dict):
+        """Like format_answer, but yields the answer text chunk by chunk via llm.stream."""
+        with span("answer_generation", streamed=True):
+            yield from self._stream_answer(input_dict)
+
+    def _stream_answer(self, input_dict: dict):
+        prepared = self._answer_inputs(input_dict)
+        if prepared["direct"]:
+            yield prepared["direct"]
+            return
+        from langchain_core.messages import HumanMessage
+        try:
+            for chunk in self.stage_llm("answer").stream([HumanMessage(content=prepared["message"])]):
+                content = getattr(chunk, "content", chunk)
+                if isinstance(content, list):
+                    content = "".join(
+                        part.get("text", "") if isinstance(part, dict) else getattr(part, "text", str(part))
+                        for part in content
+                    )
+                if content:
+                    yield str(content)
+        except Exception as e:
+            if self._is_timeout(e):
+                yield self._timeout_answer(prepared["result"])
+                return
+            raise
+        if prepared["note"]:
+            yield prepared["note"]
+
+    def run_query(self, sql_query: str):
+        """
+        Execute SQL on a server-side cursor within the QUERY_MAX_ROWS / QUERY_MAX_BYTES budget,
+        in a read-only transaction with a statement timeout, after the EXPLAIN cost check.
+
+        Database errors and policy rejections are raised so the retry loop sees them
+        (a rejection's message tells the correction prompt what to change).
+
+        Returns:
+            QueryResult: Typed rows; converted to text only for the answer prompt
+        """
+        return execute_bounded(self.sql_engine, sql_query, policy=self.execution_policy)
+
+    def run_queries(self, sql_queries: List[str]) -> list:
+        """
+        Execute several queries on one pooled connection, each under the same
+        budget and guardrails as run_query.
+
+        Returns:
+            list: A QueryResult or the raised exception per query
+        """
+        return execute_many(self.sql_engine, sql_queries, policy=self.execution_policy)
+
+    def repair_sql(self, sql_query: str) -> str:
+        """
+        Check a query against the schema catalog and apply deterministic fixes
+        (identifier case/quoting, misplaced deleted_status, NULLIF casts on ACS
+        TEXT estimates) so common failures never reach the database or the
+        LLM correction prompt.
+
+        Args:
+            sql_query (str): Generated or corrected SQL
+
+        Returns:
+            str: The query to execute (unchanged if nothing needed fixing or validation is off)
+        """
+        if not _sql_repair or validate_and_repair is None:
+            return sql_query
+        with span("sql_validation"):
+            try:
+                repaired = validate_and_repair(sql_query, self.schema_catalog.tables(), db_type)
+            except Exception as e:
+                print(f"SQL validation skipped: {e}")
+                return sql_query
+            annotate(fixes=len(repaired.fixes), problems=len(repaired.problems), repaired=bool(repaired.fixes))
+        if repaired.fixes:
+            print(f"Repaired locally: {', '.join(repaired.fixes)}")
+        if repaired.problems:
+            # The database stays the authority: run it anyway and let the LLM correct on failure
+            print(f"Validation problems: {', '.join(repaired.problems)}")
+        return repaired.sql
+
+    def _cached_result(self, sql_query: str):
+        """
+        Result-cache lookup, recorded as a span with hit/miss.
+
+        Returns:
+            (tuple | None, QueryResult | None): (key, tables) to store under after
+            executing (None if the query is not cacheable), and the cached result on a hit
+        """
+        result_cache = self.result_cache
+        if not result_cache:
+            return None, None
+        with span("cache_lookup", cache="result"):
+            lookup = result_cache.lookup_key(sql_query)
+            cached = result_cache.get(lookup[0]) if lookup else None
+            annotate(hit=cached is not None)
+        return lookup, cached
+
+    def _store_result(self, lookup, query_result) -> None:
+        if lookup:
+            self.result_cache.put(lookup[0], lookup[1], query_result)
+
+    @staticmethod
+    def _success_result(inputs: dict, sql_query: str, query_result, attempts: int = 1) -> dict:
+        """Executed-stage output: the typed result travels on; text is rendered only for the prompt."""
+        print(f"Query result: {query_result.row_count} rows{' (truncated)' if query_result.truncated else ''}")
+        return {**inputs, "query": sql_query, "error": None, "query_result": query_result,
+                "row_count": query_result.row_count, "truncated": query_result.truncated, "attempts": attempts}
+
+    def execute_query_with_retry(self, inputs: dict) -> dict:
+        """
+        Custom LangChain runnable that executes SQL with retry logic.
+        This keeps everything in a single trace.
+
+        Args:
+            inputs: Dict with 'query', 'question', 'table_details'
+
+        Returns:
+            Dict with 'result' or 'error'
+        """
+        sql_query = inputs["query"] = self.repair_sql(inputs.get("query"))
+        question = inputs.get("question")
+        max_retries = 2
+        attempt = 0
+
+        print(f"Executing: {sql_query}")
+
+        while attempt < max_retries:
+            try:
+                lookup, query_result = self._cached_result(sql_query)
+                if query_result is not None:
+                    print("Result cache hit")
+                    return self._success_result(inputs, sql_query, query_result, attempt + 1)
+                with span("db_execution", attempt=attempt + 1):
+                    query_result = self.run_query(sql_query)
+                    annotate(rows=query_result.row_count, truncated=query_result.truncated,
+                             limit_added=query_result.limit_added, plan=query_result.plan_estimate)
+                print(f"Query OK (attempt {attempt + 1})")
+                self._store_result(lookup, query_result)
+                return self._success_result(inputs, sql_query, query_result, attempt + 1)
+            except Exception as e:
+                error_message = str(e)
+                print(f"Query failed (attempt {attempt + 1}): {error_message}")
+                attempt += 1
+
+                if attempt < max_retries:
+                    print("Attempting query correction...")
+                    # Correct the query using LLM
+                    correction_prompt = _correction_prompt(question, sql_query, error_message)
+
+                    try:
+                        # A failed execution may escalate the correction to the strong model
+                        model, escalation = self.model_tiers.correction_model()
+                        with span("sql_correction", attempt=attempt, model=model, escalation=escalation), \
+                                llm_priority("correction"):
+                            corrected = self.llm_for(model).invoke(correction_prompt)
+                            sql_query = clean_sql_query(corrected.content if hasattr(corrected, 'content') else str(corrected))
+                        print(f"Corrected query: {sql_query}")
+                        sql_query = self.repair_sql(sql_query)
+                        inputs["query"] = sql_query  # Update the query for next attempt
+                    except Exception as correction_error:
+                        if self._is_timeout(correction_error):
+                            print("Query correction timed out.")
+                            break  # Don't retry if correction itself times out
+                        print(f"Correction error: {correction_error}")
+                        break
+                else:
+                    print("All retries exhausted")
+                    # Return error in a format the answer chain can handle
+                    return _failure_result(inputs, sql_query, error_message, max_retries)
+
+        return {**inputs, "result": "Unable to process the query", "query": sql_query if 'sql_query' in locals() else "N/A", "error": "Max retries reached"}
+
+    def chain_code(self, q, m=None, answer_mode: str = None):
+        """
+        Execute the SQL chain to answer a question: table selection, SQL
+        generation, execution with retry, then answer rephrasing.
+
+        Args:
+            q (str): The user's question
+            m (list, optional): Message history for context
+            answer_mode (str, optional): "auto", "template" or "llm" (default ANSWER_MODE)
+
+        Returns:
+            str: The AI's response
+        """
+        if m is None:
+            m = []
+
+        with trace("chain_code", q):
+            executed = _drain(self._answer_stages(q, m, answer_mode))
+            return self.chains["rephrase_answer"].invoke(executed)
+
+    def stream_chain_code(self, q, m=None, answer_mode: str = None):
+        """
+        Answer a question as a stream of stage events.
+
+        Yields dicts with an "event" key: "tables", "sql", "executed" (with
+        row_count), then one "token" per answer chunk and a final "done" carrying
+        the full answer. Failures are reported as an "error" event.
+
+        Args:
+            q (str): The user's question
+            m (list, optional): Message history for context
+            answer_mode (str, optional): "auto", "template" or "llm" (default ANSWER_MODE)
+        """
+        with trace("stream_chain_code", q):
+            try:
+                executed = yield from self._answer_stages(q, m or [], answer_mode)
+                parts = []
+                for text in self.stream_answer(executed):
+                    parts.append(text)
+                    yield {"event": "token", "text": text}
+                yield {"event": "done", "answer": "".join(parts)}
+            except Exception as e:
+                yield {"event": "error", "error": str(e)}
+
+    def _cache_context(self, inputs: dict) -> str:
+        """Chat history the SQL prompt will contain; part of the question-cache key."""
+        return self.prompt_budget.history_text(inputs["question"], inputs.get("messages"))
+
+    def _cached_sql(self, q: str, context: str = ""):
+        """Question-cache lookup, recorded as a span with hit/miss."""
+        question_cache = self.question_cache
+        if not question_cache:
+            return None
+        with span("cache_lookup", cache="question"):
+            cached = question_cache.get(q, self.schema_key, context)
+            annotate(hit=cached is not None)
+        return cached
+
+    def _answer_stages(self, q, m, answer_mode: str = None):
+        """Table selection, SQL generation and execution; yields stage events, returns the executed dict."""
+        chains = self.chains
+        print(f"Processing: {q[:60]}...")
+        inputs = {"question": q, "messages": m, "table_details": self.table_details, "answer_mode": answer_mode}
+
+        # Repeated questions reuse the stored SQL and skip both generation LLM calls
+        question_cache = self.question_cache
+        cache_context = self._cache_context(inputs)
+        cached = self._cached_sql(q, cache_context)
+        if cached:
+            print("Question cache hit")
+            inputs.update(query=cached["query"], table_names_to_use=cached["tables"])
+            yield {"event": "tables", "tables": cached["tables"], "cached": True}
+            yield {"event": "sql", "query": cached["query"], "cached": True}
+        else:
+            started = time.perf_counter()
+            decision = inputs["route"] = self.route(q)
+            self._choose_sql_model(inputs)
+            if decision.route == "fast":
+                print("Using fast path (no table selection)")
+            else:
+                # Optionally overlap SQL generation on guessed tables with the LLM table selection
+                speculation = self._start_speculation(inputs) if decision.route == "llm" else None
+                with span("table_selection"):
+                    inputs["table_names_to_use"] = chains["select_table"].invoke(inputs)
+                    annotate(tables=len(inputs["table_names_to_use"]))
+                yield {"event": "tables", "tables": inputs["table_names_to_use"], "cached": False}
+                if speculation:
+                    inputs["query"] = self._resolve_speculation(speculation, inputs["table_names_to_use"])
+            if not inputs.get("query"):
+                with span("sql_generation", model=inputs["sql_model"], escalation=inputs["escalation"]):
+                    inputs["query"] = chains["generate_sql"].invoke(inputs)
+            yield {"event": "sql", "query": inputs["query"], "cached": False}
+
+        executed = self.execute_query_with_retry(inputs)
+        yield {"event": "executed", "query": executed["query"], "row_count": executed.get("row_count"),
+               "truncated": executed.get("truncated", False), "error": executed.get("error")}
+        if not cached:
+            self._record_route(q, decision, inputs, executed, started)
+        if question_cache and not cached and not executed.get("error"):
+            question_cache.put(q, self.schema_key, executed["query"], inputs.get("table_names_to_use"),
+                               cache_context)
+        return executed
+
+
+    # -- Batch API ---------------------------------------------------------------
+
+    def chain_code_batch(self, questions: List[str], max_concurrency: int = None,
+                         answer_mode: str = None) -> List[dict]:
+        """
+        Answer many questions in one call, sharing each stage across the batch.
+
+        Identical questions (compared after normalize_question) are answered once.
+        Table selection, SQL generation and answer rephrasing run through
+        Runnable.batch with at most `max_concurrency` LLM calls in flight; the
+        distinct generated queries are executed one after another on a single
+        pooled connection. Queries that fail there get the usual correction and
+        retry loop. A failure in one question does not affect the others. All LLM
+        calls run at "batch" priority in the LLM scheduler.
+
+        Args:
+            questions (List[str]): Questions to answer (no message history)
+            max_concurrency (int, optional): Parallel LLM calls per stage (default BATCH_CONCURRENCY)
+            answer_mode (str, optional): "auto", "template" or "llm" (default ANSWER_MODE)
+
+        Returns:
+            List[dict]: {"question", "answer", "query", "row_count", "error"} per
+            question, in input order
+        """
+        config = {"max_concurrency": max(1, max_concurrency or _batch_concurrency)}
+        chains = self.chains
+        items, positions, index = [], [], {}
+        for q in questions:
+            key = normalize_question(q)
+            if key not in index:
+                index[key] = len(items)
+                items.append({"question": q, "messages": [], "table_details": self.table_details,
+                              "answer_mode": answer_mode})
+            positions.append(index[key])
+        print(f"Batch: {len(questions)} questions ({len(items)} unique)")
+
+        # Batch LLM calls queue behind interactive questions in the LLM scheduler
+        with trace("chain_code_batch", f"{len(items)} questions"), llm_priority("batch"):
+            started = time.perf_counter()
+            errors = [None] * len(items)
+            cached = set()
+            for i, inputs in enumerate(items):
+                hit = self._cached_sql(inputs["question"], self._cache_context(inputs))
+                if hit:
+                    inputs.update(query=hit["query"], table_names_to_use=hit["tables"])
+                    cached.add(i)
+                    continue
+                decision = inputs["route"] = self.route(inputs["question"])
+                self._choose_sql_model(inputs)
+                if decision.route == "local":
+                    inputs["table_names_to_use"] = self._routed_tables(decision)
+
+            selecting = [i for i, inputs in enumerate(items)
+                         if i not in cached and inputs["route"].route == "llm"]
+            if selecting:
+                with span("table_selection", batch=len(selecting)):
+                    selected = chains["llm_select_table"].batch(
+                        [items[i] for i in selecting], config=config, return_exceptions=True)
+                for i, tables in zip(selecting, selected):
+                    if isinstance(tables, Exception):
+                        errors[i] = f"Table selection failed: {tables}"
+                    else:
+                        items[i]["table_names_to_use"] = tables
+
+            generating = [i for i in range(len(items)) if i not in cached and errors[i] is None]
+            if generating:
+                with span("sql_generation", batch=len(generating),
+                          escalated=sum(1 for i in generating if items[i]["escalation"])):
+                    generated = chains["generate_sql"].batch(
+                        [items[i] for i in generating], config=config, return_exceptions=True)
+                for i, sql_query in zip(generating, generated):
+                    if isinstance(sql_query, Exception):
+                        errors[i] = f"SQL generation failed: {sql_query}"
+                    else:
+                        items[i]["query"] = sql_query
+
+            runnable = [i for i in range(len(items)) if errors[i] is None]
+            executed = dict(zip(runnable, self._execute_batch([items[i] for i in runnable], config)))
+
+            # format_answer records an answer_generation span per question
+            answers = dict(zip(runnable, chains["rephrase_answer"].batch(
+                [executed[i] for i in runnable], config=config, return_exceptions=True)))
+
+            question_cache = self.question_cache
+            for i in runnable:
+                outcome = executed[i]
+                if i in cached:
+                    continue
+                self._record_route(items[i]["question"], items[i]["route"], items[i], outcome, started)
+                if question_cache and not outcome.get("error"):
+                    question_cache.put(items[i]["question"], self.schema_key, outcome["query"],
+                                       items[i].get("table_names_to_use"), self._cache_context(items[i]))
+
+        results = []
+        for i in range(len(items)):
+            outcome, answer = executed.get(i, {}), answers.get(i)
+            if isinstance(answer, Exception):
+                errors[i], answer = f"Answer generation failed: {answer}", None
+            results.append({"answer": answer if answer is None or isinstance(answer, str) else str(answer),
+                            "query": outcome.get("query", items[i].get("query")),
+                            "row_count": outcome.get("row_count"),
+                            "error": errors[i] or outcome.get("error")})
+        return [{"question": q, **results[i]} for q, i in zip(questions, positions)]
+
+    def _execute_batch(self, items: List[dict], config: dict) -> List[dict]:
+        """
+        Execute a batch's SQL: identical queries run once, result-cache hits are
+        served from memory, the rest run on one pooled connection, and failures go
+        through execute_query_with_retry in parallel.
+
+        Returns:
+            List[dict]: Executed-stage output per item (as execute_query_with_retry)
+        """
+        results = [None] * len(items)
+        groups = {}
+        for n, inputs in enumerate(items):
+            inputs["query"] = self.repair_sql(inputs["query"])
+            groups.setdefault(inputs["query"], []).append(n)
+
+        pending = []
+        for sql_query, members in groups.items():
+            lookup, query_result = self._cached_result(sql_query)
+            if query_result is None:
+                pending.append((sql_query, lookup, members))
+                continue
+            for n in members:
+                results[n] = self._success_result(items[n], sql_query, query_result)
+
+        failed = []
+        if pending:
+            print(f"Executing {len(pending)} distinct queries on one connection")
+            with span("db_execution", batch=len(pending)):
+                try:
+                    outcomes = self.run_queries([sql_query for sql_query, _, _ in pending])
+                except Exception as e:  # Connection lost: every query gets the retry loop
+                    print(f"Batch execution failed: {e}")
+                    outcomes = [e] * len(pending)
+                annotate(failed=sum(isinstance(outcome, Exception) for outcome in outcomes))
+            for (sql_query, lookup, members), outcome in zip(pending, outcomes):
+                if isinstance(outcome, Exception):
+                    print(f"Query failed in batch: {outcome}")
+                    failed.extend(members)
+                    continue
+                self._store_result(lookup, outcome)
+                for n in members:
+                    results[n] = self._success_result(items[n], sql_query, outcome)
+
+        if failed:
+            # Corrections are per question LLM calls, so they run in parallel too
+            with ThreadPoolExecutor(min(len(failed), config["max_concurrency"]),
+                                    thread_name_prefix="batch-retry") as pool:
+                futures = {n: pool.submit(contextvars.copy_context().run, self.execute_query_with_retry, items[n])
+                           for n in failed}
+                for n, future in futures.items():
+                    try:
+                        results[n] = future.result()
+                    except Exception as e:
+                        results[n] = _failure_result(items[n], items[n]["query"], str(e), 1)
+        return results
+
+
+    # -- Async API ---------------------------------------------------------------
+
+    @property
+    def async_runner(self) -> AsyncQueryRunner:
+        """Async SQL executor (asyncpg / aiosqlite; worker-thread fallback)."""
+        if self._async_runner is None:
+            with self._lock:
+                if self._async_runner is None:
+                    self._async_runner = AsyncQueryRunner(get_database_uri(), self.run_query, self.execution_policy)
+        return self._async_runner
+
+    async def _ensure_ready(self) -> None:
+        # Lazy init does blocking I/O; keep it off the event loop
+        if not self.ready:
+            await asyncio.to_thread(lambda: self.chains)
+
+    async def aselect_tables(self, inputs: dict) -> List[str]:
+        """Async select_tables: routing and the local index are in-process, only the LLM route awaits."""
+        decision = inputs.get("route") or self.route(inputs["question"])
+        if decision.route == "llm":
+            return await self.chains["llm_select_table"].ainvoke(inputs)
+        return self._routed_tables(decision)
+
+    async def aformat_answer(self, input_dict: dict) -> str:
+        """Async format_answer."""
+        with span("answer_generation"):
+            return await self._aformat_answer(input_dict)
+
+    async def _aformat_answer(self, input_dict: dict) -> str:
+        # The pandas summary / template rendering of a large result would stall the loop
+        prepared = await asyncio.to_thread(self._answer_inputs, input_dict)
+        if prepared["direct"]:
+            return prepared["direct"]
+        from langchain_core.messages import HumanMessage
+        try:
+            response = await self.stage_llm("answer").ainvoke([HumanMessage(content=prepared["message"])])
+        except Exception as e:
+            if self._is_timeout(e):
+                return self._timeout_answer(prepared["result"])
+            raise
+        return self._response_text(response) + prepared["note"]
+
+    async def aexecute_query_with_retry(self, inputs: dict) -> dict:
+        """Async execute_query_with_retry: awaits the database and the correction LLM call."""
+        # Validation reads the (cached) catalog synchronously, so keep it off the event loop
+        sql_query = inputs["query"] = await asyncio.to_thread(self.repair_sql, inputs.get("query"))
+        question = inputs.get("question")
+        max_retries = 2
+
+        print(f"Executing: {sql_query}")
+        for attempt in range(max_retries):
+            try:
+                # Table-version checks query the database, so keep the lookup off the event loop
+                lookup, query_result = await asyncio.to_thread(self._cached_result, sql_query)
+                if query_result is not None:
+                    print("Result cache hit")
+                    return self._success_result(inputs, sql_query, query_result, attempt + 1)
+                with span("db_execution", attempt=attempt + 1):
+                    query_result = await self.async_runner.run(sql_query)
+                    annotate(rows=query_result.row_count, truncated=query_result.truncated,
+                             limit_added=query_result.limit_added, plan=query_result.plan_estimate)
+                print(f"Query OK (attempt {attempt + 1})")
+                self._store_result(lookup, query_result)
+                return self._success_result(inputs, sql_query, query_result, attempt + 1)
+            except Exception as e:
+                error_message = str(e)
+                print(f"Query failed (attempt {attempt + 1}): {error_message}")
+                if attempt + 1 >= max_retries:
+                    print("All retries exhausted")
+                    return _failure_result(inputs, sql_query, error_message, max_retries)
+                print("Attempting query correction...")
+                try:
+                    model, escalation = self.model_tiers.correction_model()
+                    with span("sql_correction", attempt=attempt + 1, model=model, escalation=escalation), \
+                            llm_priority("correction"):
+                        corrected = await self.llm_for(model).ainvoke(_correction_prompt(question, sql_query, error_message))
+                except Exception as correction_error:
+                    print("Query correction timed out." if self._is_timeout(correction_error) else f"Correction error: {correction_error}")
+                    break
+                sql_query = clean_sql_query(corrected.content if hasattr(corrected, 'content') else str(corrected))
+                print(f"Corrected query: {sql_query}")
+                sql_query = await asyncio.to_thread(self.repair_sql, sql_query)
+                inputs["query"] = sql_query
+
+        return {**inputs, "result": "Unable to process the query", "query": sql_query, "error": "Max retries reached"}
+
+    async def achain_code(self, q, m=None, answer_mode: str = None):
+        """
+        Async chain_code: LLM stages use ainvoke and SQL runs on the async engine,
+        so many questions can be in flight on one event loop.
+
+        Args:
+            q (str): The user's question
+            m (list, optional): Message history for context
+            answer_mode (str, optional): "auto", "template" or "llm" (default ANSWER_MODE)
+
+        Returns:
+            str: The AI's response
+        """
+        await self._ensure_ready()
+        chains = self.chains
+        print(f"Processing: {q[:60]}...")
+        inputs = {"question": q, "messages": m or [], "table_details": self.table_details, "answer_mode": answer_mode}
+
+        with trace("achain_code", q):
+            # Question-cache SQLite, local index lookups and the router log block; keep them off the loop
+            # (to_thread copies the context, so their spans join this trace)
+            question_cache = self.question_cache
+            cache_context = self._cache_context(inputs)
+            cached = await asyncio.to_thread(self._cached_sql, q, cache_context)
+            if cached:
+                print("Question cache hit")
+                inputs.update(query=cached["query"], table_names_to_use=cached["tables"])
+            else:
+                started = time.perf_counter()
+                decision = inputs["route"] = await asyncio.to_thread(self.route, q)
+                self._choose_sql_model(inputs)
+                if decision.route == "fast":
+                    print("Using fast path (no table selection)")
+                else:
+                    speculation = None
+                    guess = await asyncio.to_thread(self._table_guess, q) if decision.route == "llm" else None
+                    if guess is not None:
+                        print(f"Speculative SQL generation on {guess}")
+                        # create_task copies the context, so the speculative span joins this trace
+                        speculation = guess, asyncio.create_task(
+                            self._agenerate_speculative_sql({**inputs, "table_names_to_use": guess}))
+                    with span("table_selection"):
+                        inputs["table_names_to_use"] = await chains["select_table"].ainvoke(inputs)
+                        annotate(tables=len(inputs["table_names_to_use"]))
+                    if speculation:
+                        inputs["query"] = await self._aresolve_speculation(speculation, inputs["table_names_to_use"])
+                if not inputs.get("query"):
+                    with span("sql_generation", model=inputs["sql_model"], escalation=inputs["escalation"]):
+                        inputs["query"] = await chains["generate_sql"].ainvoke(inputs)
+
+            executed = await self.aexecute_query_with_retry(inputs)
+            if not cached:
+                await asyncio.to_thread(self._record_route, q, decision, inputs, executed, started)
+            if question_cache and not cached and not executed.get("error"):
+                await asyncio.to_thread(question_cache.put, q, self.schema_key, executed["query"],
+                                        inputs.get("table_names_to_use"), cache_context)
+            return await chains["rephrase_answer"].ainvoke(executed)
+
+
+def _clean_generated_sql(text: str) -> str:
+    with span("sql_cleaning"):
+        return clean_sql_query(text)
+
+
+def _drain(stages):
+    """Run a stage generator to completion and return its return value."""
+    while True:
+        try:
+            next(stages)
+        except StopIteration as stop:
+            return stop.value
+
+
+# Shared engine for the web app and scripts; nothing is built until first use
+engine = QueryEngine()
+
+
+def chain_code(q, m=None, answer_mode: str = None):
+    """Answer a question with the shared engine (see QueryEngine.chain_code)."""
+    return engine.chain_code(q, m, answer_mode)
+
+
+def chain_code_batch(questions: List[str], max_concurrency: int = None, answer_mode: str = None) -> List[dict]:
+    """Answer many questions in one call with the shared engine (see QueryEngine.chain_code_batch)."""
+    return engine.chain_code_batch(questions, max_concurrency, answer_mode)
+
+
+def execute_query_with_retry(inputs: dict) -> dict:
+    """Execute SQL with retry/correction on the shared engine."""
+    return engine.execute_query_with_retry(inputs)
+
+
+def format_answer(input_dict: dict) -> str:
+    """Rephrase a query result with the shared engine's LLM."""
+    return engine.format_answer(input_dict)
+
+
+async def achain_code(q, m=None, answer_mode: str = None):
+    """Answer a question asynchronously with the shared engine (see QueryEngine.achain_code)."""
+    return await engine.achain_code(q, m, answer_mode)
+
+
+def stream_chain_code(q, m=None, answer_mode: str = None):
+    """Stream stage events and answer tokens with the shared engine (see QueryEngine.stream_chain_code)."""
+    return engine.stream_chain_code(q, m, answer_mode)
+
+
+_ENGINE_ATTRIBUTES = {"db", "llm", "table_details", "schema_info", "table_selector", "question_cache", "schema_key"}
+
 
+def __getattr__(name):
+    # Backwards-compatible module attributes (query_engine.db, query_engine.chain, ...)
+    # resolved lazily through the shared engine
+    if name in _ENGINE_ATTRIBUTES:
+        return getattr(engine, name)
+    if name in ("few_shot_prompt", "table_chain", "llm_select_table", "select_table", "generate_query",
+                "generate_sql", "rephrase_answer", "generation_chain",
+                "fast_generation_chain", "chain"):
+        return engine.chains[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
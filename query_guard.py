@@ -0,0 +1,167 @@
+"""
+AskOGMS execution guardrails.
+Wraps every generated query in a read-only transaction with a per-statement
+timeout, adds a LIMIT when the query has none, and checks the planner's cost and
+row estimates before running it, so an accidental cartesian join is rejected up
+front instead of holding a database core for minutes.
+"""
+import json
+import os
+import re
+from typing import List, Optional
+
+# Statements the assistant may run (anything else is rejected before reaching the database)
+_READ_ONLY_START = re.compile(r"^\s*(?:\(\s*)*(?:SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+# A top-level row limit sits at the very end of the statement (a subquery's ends before a ")")
+_TRAILING_LIMIT = re.compile(
+    r"\b(?:LIMIT\s+\d+(?:\s*,\s*\d+)?(?:\s+OFFSET\s+\d+)?|OFFSET\s+\d+(?:\s+ROWS?)?|"
+    r"FETCH\s+(?:FIRST|NEXT)\s+\d+\s+ROWS?\s+ONLY)\s*;?\s*$",
+    re.IGNORECASE,
+)
+# A plain trailing `LIMIT n [OFFSET m]`, which prepare() clamps to auto_limit
+_TRAILING_LIMIT_COUNT = re.compile(r"\bLIMIT\s+(\d+)(\s+OFFSET\s+\d+)?\s*;?\s*$", re.IGNORECASE)
+# Literals, quoted identifiers and comments, whose semicolons do not separate statements
+_QUOTED_OR_COMMENT = re.compile(
+    r"""'(?:[^']|'')*'?|"(?:[^"]|"")*"?|`[^`]*`?|\$(\w*)\$.*?(?:\$\1\$|\Z)|--[^\n]*|/\*.*?(?:\*/|\Z)""",
+    re.DOTALL,
+)
+
+
+class QueryRejected(Exception):
+    """Raised when a query violates the execution policy; the message goes to the correction prompt."""
+
+
+class ExecutionPolicy:
+    """
+    Per-query execution limits.
+
+    Args:
+        read_only (bool): Run in a read-only transaction and refuse non-SELECT statements
+        statement_timeout_ms (int): Server-side statement timeout (0 = none)
+        max_cost (float): Reject plans whose estimated total cost exceeds this (0 = no check)
+        max_plan_rows (float): Reject plans estimated to produce more rows than this in
+            any node not under a LIMIT (0 = no check)
+        auto_limit (int): LIMIT added to queries without one (0 = never)
+    """
+
+    def __init__(self, read_only: bool = True, statement_timeout_ms: int = 30000, max_cost: float = 0,
+                 max_plan_rows: float = 0, auto_limit: int = 0):
+        self.read_only = read_only
+        self.statement_timeout_ms = statement_timeout_ms
+        self.max_cost = max_cost
+        self.max_plan_rows = max_plan_rows
+        self.auto_limit = auto_limit
+
+    @classmethod
+    def from_env(cls) -> "ExecutionPolicy":
+        """Policy from QUERY_READ_ONLY, QUERY_STATEMENT_TIMEOUT_MS, QUERY_MAX_COST, QUERY_MAX_PLAN_ROWS, QUERY_AUTO_LIMIT."""
+        auto_limit = os.getenv("QUERY_AUTO_LIMIT", "true").lower() == "true"
+        return cls(
+            read_only=os.getenv("QUERY_READ_ONLY", "true").lower() == "true",
+            statement_timeout_ms=int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", "30000")),
+            max_cost=float(os.getenv("QUERY_MAX_COST", "1000000")),
+            max_plan_rows=float(os.getenv("QUERY_MAX_PLAN_ROWS", "10000000")),
+            # One row past the fetch budget, so truncation is still detected
+            auto_limit=int(os.getenv("QUERY_MAX_ROWS", "1000")) + 1 if auto_limit else 0,
+        )
+
+    def prepare(self, sql_query: str) -> str:
+        """
+        Check the statement type and add a LIMIT if the query has none (a larger
+        trailing LIMIT is lowered to auto_limit).
+
+        Raises:
+            QueryRejected: For non-read-only statements when read_only is set, and
+                for more than one statement
+        """
+        if self.read_only and not _READ_ONLY_START.match(sql_query):
+            raise QueryRejected("Only read-only SELECT queries can be run. Rewrite the request as a SELECT.")
+        if ";" in _QUOTED_OR_COMMENT.sub(" ", sql_query).rstrip().rstrip(";"):
+            raise QueryRejected("Only a single SQL statement can be run. Return one SELECT query.")
+        if self.auto_limit and _READ_ONLY_START.match(sql_query):
+            existing = _TRAILING_LIMIT_COUNT.search(sql_query)
+            if existing and int(existing.group(1)) > self.auto_limit:
+                sql_query = f"{sql_query[:existing.start(1)]}{self.auto_limit}{existing.group(2) or ''}"
+            elif not _TRAILING_LIMIT.search(sql_query):
+                sql_query = f"{sql_query.rstrip().rstrip(';').rstrip()}\nLIMIT {self.auto_limit}"
+        return sql_query
+
+    def session_statements(self, dialect: str) -> List[str]:
+        """Statements that open the guarded transaction (read-only, statement timeout)."""
+        statements = []
+        if dialect == "postgresql":
+            if self.read_only:
+                statements.append("SET TRANSACTION READ ONLY")
+            if self.statement_timeout_ms:
+                statements.append(f"SET LOCAL statement_timeout = {int(self.statement_timeout_ms)}")
+        elif dialect == "sqlite" and self.read_only:
+            statements.append("PRAGMA query_only = ON")
+        elif dialect == "mysql":
+            # Session-scoped: takes effect for the transaction the query implicitly starts (SET does not start one)
+            if self.read_only:
+                statements.append("SET SESSION TRANSACTION READ ONLY")
+            if self.statement_timeout_ms:
+                statements.append(f"SET SESSION max_execution_time = {int(self.statement_timeout_ms)}")
+        return statements
+
+    def reset_statements(self, dialect: str) -> List[str]:
+        """Statements that undo connection-level settings before the connection returns to the pool."""
+        if dialect == "sqlite" and self.read_only:
+            return ["PRAGMA query_only = OFF"]
+        if dialect == "mysql":
+            statements = []
+            if self.read_only:
+                statements.append("SET SESSION TRANSACTION READ WRITE")
+            if self.statement_timeout_ms:
+                statements.append("SET SESSION max_execution_time = 0")
+            return statements
+        return []  # PostgreSQL settings are transaction-scoped
+
+    def explain_sql(self, dialect: str, sql_query: str) -> Optional[str]:
+        """EXPLAIN statement whose output check_plan understands, or None if the dialect has no cost estimates."""
+        if not (self.max_cost or self.max_plan_rows):
+            return None
+        if dialect == "postgresql":
+            return f"EXPLAIN (FORMAT JSON) {sql_query.rstrip().rstrip(';')}"
+        if dialect == "mysql":
+            return f"EXPLAIN FORMAT=JSON {sql_query.rstrip().rstrip(';')}"
+        return None
+
+    def check_plan(self, dialect: str, plan) -> dict:
+        """
+        Compare the EXPLAIN output with the thresholds.
+
+        Args:
+            dialect (str): SQLAlchemy dialect name
+            plan: First column of the EXPLAIN result (JSON text or parsed JSON)
+
+        Returns:
+            dict: {"cost", "rows"} estimates
+
+        Raises:
+            QueryRejected: If the estimated cost or row count is over the limit
+        """
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        if dialect == "postgresql":
+            root = plan[0]["Plan"]
+            estimate = {"cost": float(root["Total Cost"]), "rows": _max_unlimited_rows(root)}
+        else:
+            cost_info = plan.get("query_block", {}).get("cost_info", {})
+            estimate = {"cost": float(cost_info.get("query_cost", 0)), "rows": 0.0}
+        if self.max_cost and estimate["cost"] > self.max_cost:
+            raise QueryRejected(
+                f"Query rejected before execution: estimated cost {estimate['cost']:.0f} exceeds the limit of "
+                f"{self.max_cost:.0f}. Check every JOIN has a join condition and add filters or aggregation.")
+        if self.max_plan_rows and estimate["rows"] > self.max_plan_rows:
+            raise QueryRejected(
+                f"Query rejected before execution: an estimated {estimate['rows']:.0f} rows exceeds the limit of "
+                f"{self.max_plan_rows:.0f}. Check every JOIN has a join condition and add filters or aggregation.")
+        return estimate
+
+
+def _max_unlimited_rows(node: dict) -> float:
+    """Largest PostgreSQL row estimate among plan nodes not below a Limit (those stop early)."""
+    if node.get("Node Type") == "Limit":
+        return float(node.get("Plan Rows", 0))
+    return max([float(node.get("Plan Rows", 0))] + [_max_unlimited_rows(child) for child in node.get("Plans", [])])
@@ -0,0 +1,197 @@
+"""
+AskOGMS typed query results.
+Fetches rows through a server-side cursor under a row and byte budget, and
+keeps them typed until the answer prompt needs text.
+"""
+import os
+from dataclasses import dataclass, field
+from contextlib import suppress
+from typing import Any, List, Optional
+
+# Longest single value rendered into the answer prompt
+PROMPT_MAX_VALUE_LENGTH = 300
+
+
+def _row_size(row) -> int:
+    """Approximate in-memory/prompt size of a row (rendered length of each value)."""
+    return sum(len(str(value)) + 4 for value in row)
+
+
+def _truncate_value(value: Any, length: int) -> Any:
+    if isinstance(value, str) and len(value) > length:
+        return value[:length].rsplit(" ", 1)[0] + "..."
+    return value
+
+
+@dataclass
+class QueryResult:
+    """Rows fetched for one query, plus whether the fetch budget cut it short."""
+
+    columns: List[str] = field(default_factory=list)
+    rows: List[tuple] = field(default_factory=list)
+    truncated: bool = False
+    byte_count: int = 0
+    limit_added: bool = False  # the execution policy appended a LIMIT
+    plan_estimate: Optional[dict] = None  # {"cost", "rows"} from the EXPLAIN pre-check
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.rows
+
+    def to_prompt_text(self, max_value_length: int = PROMPT_MAX_VALUE_LENGTH) -> str:
+        """Render rows for the answer prompt, in the list-of-tuples form the prompt expects."""
+        if not self.rows:
+            return "No records found in the database."
+        values = [tuple(_truncate_value(value, max_value_length) for value in row) for row in self.rows]
+        text = str(values)
+        if self.truncated:
+            text += f"\n(Result truncated: showing the first {self.row_count} rows.)"
+        return text
+
+    def to_dict(self) -> dict:
+        return {"columns": self.columns, "rows": [list(row) for row in self.rows],
+                "row_count": self.row_count, "truncated": self.truncated}
+
+
+class _RowCollector:
+    """Accumulates rows into a QueryResult until the row or byte budget is hit."""
+
+    def __init__(self, columns: List[str], max_rows: int = None, max_bytes: int = None):
+        # A SELECT * on a large table stops at the budget
+        self.max_rows = int(os.getenv("QUERY_MAX_ROWS", "1000")) if max_rows is None else max_rows
+        self.max_bytes = int(os.getenv("QUERY_MAX_BYTES", "1000000")) if max_bytes is None else max_bytes
+        self.result = QueryResult(columns=list(columns))
+
+    def add(self, row) -> bool:
+        """Keep a row; returns False (and marks truncation) once the budget is exhausted."""
+        size = _row_size(row)
+        if self.result.row_count >= self.max_rows or (self.result.rows and self.result.byte_count + size > self.max_bytes):
+            self.result.truncated = True
+            return False
+        self.result.rows.append(tuple(row))
+        self.result.byte_count += size
+        return True
+
+
+def collect_rows(columns: List[str], rows, max_rows: int = None, max_bytes: int = None) -> QueryResult:
+    """
+    Pull rows from an iterator until the row or byte budget is reached.
+
+    Args:
+        columns (list): Column names
+        rows: Iterable of row tuples (a streaming cursor)
+        max_rows (int, optional): Row budget (default QUERY_MAX_ROWS, 1000)
+        max_bytes (int, optional): Byte budget (default QUERY_MAX_BYTES, 1 MB)
+
+    Returns:
+        QueryResult: Rows within budget; truncated=True if more were available
+    """
+    collector = _RowCollector(columns, max_rows, max_bytes)
+    for row in rows:
+        if not collector.add(row):
+            break
+    return collector.result
+
+
+async def acollect_rows(columns: List[str], rows, max_rows: int = None, max_bytes: int = None) -> QueryResult:
+    """collect_rows for an async row iterator (SQLAlchemy AsyncResult)."""
+    collector = _RowCollector(columns, max_rows, max_bytes)
+    async for row in rows:
+        if not collector.add(row):
+            break
+    return collector.result
+
+
+def _execute_on(conn, dialect: str, sql_query: str, max_rows: int = None, max_bytes: int = None,
+                policy=None) -> QueryResult:
+    """Run one query in its own (guarded) transaction on an open connection."""
+    from sqlalchemy import text
+    prepared = policy.prepare(sql_query) if policy else sql_query
+    with conn.begin():
+        estimate = None
+        if policy:
+            for statement in policy.session_statements(dialect):
+                conn.exec_driver_sql(statement)
+            explain = policy.explain_sql(dialect, prepared)
+            if explain:
+                estimate = policy.check_plan(dialect, conn.execute(text(explain)).scalar())
+        cursor = conn.execution_options(stream_results=True, max_row_buffer=200).execute(text(prepared))
+        if not cursor.returns_rows:
+            return QueryResult()
+        try:
+            result = collect_rows(cursor.keys(), cursor, max_rows, max_bytes)
+        finally:
+            cursor.close()
+        result.limit_added = prepared is not sql_query
+        result.plan_estimate = estimate
+        return result
+
+
+def _reset_connection(conn, dialect: str, policy) -> None:
+    # Connection-level settings (SQLite query_only, MySQL timeout) must not leak into the pool
+    if policy:
+        with suppress(Exception):
+            for statement in policy.reset_statements(dialect):
+                conn.exec_driver_sql(statement)
+            conn.commit()
+
+
+def execute_bounded(sql_engine, sql_query: str, max_rows: int = None, max_bytes: int = None,
+                    policy=None) -> QueryResult:
+    """
+    Execute SQL with a server-side cursor and fetch at most the budget.
+
+    stream_results makes psycopg2 use a named cursor, so rows beyond the budget
+    are never transferred or materialized.
+
+    Args:
+        sql_engine: SQLAlchemy engine
+        sql_query (str): SQL to run
+        policy (ExecutionPolicy, optional): Read-only transaction, statement timeout,
+            LIMIT injection and EXPLAIN cost check (query_guard)
+
+    Returns:
+        QueryResult
+
+    Raises:
+        QueryRejected: If the policy refuses the statement or its plan
+    """
+    dialect = sql_engine.dialect.name
+    with sql_engine.connect() as conn:
+        try:
+            return _execute_on(conn, dialect, sql_query, max_rows, max_bytes, policy)
+        finally:
+            _reset_connection(conn, dialect, policy)
+
+
+def execute_many(sql_engine, sql_queries: List[str], max_rows: int = None, max_bytes: int = None,
+                 policy=None) -> list:
+    """
+    Execute several queries on one pooled connection, each in its own transaction.
+
+    Args:
+        sql_engine: SQLAlchemy engine
+        sql_queries (List[str]): SQL to run, in order
+        policy (ExecutionPolicy, optional): Applied to every query (see execute_bounded)
+
+    Returns:
+        list: A QueryResult or the raised exception per query (one failure does not stop the rest)
+    """
+    dialect = sql_engine.dialect.name
+    outcomes = []
+    with sql_engine.connect() as conn:
+        try:
+            for sql_query in sql_queries:
+                try:
+                    outcomes.append(_execute_on(conn, dialect, sql_query, max_rows, max_bytes, policy))
+                except Exception as e:
+                    if conn.invalidated:
+                        raise
+                    outcomes.append(e)
+        finally:
+            _reset_connection(conn, dialect, policy)
+    return outcomes
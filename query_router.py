@@ -0,0 +1,413 @@
+"""
+AskOGMS query router.
+Decides per question which table-selection stage to run: none ("fast", every
+table goes to SQL generation), the local index ("local") or Gemini ("llm").
+Pluggable strategies (lexical schema match, a classifier trained on logged
+questions, local index confidence) are tried in order; every routed question's
+outcome is logged and aggregated so each route's accuracy and latency can be
+compared.
+
+Train the classifier from the routing log:
+    python query_router.py train
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+from collections import Counter, defaultdict, deque
+from typing import Dict, List, Optional
+
+from local_embeddings import tokenize
+
+ROUTES = ("fast", "local", "llm")
+
+# Words that carry no schema meaning in questions (in tokenize() form: "does" -> "doe", "this" -> "thi")
+_STOPWORDS = {
+    "a", "all", "an", "and", "are", "by", "can", "do", "doe", "each", "for", "from", "get", "give", "have",
+    "how", "i", "in", "is", "it", "list", "many", "me", "much", "of", "on", "or", "per", "please", "show",
+    "that", "the", "their", "there", "thi", "to", "total", "what", "when", "where", "which", "who", "with",
+}
+
+# Recent outcome latencies kept per route for percentiles
+_LATENCY_WINDOW = 1000
+
+
+class RouteDecision:
+    """
+    A routing decision.
+
+    Attributes:
+        route (str): "fast", "local" or "llm"
+        confidence (float): Strategy confidence in [0, 1]
+        strategy (str): Name of the strategy that decided ("fallback" if none did)
+        tables (List[str] | None): Tables for the local route
+    """
+
+    __slots__ = ("route", "confidence", "strategy", "tables")
+
+    def __init__(self, route: str, confidence: float, strategy: str, tables: Optional[List[str]] = None):
+        self.route = route
+        self.confidence = confidence
+        self.strategy = strategy
+        self.tables = tables
+
+    def to_dict(self) -> dict:
+        return {"route": self.route, "confidence": round(self.confidence, 4), "strategy": self.strategy,
+                "tables": self.tables}
+
+
+def _content_tokens(question: str) -> List[str]:
+    return [token for token in tokenize(question) if token not in _STOPWORDS and not token.isdigit()]
+
+
+class LexicalStrategy:
+    """
+    Route to the local index when the question is phrased in the schema's own words.
+
+    Confidence is the share of the question's content words found in the table
+    names, column names and descriptions of the tables the index ranks; a question
+    that also names a table outright gets full confidence.
+    """
+
+    name = "lexical"
+
+    def __init__(self, min_confidence: float = 0.75):
+        self.min_confidence = min_confidence
+
+    def decide(self, question: str, selector) -> Optional[RouteDecision]:
+        if selector is None:
+            return None
+        tokens = _content_tokens(question)
+        ranked = selector.select(question)
+        if not tokens or not ranked["tables"]:
+            return None
+        question_tokens = set(tokens)
+        if any(set(tokenize(table)) <= question_tokens for table in ranked["tables"]):
+            return RouteDecision("local", 1.0, self.name, ranked["tables"])
+        vocabulary = set()
+        for table in ranked["tables"]:
+            vocabulary.update(tokenize(selector.documents[table]["text"]))
+        coverage = sum(1 for token in tokens if token in vocabulary) / len(tokens)
+        return RouteDecision("local", coverage, self.name, ranked["tables"])
+
+
+class IndexConfidenceStrategy:
+    """Route to the local index when its top score clears `threshold` (default TABLE_SELECTOR_MIN_CONFIDENCE)."""
+
+    name = "index"
+    min_confidence = 1.0  # confidence is the score relative to the threshold
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.threshold = threshold
+
+    def decide(self, question: str, selector) -> Optional[RouteDecision]:
+        if selector is None:
+            return None
+        ranked = selector.select(question)
+        if not ranked["tables"]:
+            return None
+        threshold = selector.min_confidence if self.threshold is None else self.threshold
+        confidence = min(1.0, ranked["confidence"] / threshold) if threshold else 1.0
+        return RouteDecision("local", confidence, self.name, ranked["tables"])
+
+
+class KeywordStrategy:
+    """The original keyword check ("count", "show", "list", ...) -> fast path. Kept for comparison."""
+
+    name = "keywords"
+    min_confidence = 1.0
+    keywords = ("count", "total", "how many", "show", "list", "all")
+
+    def decide(self, question: str, selector) -> Optional[RouteDecision]:
+        if any(keyword in question.lower() for keyword in self.keywords):
+            return RouteDecision("fast", 1.0, self.name)
+        return None
+
+
+class RouteClassifier:
+    """Multinomial naive Bayes over question tokens; labels are routes."""
+
+    def __init__(self, classes: List[str], priors: Dict[str, float], likelihoods: Dict[str, Dict[str, float]],
+                 unseen: Dict[str, float]):
+        self.classes = classes
+        self.priors = priors
+        self.likelihoods = likelihoods
+        self.unseen = unseen
+
+    @classmethod
+    def fit(cls, questions: List[str], labels: List[str], alpha: float = 1.0) -> "RouteClassifier":
+        counts = {label: Counter() for label in set(labels)}
+        for question, label in zip(questions, labels):
+            counts[label].update(_content_tokens(question))
+        vocabulary = set().union(*counts.values()) if counts else set()
+        label_counts = Counter(labels)
+        classes = sorted(counts)
+        priors = {label: math.log(label_counts[label] / len(labels)) for label in classes}
+        likelihoods, unseen = {}, {}
+        for label in classes:
+            total = sum(counts[label].values()) + alpha * (len(vocabulary) + 1)
+            likelihoods[label] = {token: math.log((count + alpha) / total) for token, count in counts[label].items()}
+            unseen[label] = math.log(alpha / total)
+        return cls(classes, priors, likelihoods, unseen)
+
+    def predict(self, question: str):
+        """Return (label, probability) for a question."""
+        tokens = _content_tokens(question)
+        scores = {
+            label: self.priors[label] + sum(self.likelihoods[label].get(token, self.unseen[label]) for token in tokens)
+            for label in self.classes
+        }
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"classes": self.classes, "priors": self.priors, "likelihoods": self.likelihoods,
+                       "unseen": self.unseen}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "RouteClassifier":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["classes"], data["priors"], data["likelihoods"], data["unseen"])
+
+
+class ClassifierStrategy:
+    """Route with a RouteClassifier trained on the routing log (abstains until a model exists)."""
+
+    name = "classifier"
+
+    def __init__(self, model_path: str, min_confidence: float = 0.8):
+        self.model_path = model_path
+        self.min_confidence = min_confidence
+        self.model = None
+        if model_path and os.path.exists(model_path):
+            try:
+                self.model = RouteClassifier.load(model_path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Route classifier not loaded ({model_path}): {e}")
+
+    def decide(self, question: str, selector) -> Optional[RouteDecision]:
+        if self.model is None:
+            return None
+        route, probability = self.model.predict(question)
+        tables = selector.select(question)["tables"] if route == "local" and selector is not None else None
+        if route == "local" and not tables:
+            return None
+        return RouteDecision(route, probability, self.name, tables)
+
+
+class _RankingMemo:
+    """Selector view that ranks each question once, however many strategies ask."""
+
+    def __init__(self, selector):
+        self._selector = selector
+        self._question = None
+        self._ranked = None
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+    def select(self, question: str) -> dict:
+        if question != self._question:
+            self._question, self._ranked = question, self._selector.select(question)
+        return self._ranked
+
+
+STRATEGIES = {
+    "lexical": LexicalStrategy,
+    "index": IndexConfidenceStrategy,
+    "keywords": KeywordStrategy,
+    "classifier": ClassifierStrategy,
+}
+
+
+def outcome_label(record: dict) -> Optional[str]:
+    """
+    Cheapest route that would have been right for a logged question.
+
+    "local" if the tables the final SQL read were all in the local index's
+    ranking, else "llm"; None for failed questions or when the index was not
+    consulted (no reliable label).
+    """
+    if not record.get("ok") or record.get("sql_tables") is None or record.get("index_tables") is None:
+        return None
+    index_tables = {table.lower() for table in record.get("index_tables") or []}
+    return "local" if set(record["sql_tables"]) <= index_tables else "llm"
+
+
+class QueryRouter:
+    """
+    Tries strategies in order; the first whose confidence reaches its
+    min_confidence decides, otherwise the fallback route is used.
+
+    Args:
+        strategies (list): Strategy objects with name, min_confidence and decide(question, selector)
+        fallback (str): Route when no strategy is confident
+        log_path (str, optional): JSON Lines file receiving one outcome per routed question (None = no log)
+    """
+
+    def __init__(self, strategies: List, fallback: str = "llm", log_path: Optional[str] = None):
+        self.strategies = strategies
+        self.fallback = fallback
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()  # keeps log lines whole without holding up route() and stats()
+        self._outcomes = defaultdict(lambda: {"count": 0, "ok": 0, "first_try": 0, "tables_right": 0,
+                                              "judged": 0, "latencies": deque(maxlen=_LATENCY_WINDOW)})
+        self._decisions = Counter()
+
+    def route(self, question: str, selector=None) -> RouteDecision:
+        """
+        Route a question.
+
+        Args:
+            question (str): The user's question
+            selector (LocalTableSelector, optional): Local index (strategies abstain without it)
+
+        Returns:
+            RouteDecision
+        """
+        selector = _RankingMemo(selector) if selector is not None else None
+        decision = None
+        for strategy in self.strategies:
+            candidate = strategy.decide(question, selector)
+            if candidate is not None and candidate.confidence >= strategy.min_confidence:
+                decision = candidate
+                break
+        if decision is None:
+            tables = None
+            if self.fallback == "local" and selector is not None:
+                tables = selector.select(question)["tables"] or None
+            decision = RouteDecision(self.fallback, 0.0, "fallback", tables)
+        with self._lock:
+            self._decisions[(decision.route, decision.strategy)] += 1
+        return decision
+
+    def record(self, question: str, decision: RouteDecision, chosen_tables: Optional[List[str]],
+               index_tables: Optional[List[str]], sql_tables: Optional[List[str]], ok: bool, attempts: int,
+               seconds: float) -> None:
+        """
+        Record a routed question's outcome.
+
+        Args:
+            question (str): The question
+            decision (RouteDecision): How it was routed
+            chosen_tables (list | None): Tables SQL generation saw (None = all)
+            index_tables (list | None): The local index's ranking for the question
+            sql_tables (list | None): Tables the executed SQL read (None if unknown)
+            ok (bool): The query executed without error
+            attempts (int): Executions needed (more than 1 means the LLM had to correct it)
+            seconds (float): Routing through execution
+        """
+        tables_right = None
+        if ok and sql_tables is not None:
+            tables_right = chosen_tables is None or set(sql_tables) <= {t.lower() for t in chosen_tables}
+        with self._lock:
+            stats = self._outcomes[decision.route]
+            stats["count"] += 1
+            stats["ok"] += bool(ok)
+            stats["first_try"] += bool(ok and attempts <= 1)
+            if tables_right is not None:
+                stats["judged"] += 1
+                stats["tables_right"] += tables_right
+            stats["latencies"].append(seconds)
+        if not self.log_path:
+            return
+        record = {"question": question, **decision.to_dict(), "chosen_tables": chosen_tables,
+                  "index_tables": index_tables, "sql_tables": sql_tables, "ok": ok, "attempts": attempts,
+                  "seconds": round(seconds, 4)}
+        try:
+            with self._log_lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Routing log not written ({self.log_path}): {e}")
+
+    def stats(self) -> dict:
+        """Per route: questions, success and first-try rates, table accuracy, latency p50/p95 (ms)."""
+        with self._lock:
+            routes = {}
+            for route, stats in self._outcomes.items():
+                latencies = sorted(stats["latencies"])
+                count = stats["count"]
+                routes[route] = {
+                    "count": count,
+                    "success_rate": round(stats["ok"] / count, 4),
+                    "first_try_rate": round(stats["first_try"] / count, 4),
+                    "table_accuracy": round(stats["tables_right"] / stats["judged"], 4) if stats["judged"] else None,
+                    "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+                    "p95_ms": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000, 2),
+                }
+            decisions = {f"{route}/{strategy}": count for (route, strategy), count in sorted(self._decisions.items())}
+        return {"strategies": [strategy.name for strategy in self.strategies], "fallback": self.fallback,
+                "decisions": decisions, "routes": routes}
+
+
+def router_from_env(table_selector_mode: str = "hybrid") -> QueryRouter:
+    """
+    Build the router from TABLE_SELECTOR and ROUTER_* settings.
+
+    TABLE_SELECTOR=llm and =local pin every question to that route; hybrid runs
+    the ROUTER_STRATEGIES chain with Gemini as the fallback. The outcome log is
+    opt-in (ROUTER_LOG=<path>): it grows by one line per question.
+    """
+    log_path = os.getenv("ROUTER_LOG", "").strip()
+    log_path = None if log_path.lower() in ("", "off") else log_path
+    if table_selector_mode in ("llm", "local"):
+        return QueryRouter([], fallback=table_selector_mode, log_path=log_path)
+    strategies = []
+    for name in os.getenv("ROUTER_STRATEGIES", "lexical,classifier,index").split(","):
+        name = name.strip().lower()
+        if name == "lexical":
+            strategies.append(LexicalStrategy(float(os.getenv("ROUTER_LEXICAL_MIN_CONFIDENCE", "0.75"))))
+        elif name == "classifier":
+            strategies.append(ClassifierStrategy(os.getenv("ROUTER_MODEL_PATH", "askdb_router_model.json"),
+                                                 float(os.getenv("ROUTER_CLASSIFIER_MIN_CONFIDENCE", "0.8"))))
+        elif name in STRATEGIES:
+            strategies.append(STRATEGIES[name]())
+        elif name:
+            print(f"Unknown router strategy: {name}")
+    return QueryRouter(strategies, fallback=os.getenv("ROUTER_FALLBACK", "llm").lower(), log_path=log_path)
+
+
+def train(log_path: str, model_path: str, holdout: float = 0.2, seed: int = 0) -> dict:
+    """
+    Fit the route classifier on the routing log and save it.
+
+    Returns:
+        dict: Example and label counts plus held-out accuracy
+    """
+    with open(log_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    examples = [(record["question"], outcome_label(record)) for record in records]
+    examples = [(question, label) for question, label in examples if label]
+    if not examples:
+        raise ValueError(f"No labelled questions in {log_path}")
+    random.Random(seed).shuffle(examples)
+    split = int(len(examples) * (1 - holdout)) if len(examples) >= 10 else len(examples)
+    report = {"examples": len(examples), "labels": dict(Counter(label for _, label in examples))}
+    if split < len(examples):
+        model = RouteClassifier.fit(*zip(*examples[:split]))
+        held_out = examples[split:]
+        report["holdout_accuracy"] = round(
+            sum(model.predict(question)[0] == label for question, label in held_out) / len(held_out), 4)
+    RouteClassifier.fit(*zip(*examples)).save(model_path)
+    report["model"] = model_path
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AskOGMS query router tools")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--log", default=os.getenv("ROUTER_LOG") or "askdb_router_log.jsonl")
+    parser.add_argument("--model", default=os.getenv("ROUTER_MODEL_PATH", "askdb_router_model.json"))
+    args = parser.parse_args(argv)
+    report = train(args.log, args.model)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
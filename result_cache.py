@@ -0,0 +1,221 @@
+"""
+AskOGMS SQL result cache.
+Keeps recent query results in memory keyed on the canonical form of the SQL, so
+differently phrased questions that produce the same query are answered without
+touching the database. Entries expire after a TTL, the cache is capped in bytes,
+and entries are dropped per table when that table's data changes.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Per-table modification counters; any insert/update/delete (or TRUNCATE, via n_live_tup) changes them
+_POSTGRES_TABLE_VERSIONS_SQL = """
+    SELECT relname, n_tup_ins || ':' || n_tup_upd || ':' || n_tup_del || ':' || n_live_tup
+    FROM pg_stat_user_tables
+"""
+
+# Rough per-entry overhead on top of the rows' rendered size
+_ENTRY_OVERHEAD_BYTES = 512
+
+_DIALECTS = {"postgresql": "postgres", "sqlite": "sqlite", "mysql": "mysql"}
+
+# Functions whose value changes between runs of the same query; such queries are never cached.
+# sqlglot parses the common spellings (now(), CURRENT_DATE, random(), rand(), ...) into these nodes
+_VOLATILE_EXPRESSIONS = ("CurrentDate", "CurrentDatetime", "CurrentTime", "CurrentTimestamp", "CurrentTimestampLTZ",
+                         "Localtime", "Localtimestamp", "Systimestamp", "Rand", "Randn", "Randstr", "Uuid")
+# ... and the rest, which it leaves as anonymous function calls
+_VOLATILE_FUNCTIONS = {"now", "random", "rand", "uuid", "sysdate", "clock_timestamp", "statement_timestamp",
+                       "transaction_timestamp", "timeofday", "nextval", "setval", "unixepoch", "julianday"}
+
+
+def _is_volatile(tree) -> bool:
+    """True if the query reads the clock, a random source or a sequence (including date('now') and 'now'::date)."""
+    from sqlglot import exp
+    volatile = tuple(getattr(exp, name) for name in _VOLATILE_EXPRESSIONS if hasattr(exp, name))
+    for node in tree.walk():
+        if isinstance(node, volatile):
+            return True
+        if isinstance(node, exp.Anonymous) and node.name.lower() in _VOLATILE_FUNCTIONS:
+            return True
+        if (isinstance(node, exp.Literal) and node.is_string and node.this.strip().lower() == "now"
+                and isinstance(node.parent, (exp.Func, exp.Cast))):
+            return True
+    return False
+
+
+def canonical_sql(sql_query: str, dialect: str) -> Optional[Tuple[str, List[str]]]:
+    """
+    Canonical text of a query plus the tables it reads.
+
+    The query is parsed and regenerated by sqlglot, so whitespace, keyword case,
+    unquoted identifier case and a trailing semicolon do not change the key.
+
+    Args:
+        sql_query (str): SQL as executed
+        dialect (str): SQLAlchemy dialect name
+
+    Returns:
+        (str, List[str]) | None: Canonical SQL and lower-cased table names, or None
+        if the query cannot be parsed or calls a volatile function such as now(),
+        CURRENT_DATE or random() (it is then never cached)
+    """
+    try:
+        import sqlglot
+        from sqlglot import exp
+        tree = sqlglot.parse_one(sql_query, read=_DIALECTS.get(dialect))
+    except Exception:
+        return None
+    if _is_volatile(tree):
+        return None
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    tables = sorted({table.name.lower() for table in tree.find_all(exp.Table)} - ctes)
+    if not tables:
+        return None  # SELECT 1, SELECT now(), ...: nothing to invalidate on
+    return tree.sql(dialect=_DIALECTS.get(dialect), normalize=True), tables
+
+
+def table_versions(sql_engine) -> Optional[Dict[str, str]]:
+    """{table: modification counter} from pg_stat_user_tables, or None where there is no equivalent."""
+    if sql_engine.dialect.name != "postgresql":
+        return None
+    with sql_engine.connect() as conn:
+        return {name.lower(): version for name, version in conn.exec_driver_sql(_POSTGRES_TABLE_VERSIONS_SQL)}
+
+
+class ResultCache:
+    """
+    In-memory LRU of QueryResults keyed on canonical SQL.
+
+    Table versions (PostgreSQL) are re-read at most once per `check_interval`
+    seconds; entries reading a table whose counters moved are dropped. Other
+    databases rely on the TTL and explicit invalidate() calls. The counters are
+    updated when a writing transaction ends, so a change can take up to the check
+    interval (plus the stats flush delay) to show.
+
+    Args:
+        sql_engine: SQLAlchemy engine the results come from
+        max_bytes (int): Memory cap (approximate: rendered size of the cached rows)
+        ttl_seconds (float): Maximum entry age (0 = no expiry)
+        check_interval (float): Seconds between table-version checks
+    """
+
+    def __init__(self, sql_engine, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600,
+                 check_interval: float = 30):
+        self.sql_engine = sql_engine
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (result, tables, size, stored_at)
+        self._bytes = 0
+        self._versions: Optional[Dict[str, str]] = None
+        self._checked_at = 0.0
+        self._checking = False
+
+    @staticmethod
+    def _key(canonical: str) -> str:
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def lookup_key(self, sql_query: str) -> Optional[Tuple[str, List[str]]]:
+        """(cache key, tables) for a query, or None if it cannot be cached."""
+        canonical = canonical_sql(sql_query, self.sql_engine.dialect.name)
+        if canonical is None:
+            return None
+        return self._key(canonical[0]), canonical[1]
+
+    def _drop(self, key: str) -> None:
+        _, _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _check_versions(self) -> None:
+        """Re-read table versions if due and drop entries of changed tables; the query runs outside the lock."""
+        with self._lock:
+            now = time.monotonic()
+            if self._checking or now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            self._checking = True  # One check in flight; other lookups keep using the current entries
+        try:
+            versions = table_versions(self.sql_engine)
+        except Exception as e:
+            print(f"Result cache: table version check failed: {e}")
+            versions = None
+        with self._lock:
+            self._checking = False
+            if versions is None:
+                return
+            if self._versions is not None:
+                changed = {table for table in set(versions) | set(self._versions)
+                           if versions.get(table) != self._versions.get(table)}
+                if changed:
+                    self._invalidate_tables(changed)
+            self._versions = versions
+
+    def _invalidate_tables(self, tables) -> int:
+        stale = [key for key, (_, entry_tables, _, _) in self._entries.items() if tables.intersection(entry_tables)]
+        for key in stale:
+            self._drop(key)
+        self.invalidations += len(stale)
+        return len(stale)
+
+    def get(self, key: str):
+        """Cached QueryResult for a key, or None (expired or invalidated entries are dropped)."""
+        self._check_versions()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[3] > self.ttl_seconds:
+                self._drop(key)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, tables: List[str], result) -> None:
+        """Store a result, evicting least recently used entries over the byte cap."""
+        size = result.byte_count + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (result, tuple(tables), size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables: Optional[List[str]] = None) -> int:
+        """Drop entries reading any of `tables` (or everything). Returns entries removed."""
+        with self._lock:
+            if tables is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+                self.invalidations += removed
+                return removed
+            return self._invalidate_tables({table.lower() for table in tables})
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,233 @@
+"""
+AskOGMS result summarization.
+Reduces large query results to a compact local summary before the answer LLM
+call, and renders results with a known shape (single value, short list, small
+table) as markdown answers without the LLM at all.
+"""
+import io
+import numbers
+import threading
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+from typing import List, Optional
+
+from query_results import QueryResult
+
+# auto: templates for results that fit a known shape, the LLM otherwise;
+# template: never call the LLM; llm: always rephrase with the LLM
+ANSWER_MODES = ("auto", "template", "llm")
+
+# Generated names like count(*), ?column? or sum add nothing for the reader
+_GENERIC_COLUMNS = ("count", "sum", "avg", "min", "max")
+# Longest value shown in a list or table cell
+_MAX_CELL_LENGTH = 80
+
+
+def scalar_value(query_result: QueryResult):
+    """Return (column, value) for a 1x1 result such as SELECT COUNT(*), else None."""
+    if query_result.row_count == 1 and len(query_result.columns) == 1 and not query_result.truncated:
+        return query_result.columns[0], query_result.rows[0][0]
+    return None
+
+
+def format_value(value) -> str:
+    """Human-friendly rendering of a single database value."""
+    if value is None:
+        return "no value (NULL)"
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, numbers.Integral):
+        return f"{value:,}"
+    if isinstance(value, (numbers.Real, Decimal)):
+        if value != value or value in (float("inf"), float("-inf")):
+            return str(value)
+        if value and abs(value) < 1:
+            return f"{value:.6g}"  # Two decimals would turn 0.0042 into 0
+        return f"{value:,.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def column_label(column: str) -> Optional[str]:
+    """Readable label for a column name (state_name -> State name), or None for generated names."""
+    if column and column.replace("_", "").isalnum() and column.lower() not in _GENERIC_COLUMNS:
+        return column.replace("_", " ").capitalize()
+    return None
+
+
+def scalar_answer(question: str, query_result: QueryResult) -> Optional[str]:
+    """Answer text for a single-value result, or None if the result is not a scalar."""
+    scalar = scalar_value(query_result)
+    if scalar is None:
+        return None
+    column, value = scalar
+    label = column_label(column)
+    if label:
+        return f"**{label}**: {format_value(value)}"
+    return f"The answer is **{format_value(value)}**."
+
+
+def _cell(value) -> str:
+    """A value for a list item or table cell: formatted, one line, pipes escaped, length capped."""
+    if value is None:
+        return ""
+    text = " ".join(format_value(value).split()).replace("|", "\\|")
+    return text if len(text) <= _MAX_CELL_LENGTH else text[:_MAX_CELL_LENGTH - 3] + "..."
+
+
+def _join(values: List[str]) -> str:
+    return values[0] if len(values) == 1 else ", ".join(values[:-1]) + " and " + values[-1]
+
+
+def list_answer(query_result: QueryResult, max_items: int = 20, inline_items: int = 5) -> Optional[str]:
+    """
+    Answer text for a single-column result with a few rows (e.g. a list of state names).
+
+    Up to `inline_items` values are written as one sentence, longer lists as bullets.
+
+    Returns:
+        str | None: Markdown answer, or None if the result is not a short single column
+    """
+    if len(query_result.columns) != 1 or query_result.truncated or not 1 < query_result.row_count <= max_items:
+        return None
+    label = column_label(query_result.columns[0]) or "Results"
+    values = [_cell(row[0]) or "(none)" for row in query_result.rows]
+    if len(values) <= inline_items:
+        return f"**{label}** ({len(values)}): {_join(values)}."
+    return f"**{label}** ({len(values)}):\n" + "\n".join(f"- {value}" for value in values)
+
+
+def table_answer(query_result: QueryResult, max_rows: int = 20, max_columns: int = 6,
+                 force: bool = False) -> Optional[str]:
+    """
+    Markdown table (or field list for a single row) for a small result.
+
+    Args:
+        query_result (QueryResult): Typed rows from the executor
+        max_rows (int): Most rows rendered
+        max_columns (int): Most columns for a result to count as small
+        force (bool): Render any result, showing the first `max_rows` rows
+
+    Returns:
+        str | None: Markdown answer, or None if the result is too large and force is off
+    """
+    columns = query_result.columns
+    fits = len(columns) <= max_columns and query_result.row_count <= max_rows and not query_result.truncated
+    if not columns or not (fits or force):
+        return None
+    headers = [column_label(column) or column for column in columns]
+    if query_result.row_count == 1:
+        return "\n".join(f"**{header}**: {_cell(value) or 'no value'}"
+                         for header, value in zip(headers, query_result.rows[0]))
+    shown = query_result.rows[:max_rows]
+    lines = ["| " + " | ".join(_cell(header) for header in headers) + " |",
+             "|" + "---|" * len(headers)]
+    lines.extend("| " + " | ".join(_cell(value) for value in row) + " |" for row in shown)
+    total = f"{query_result.row_count}{'+' if query_result.truncated else ''}"
+    intro = f"{total} rows" if len(shown) == query_result.row_count else f"First {len(shown)} of {total} rows"
+    return f"{intro}:\n\n" + "\n".join(lines)
+
+
+def template_answer(question: str, query_result: QueryResult, max_items: int = 20, max_rows: int = 20,
+                    max_columns: int = 6, force: bool = False) -> Optional[str]:
+    """
+    Deterministic answer for a result with a known shape, without the LLM.
+
+    Shapes, in order: no rows, single value, short single column, small table.
+
+    Args:
+        question (str): The user's question
+        query_result (QueryResult): Typed rows from the executor
+        max_items (int): Longest single-column result written as a list
+        max_rows (int): Most rows in a table
+        max_columns (int): Most columns in a table
+        force (bool): Also render results that fit no shape (first `max_rows` rows)
+
+    Returns:
+        str | None: Markdown answer, or None if the LLM should phrase it
+    """
+    if query_result.is_empty:
+        return "No matching records were found."
+    return (scalar_answer(question, query_result)
+            or list_answer(query_result, max_items)
+            or table_answer(query_result, max_rows, max_columns, force))
+
+
+def needs_summary(query_result: QueryResult, max_rows: int, max_bytes: int) -> bool:
+    return query_result.row_count > max_rows or query_result.byte_count > max_bytes
+
+
+def summarize(query_result: QueryResult, top_n: int = 10, top_values: int = 5) -> str:
+    """
+    Compact, LLM-friendly description of a large result computed with pandas.
+
+    Includes shape, per-column statistics (numeric: min/max/mean/sum; other:
+    distinct count plus the most frequent values with counts) and the first
+    `top_n` rows.
+
+    Args:
+        query_result (QueryResult): Typed rows from the executor
+        top_n (int): Rows to include verbatim
+        top_values (int): Most frequent values listed per non-numeric column
+
+    Returns:
+        str: Summary text for the answer prompt
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame(query_result.rows, columns=query_result.columns)
+    lines = [
+        f"Result has {query_result.row_count} rows x {len(query_result.columns)} columns"
+        + (" (truncated by the fetch limit; more rows exist)" if query_result.truncated else "") + ".",
+        "Column summary:",
+    ]
+    for column in frame.columns:
+        series = frame[column]
+        numeric = pd.to_numeric(series, errors="coerce")
+        non_null = int(series.notna().sum())
+        if not non_null:
+            lines.append(f"- {column}: all NULL")
+        elif numeric.notna().sum() == non_null:
+            lines.append(
+                f"- {column}: numeric, {non_null} values, min {format_value(numeric.min())}, "
+                f"max {format_value(numeric.max())}, mean {format_value(numeric.mean())}, sum {format_value(numeric.sum())}"
+            )
+        else:
+            counts = series.astype(str).value_counts().head(top_values)
+            common = ", ".join(f"{value} ({count})" for value, count in counts.items())
+            lines.append(f"- {column}: {series.nunique()} distinct values; most common: {common}")
+    lines.append(f"First {min(top_n, query_result.row_count)} rows:")
+    lines.append(str([tuple(row) for row in query_result.rows[:top_n]]))
+    return "\n".join(lines)
+
+
+class ResultStore:
+    """Keeps the most recent full results in memory so the UI can offer a CSV download."""
+
+    def __init__(self, max_entries: int = 50):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, query_result: QueryResult) -> str:
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            self._results[result_id] = query_result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result_id
+
+    def get(self, result_id: str) -> Optional[QueryResult]:
+        with self._lock:
+            return self._results.get(result_id)
+
+    def to_csv(self, result_id: str) -> Optional[str]:
+        query_result = self.get(result_id)
+        if query_result is None:
+            return None
+        import csv
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(query_result.columns)
+        writer.writerows(query_result.rows)
+        return buffer.getvalue()
@@ -0,0 +1,166 @@
+"""
+AskOGMS schema info cache.
+Renders each table's CREATE TABLE text and sample rows once and reuses it until
+the table's catalog signature changes, instead of re-querying on every question.
+"""
+import hashlib
+import threading
+import time
+from typing import Dict, List, Optional
+
+# One catalog query covers every table: column list plus relfilenode (changes on
+# TRUNCATE / VACUUM FULL / rewrite) and xmin of the pg_class row (changes on ALTER)
+_POSTGRES_SIGNATURE_SQL = """
+    SELECT c.relname,
+           c.relfilenode::text || ':' || c.xmin::text || ':' ||
+           string_agg(a.attname || ' ' || format_type(a.atttypid, a.atttypmod), ',' ORDER BY a.attnum)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = COALESCE(%(schema)s, current_schema()) AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+    GROUP BY c.relname, c.relfilenode, c.xmin
+"""
+
+
+def table_signatures(sql_engine, schema: Optional[str] = None) -> Dict[str, str]:
+    """
+    Return {table_name: signature} for every table in the schema.
+
+    PostgreSQL uses a single pg_catalog query; other dialects hash the reflected
+    column list per table.
+
+    Args:
+        sql_engine: SQLAlchemy engine
+        schema (str, optional): Schema name (defaults to the connection's current schema)
+
+    Returns:
+        Dict[str, str]: Signature per table name
+    """
+    if sql_engine.dialect.name == "postgresql":
+        with sql_engine.connect() as conn:
+            rows = conn.exec_driver_sql(_POSTGRES_SIGNATURE_SQL, {"schema": schema}).fetchall()
+        return {name: signature for name, signature in rows}
+
+    from sqlalchemy import inspect
+    inspector = inspect(sql_engine)  # fresh inspector: no cached reflection
+    signatures = {}
+    for name in inspector.get_table_names(schema=schema) + inspector.get_view_names(schema=schema):
+        columns = ",".join(f"{c['name']} {c['type']}" for c in inspector.get_columns(name, schema=schema))
+        signatures[name] = hashlib.sha1(columns.encode("utf-8")).hexdigest()
+    return signatures
+
+
+class SchemaInfoCache:
+    """
+    Drop-in stand-in for SQLDatabase when rendering table info for the SQL prompt.
+
+    get_table_info() is served from a per-table cache; everything else (dialect,
+    run, get_usable_table_names, ...) is delegated to the wrapped SQLDatabase.
+    Signatures are re-checked at most once per `check_interval` seconds. Catalog
+    queries and renders run outside the cache lock, so lookups of cached tables
+    never wait on the database.
+    """
+
+    def __init__(self, db, check_interval: float = 300):
+        self.db = db
+        self.check_interval = check_interval
+        self.renders = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()  # SQLDatabase reflects into one shared MetaData
+        self._rendered: Dict[tuple, tuple] = {}  # (table_name, get_col_comments) -> (signature, text)
+        self._signatures: Dict[str, str] = {}
+        self._stale = set()  # explicitly invalidated tables: re-reflect on next render
+        self._checked_at = 0.0
+        self._checking = False
+
+    def __getattr__(self, name):
+        if name == "db":
+            raise AttributeError(name)
+        return getattr(self.db, name)
+
+    def _current_signatures(self) -> Dict[str, str]:
+        with self._lock:
+            now = time.monotonic()
+            signatures = self._signatures
+            if signatures and (self._checking or now - self._checked_at < self.check_interval):
+                return signatures
+            self._checking = True  # One re-check in flight; others keep the known signatures
+        try:
+            signatures = table_signatures(self.db._engine, self.db._schema)
+        except Exception as e:
+            # Keep serving the last known signatures if the catalog check fails
+            print(f"Schema signature check failed: {e}")
+            signatures = None
+        with self._lock:
+            self._checking = False
+            self._checked_at = now
+            if signatures is not None:
+                self._signatures = signatures
+            return self._signatures
+
+    def _render(self, table_name: str, get_col_comments: bool, refresh: bool = False) -> str:
+        if refresh:
+            # SQLDatabase keeps reflected tables in its MetaData; drop the stale copy
+            # so the table is reflected again with its new columns
+            stale = self.db._metadata.tables.get(
+                f"{self.db._schema}.{table_name}" if self.db._schema else table_name
+            )
+            if stale is not None:
+                self.db._metadata.remove(stale)
+        self.renders += 1
+        return self.db.get_table_info([table_name], get_col_comments=get_col_comments)
+
+    def get_table_info(self, table_names: Optional[List[str]] = None, get_col_comments: bool = False) -> str:
+        """Same contract as SQLDatabase.get_table_info, served from the cache."""
+        tables = sorted(self.table_infos(table_names, get_col_comments).values())
+        return "\n\n".join(t for t in tables if t)
+
+    def table_infos(self, table_names: Optional[List[str]] = None, get_col_comments: bool = False) -> Dict[str, str]:
+        """
+        Rendered info per table, in the order given (for per-table prompt budgeting).
+
+        Raises:
+            ValueError: If a table is not in the database (as get_table_info)
+        """
+        all_table_names = list(self.db.get_usable_table_names())
+        if table_names is not None:
+            missing_tables = set(table_names).difference(all_table_names)
+            if missing_tables:
+                raise ValueError(f"table_names {missing_tables} not found in database")
+            all_table_names = table_names
+
+        signatures = self._current_signatures()
+        tables, missing = {}, []
+        with self._lock:
+            for name in all_table_names:
+                signature = signatures.get(name, "")
+                cached = self._rendered.get((name, get_col_comments))
+                if cached and cached[0] == signature:
+                    self.hits += 1
+                    tables[name] = cached[1]
+                    continue
+                if cached:
+                    print(f"Schema changed for {name}; re-rendering table info")
+                missing.append((name, signature, cached is not None or name in self._stale))
+        # Column and sample-row queries run outside the cache lock
+        for name, signature, refresh in missing:
+            with self._render_lock:
+                info = self._render(name, get_col_comments, refresh=refresh)
+            with self._lock:
+                self._stale.discard(name)
+                self._rendered[(name, get_col_comments)] = (signature, info)
+            tables[name] = info
+        return {name: tables[name] for name in all_table_names}
+
+    def invalidate(self, table_names: Optional[List[str]] = None) -> None:
+        """Forget rendered info for some tables (or all) and force a signature re-check."""
+        with self._lock:
+            names = {k[0] for k in self._rendered} if table_names is None else set(table_names)
+            for key in [k for k in self._rendered if k[0] in names]:
+                del self._rendered[key]
+            self._stale.update(names)
+            self._signatures = {}
+
+    def stats(self) -> dict:
+        return {"tables_cached": len(self._rendered), "renders": self.renders, "hits": self.hits}
@@ -0,0 +1,214 @@
+"""
+AskOGMS schema catalog.
+Builds one snapshot of every table's columns, primary keys and foreign keys with
+a single query per kind (pg_catalog / sqlite_master), caches it as a JSON payload
+with an ETag, and rebuilds only when the schema version changes.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from schema_cache import table_signatures
+
+_POSTGRES_COLUMNS_SQL = """
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), NOT a.attnotnull
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    WHERE n.nspname = %(schema)s AND c.relkind IN ('r', 'p')
+    ORDER BY c.relname, a.attnum
+"""
+
+_POSTGRES_PRIMARY_KEYS_SQL = """
+    SELECT c.relname, a.attname
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord) ON true
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+    WHERE n.nspname = %(schema)s AND con.contype = 'p'
+    ORDER BY c.relname, k.ord
+"""
+
+_POSTGRES_FOREIGN_KEYS_SQL = """
+    SELECT c.relname, a.attname, rc.relname, ra.attname
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_class rc ON rc.oid = con.confrelid
+    JOIN LATERAL unnest(con.conkey, con.confkey) AS k(attnum, ref_attnum) ON true
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+    JOIN pg_attribute ra ON ra.attrelid = rc.oid AND ra.attnum = k.ref_attnum
+    WHERE n.nspname = %(schema)s AND con.contype = 'f'
+"""
+
+# pragma_table_info().pk is the column's position in the primary key (0 = not part of it)
+_SQLITE_COLUMNS_SQL = """
+    SELECT m.name, p.name, p.type, NOT p."notnull", p.pk
+    FROM sqlite_master m
+    JOIN pragma_table_info(m.name) p
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+    ORDER BY m.name, p.cid
+"""
+
+_SQLITE_FOREIGN_KEYS_SQL = """
+    SELECT m.name, f."from", f."table", f."to"
+    FROM sqlite_master m
+    JOIN pragma_foreign_key_list(m.name) f
+    WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+"""
+
+
+def _assemble(columns, primary_keys, foreign_keys) -> Dict[str, dict]:
+    """
+    Combine catalog rows into {table: {"columns": [...]}} in the /api/schema format.
+
+    Args:
+        columns: (table, column, type, nullable) rows in ordinal order
+        primary_keys: (table, column) rows
+        foreign_keys: (table, column, ref_table, ref_column) rows; ref_column may be
+            None (SQLite: references the target's primary key)
+    """
+    tables: Dict[str, dict] = {}
+    for table, name, data_type, nullable in columns:
+        tables.setdefault(table, {"columns": []})["columns"].append(
+            {"name": name, "type": str(data_type), "nullable": bool(nullable), "pk": False, "fk": None})
+    pk_map: Dict[str, list] = {}
+    for table, name in primary_keys:
+        pk_map.setdefault(table, []).append(name)
+    fk_map = {}
+    for table, name, ref_table, ref_column in foreign_keys:
+        if ref_column is None:
+            ref_column = (pk_map.get(ref_table) or [None])[0]
+        fk_map[(table, name)] = {"table": ref_table, "column": ref_column}
+    for table, info in tables.items():
+        for column in info["columns"]:
+            column["pk"] = column["name"] in pk_map.get(table, ())
+            column["fk"] = fk_map.get((table, column["name"]))
+    return tables
+
+
+def read_catalog(sql_engine, schema: Optional[str] = None) -> Dict[str, dict]:
+    """
+    Read columns, primary keys and foreign keys for every table.
+
+    PostgreSQL and SQLite use one catalog query per kind; other dialects fall back
+    to SQLAlchemy reflection.
+
+    Args:
+        sql_engine: SQLAlchemy engine
+        schema (str, optional): Schema name (PostgreSQL default: public)
+
+    Returns:
+        Dict[str, dict]: {table: {"columns": [{"name", "type", "nullable", "pk", "fk"}]}}
+    """
+    dialect = sql_engine.dialect.name
+    if dialect == "postgresql":
+        params = {"schema": schema or "public"}
+        with sql_engine.connect() as conn:
+            columns = conn.exec_driver_sql(_POSTGRES_COLUMNS_SQL, params).fetchall()
+            primary_keys = conn.exec_driver_sql(_POSTGRES_PRIMARY_KEYS_SQL, params).fetchall()
+            foreign_keys = conn.exec_driver_sql(_POSTGRES_FOREIGN_KEYS_SQL, params).fetchall()
+        return _assemble(columns, primary_keys, foreign_keys)
+
+    if dialect == "sqlite":
+        with sql_engine.connect() as conn:
+            rows = conn.exec_driver_sql(_SQLITE_COLUMNS_SQL).fetchall()
+            foreign_keys = conn.exec_driver_sql(_SQLITE_FOREIGN_KEYS_SQL).fetchall()
+        primary_keys = [(table, name) for table, name, _, _, pk in sorted(rows, key=lambda r: r[4]) if pk]
+        return _assemble([row[:4] for row in rows], primary_keys, foreign_keys)
+
+    from sqlalchemy import inspect
+    inspector = inspect(sql_engine)
+    columns, primary_keys, foreign_keys = [], [], []
+    for table in sorted(inspector.get_table_names(schema=schema)):
+        columns += [(table, c["name"], c["type"], c["nullable"]) for c in inspector.get_columns(table, schema=schema)]
+        primary_keys += [(table, name) for name in inspector.get_pk_constraint(table, schema=schema)["constrained_columns"]]
+        for fk in inspector.get_foreign_keys(table, schema=schema):
+            foreign_keys += [(table, name, fk["referred_table"], ref)
+                             for name, ref in zip(fk["constrained_columns"], fk["referred_columns"])]
+    return _assemble(columns, primary_keys, foreign_keys)
+
+
+def schema_version(sql_engine, schema: Optional[str] = None) -> str:
+    """Cheap schema version: PRAGMA schema_version on SQLite, a hash of table signatures elsewhere."""
+    if sql_engine.dialect.name == "sqlite":
+        with sql_engine.connect() as conn:
+            return str(conn.exec_driver_sql("PRAGMA schema_version").scalar())
+    signatures = table_signatures(sql_engine, schema)
+    return hashlib.sha1(json.dumps(signatures, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class SchemaCatalog:
+    """
+    In-process catalog snapshot for the schema viewer.
+
+    The serialized payload and its ETag are reused until the schema version
+    changes; the version is re-checked at most once per `check_interval` seconds,
+    outside the lock, so requests never queue behind catalog queries.
+    """
+
+    def __init__(self, sql_engine, schema: Optional[str] = None, check_interval: float = 60):
+        self.sql_engine = sql_engine
+        self.schema = schema
+        self.check_interval = check_interval
+        self.builds = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._tables: Dict[str, dict] = {}
+        self._payload = b""
+        self._etag = ""
+        self._version = None
+        self._checked_at = 0.0
+        self._checking = False
+
+    def _refresh(self) -> None:
+        """Re-check the schema version if due and rebuild the snapshot; catalog queries run outside the lock."""
+        with self._lock:
+            now = time.monotonic()
+            current = self._version
+            if current is not None and (self._checking or now - self._checked_at < self.check_interval):
+                self.hits += 1
+                return
+            self._checking = True  # One check in flight; other requests keep the current snapshot
+        try:
+            version = schema_version(self.sql_engine, self.schema)
+            if version == current:
+                tables = None
+            else:
+                tables = read_catalog(self.sql_engine, self.schema)
+                payload = json.dumps({"tables": tables}, separators=(",", ":")).encode("utf-8")
+        finally:
+            with self._lock:
+                self._checking = False
+        with self._lock:
+            self._checked_at = now
+            if tables is None:
+                self.hits += 1
+                return
+            self._tables, self._payload, self._version = tables, payload, version
+            self._etag = hashlib.sha1(payload).hexdigest()[:16]
+            self.builds += 1
+        print(f"Schema catalog: {len(tables)} tables (build {self.builds})")
+
+    def payload(self) -> Tuple[bytes, str]:
+        """Return (JSON payload, ETag) for the whole catalog."""
+        self._refresh()
+        with self._lock:
+            return self._payload, self._etag
+
+    def tables(self) -> Dict[str, dict]:
+        """Return the catalog as {table: {"columns": [...]}}."""
+        self._refresh()
+        with self._lock:
+            return self._tables
+
+    def invalidate(self) -> None:
+        """Rebuild the snapshot on the next request."""
+        with self._lock:
+            self._version = None
+
+    def stats(self) -> dict:
+        return {"tables": len(self._tables), "builds": self.builds, "hits": self.hits, "etag": self._etag}
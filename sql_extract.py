@@ -0,0 +1,151 @@
+"""
+AskOGMS SQL extraction.
+Pulls the SQL statement out of raw LLM output (code fences, "SQLQuery:" style
+prefixes, surrounding prose) with one precompiled tokenizer pass that respects
+string literals (including E'...' escapes and $$ dollar quoting), quoted
+identifiers and comments, then lays the statement out
+one clause per line.
+"""
+import re
+from typing import List, Optional, Tuple
+
+# Compiled once. Each match is one token plus the whitespace/comments before it,
+# so the input is consumed in a single left-to-right scan.
+_TOKEN_RE = re.compile(r"""
+    (?P<space>(?:\s+|--[^\n]*|/\*.*?(?:\*/|\Z))*)
+    (?:
+        (?P<estring>[Ee]'(?:[^'\\]|\\.|'')*'?)
+      | (?P<dollar>\$(?P<dollar_tag>[A-Za-z_][A-Za-z0-9_]*|)\$(?:.*?\$(?P=dollar_tag)\$|.*))
+      | (?P<string>'[^']*(?:''[^']*)*'?)
+      | (?P<ident>"[^"]*(?:""[^"]*)*"?)
+      | (?P<backtick>`[^`]*`?)
+      | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+      | (?P<other>[^\sA-Za-z_'"`;/-]+|\S)
+    )
+""", re.VERBOSE | re.DOTALL)
+
+# Language tags seen after an opening ``` fence
+_FENCE_TAGS = {"sql", "sqlquery", "mysql", "postgresql", "postgres", "sqlite", "psql"}
+
+# Words that start a new line in the output (multi-word clauses are matched as sequences)
+_CLAUSES = {
+    "SELECT": [()], "FROM": [()], "WHERE": [()], "HAVING": [()], "LIMIT": [()], "UNION": [()],
+    "VALUES": [()], "INSERT": [()], "UPDATE": [()], "DELETE": [()], "JOIN": [()],
+    "GROUP": [("BY",)], "ORDER": [("BY",)],
+    "LEFT": [("JOIN",), ("OUTER", "JOIN")], "RIGHT": [("JOIN",), ("OUTER", "JOIN")],
+    "FULL": [("JOIN",), ("OUTER", "JOIN")], "INNER": [("JOIN",)], "CROSS": [("JOIN",)],
+    "OUTER": [("JOIN",)],
+}
+# Join qualifiers: a JOIN / OUTER right after one of these stays on the qualifier's line
+_JOIN_QUALIFIERS = {"LEFT", "RIGHT", "FULL", "INNER", "CROSS", "OUTER"}
+
+Token = Tuple[str, str, bool]  # (kind, text, preceded by whitespace or a comment)
+
+
+def _fenced_body(text: str) -> str:
+    """Content of the first ``` fence (language tag dropped), or the text itself if there is none."""
+    start = text.find("```")
+    if start < 0:
+        return text
+    body_start = start + 3
+    end = text.find("```", body_start)
+    body = text[body_start:] if end < 0 else text[body_start:end]
+    tag = re.match(r"[A-Za-z]+", body)
+    if tag and tag.group(0).lower() in _FENCE_TAGS:
+        body = body[tag.end():]
+    return body
+
+
+def _tokenize(text: str) -> List[Token]:
+    return [(match.lastgroup, match.group(match.lastgroup), match.start(match.lastgroup) > match.start())
+            for match in _TOKEN_RE.finditer(text)]
+
+
+def _next_words(tokens: List[Token], index: int, count: int) -> List[str]:
+    """Upper-cased text of the `count` tokens after `index`."""
+    return [value.upper() for _, value, _ in tokens[index + 1:index + 1 + count]]
+
+
+def _statement_start(tokens: List[Token]) -> Optional[int]:
+    """
+    Index of the token that starts the SQL statement: a top-level (outside any
+    parentheses) WITH followed by `name AS (` / RECURSIVE, whatever its case, or
+    a top-level SELECT. Subqueries and CTE bodies never start the statement. An
+    upper-case SELECT wins over a lower-case one so prose like "select the rows:
+    SELECT ..." starts at the real query.
+    """
+    first_select = None
+    depth = 0
+    for i, (kind, value, _) in enumerate(tokens):
+        if kind == "other":
+            depth = max(0, depth + value.count("(") - value.count(")"))
+            continue
+        if kind != "word" or depth:
+            continue
+        upper = value.upper()
+        if upper == "WITH":
+            ahead = _next_words(tokens, i, 3)
+            if ahead[:1] == ["RECURSIVE"] or ahead[1:3] == ["AS", "("]:
+                return i
+        elif upper == "SELECT":
+            if value.isupper():
+                return i
+            if first_select is None:
+                first_select = i
+    return first_select
+
+
+def _render(tokens: List[Token], identifier_quote: str) -> str:
+    """Join statement tokens: whitespace collapsed, comments dropped, one clause per line."""
+    out: List[str] = []
+    previous_word = ""
+    for i, (kind, value, spaced) in enumerate(tokens):
+        separator = " " if spaced and out else ""
+        if kind == "word":
+            upper = value.upper()
+            sequences = _CLAUSES.get(upper)
+            if sequences is not None and out and not (upper in ("JOIN", "OUTER") and previous_word in _JOIN_QUALIFIERS):
+                if any(_next_words(tokens, i, len(sequence)) == list(sequence) for sequence in sequences):
+                    separator = "\n"
+            previous_word = upper
+        else:
+            previous_word = ""
+            if kind == "backtick":
+                inner = value.strip("`")
+                value = f"{identifier_quote}{inner}{identifier_quote}" if identifier_quote else inner
+        if separator:
+            out.append(separator)
+        out.append(value)
+    return "".join(out)
+
+
+def extract_sql(text: str, identifier_quote: str = '"') -> str:
+    """
+    Extract and normalize the SQL statement from raw LLM output.
+
+    Handles ``` fences with or without a language tag, "SQLQuery:" / "SQL:" style
+    prefixes and prose before or after the query, CTEs (WITH ... SELECT), and
+    semicolons or keywords inside string literals and quoted identifiers. The
+    statement ends at the first top-level semicolon (kept) or the end of the fence.
+    Comments are dropped (a `--` comment would otherwise swallow the rest of the
+    one-line-per-clause output).
+
+    Args:
+        text (str): Raw model output
+        identifier_quote (str): Quote used for `backticked` identifiers ('"' for
+            PostgreSQL/SQLite, '`' for MySQL, '' to drop the backticks)
+
+    Returns:
+        str: The SQL statement, one clause per line
+    """
+    tokens = _tokenize(_fenced_body(text))
+    start = _statement_start(tokens)
+    if start is None:
+        # No recognizable query: normalize whatever is there and let the database report it
+        start = 0
+    end = len(tokens)
+    for i in range(start, len(tokens)):
+        if tokens[i][1] == ";" and tokens[i][0] == "other":
+            end = i + 1
+            break
+    return _render(tokens[start:end], identifier_quote)
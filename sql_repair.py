@@ -0,0 +1,223 @@
+"""
+AskOGMS local SQL validation and repair.
+Parses generated SQL with sqlglot and checks every table and column against the
+cached schema catalog before the query reaches the database. The failures the
+correction prompt lists are fixed deterministically (mixed-case identifiers left
+unquoted, deleted_status on a table that lacks it, ACS TEXT estimates used as
+numbers), so the LLM correction round-trip is only needed when this cannot help.
+"""
+import re
+from typing import Dict, List, Optional, Union
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import traverse_scope
+
+# DB_TYPE -> sqlglot dialect
+_DIALECTS = {"postgresql": "postgres", "postgres": "postgres", "sqlite": "sqlite", "mysql": "mysql"}
+
+# TEXT columns that hold numbers (ACS estimates / standard errors), cast before numeric use
+NUMERIC_TEXT_COLUMNS = re.compile(r"^ACS\d+_", re.IGNORECASE)
+
+# Soft-delete flag: a filter on it is dropped when no table in scope has the column
+SOFT_DELETE_COLUMN = "deleted_status"
+
+# Parents that use their operand as a number
+_NUMERIC_FUNCS = (exp.Sum, exp.Avg, exp.Min, exp.Max, exp.Stddev, exp.Variance, exp.Round, exp.Abs)
+_ARITHMETIC = (exp.Add, exp.Sub, exp.Mul, exp.Div, exp.Mod)
+_ORDERING = (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.EQ, exp.NEQ)
+_NUMERIC_TYPES = {exp.DataType.Type.DECIMAL, exp.DataType.Type.DOUBLE, exp.DataType.Type.FLOAT,
+                  exp.DataType.Type.INT, exp.DataType.Type.BIGINT, exp.DataType.Type.SMALLINT}
+
+
+class RepairResult:
+    """
+    Outcome of validate_and_repair.
+
+    Attributes:
+        sql (str): The query to execute (rewritten only if something was fixed)
+        fixes (List[str]): Changes that were applied
+        problems (List[str]): Issues that could not be fixed locally
+        parsed (bool): False if sqlglot could not parse the query (nothing was checked)
+    """
+
+    __slots__ = ("sql", "fixes", "problems", "parsed")
+
+    def __init__(self, sql: str, fixes: List[str] = None, problems: List[str] = None, parsed: bool = True):
+        self.sql = sql
+        self.fixes = fixes or []
+        self.problems = problems or []
+        self.parsed = parsed
+
+    @property
+    def ok(self) -> bool:
+        return self.parsed and not self.problems
+
+
+def _column_index(tables: Dict[str, dict]) -> Dict[str, dict]:
+    """{lower table name: {"name", "columns": {lower column name: (name, type)}}}"""
+    return {
+        table.lower(): {"name": table,
+                        "columns": {c["name"].lower(): (c["name"], c["type"].upper()) for c in info["columns"]}}
+        for table, info in tables.items()
+    }
+
+
+def _set_identifier(node: exp.Expression, name: str) -> bool:
+    """Point a Table/Column identifier at the catalog's spelling; quote it if case matters."""
+    identifier = node.this
+    needs_quote = name != name.lower()
+    if identifier.this == name and (identifier.quoted or not needs_quote):
+        return False
+    node.set("this", exp.to_identifier(name, quoted=needs_quote or identifier.quoted))
+    return True
+
+
+def _in_numeric_context(column: exp.Column) -> Union[exp.Cast, bool, None]:
+    """
+    Whether the column is used as a number. Returns the enclosing Cast if it is
+    already cast (without NULLIF), True for other numeric uses, None otherwise.
+    """
+    parent = column.parent
+    while isinstance(parent, exp.Paren):
+        parent = parent.parent
+    if isinstance(parent, (exp.Cast, exp.TryCast)):
+        return parent if parent.to.this in _NUMERIC_TYPES else None
+    if isinstance(parent, _NUMERIC_FUNCS + _ARITHMETIC):
+        return True
+    if isinstance(parent, _ORDERING):
+        other = parent.expression if parent.this is column else parent.this
+        return True if isinstance(other, exp.Literal) and not other.is_string else None
+    return None
+
+
+def _numeric_text(column: exp.Column) -> exp.Expression:
+    """NULLIF(NULLIF(col, ''), '.')::numeric"""
+    inner = exp.Nullif(this=exp.Nullif(this=column.copy(), expression=exp.Literal.string("")),
+                       expression=exp.Literal.string("."))
+    return exp.cast(inner, exp.DataType.build("numeric"))
+
+
+def _drop_predicate(node: exp.Expression) -> bool:
+    """Remove the comparison containing `node` from its WHERE / ON / AND chain."""
+    predicate = node
+    while predicate.parent is not None and not isinstance(predicate.parent, (exp.And, exp.Where, exp.Join)):
+        if isinstance(predicate.parent, (exp.Or, exp.Select)):
+            return False  # Dropping one side of an OR would change the result
+        predicate = predicate.parent
+    parent = predicate.parent
+    if isinstance(parent, exp.And):
+        parent.replace(parent.expression if parent.this is predicate else parent.this)
+    elif isinstance(parent, exp.Where):
+        parent.pop()
+    elif isinstance(parent, exp.Join) and parent.args.get("on") is predicate:
+        parent.set("on", exp.true())
+    else:
+        return False
+    return True
+
+
+def referenced_tables(sql: str, db_type: str = "postgresql") -> Optional[List[str]]:
+    """Lower-cased base tables a query reads (CTE names excluded), or None if it does not parse."""
+    try:
+        tree = sqlglot.parse_one(sql, read=_DIALECTS.get(db_type.lower()))
+    except SqlglotError:
+        return None
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    return sorted({table.name.lower() for table in tree.find_all(exp.Table)} - ctes)
+
+
+def validate_and_repair(sql: str, tables: Dict[str, dict], db_type: str = "postgresql") -> RepairResult:
+    """
+    Check a query's tables and columns against the catalog and fix what can be fixed locally.
+
+    Repairs:
+        - table/column names in the wrong case (e.g. unquoted Geo_STUSAB on PostgreSQL,
+          which folds it to geo_stusab) are rewritten to the catalog spelling and quoted
+        - a column qualified with a table that lacks it is moved to the one in-scope
+          table that has it; a deleted_status filter with no such table is dropped
+        - ACS TEXT estimates used in aggregates, arithmetic or numeric comparisons are
+          wrapped in NULLIF(NULLIF(col, ''), '.')::numeric
+
+    Args:
+        sql (str): Generated query
+        tables (Dict[str, dict]): Schema catalog ({table: {"columns": [{"name", "type"}]}})
+        db_type (str): DB_TYPE (postgresql, sqlite, mysql)
+
+    Returns:
+        RepairResult: Query to run plus applied fixes and remaining problems
+    """
+    dialect = _DIALECTS.get(db_type.lower())
+    try:
+        tree = sqlglot.parse_one(sql, read=dialect)
+    except SqlglotError as e:
+        return RepairResult(sql, problems=[f"parse error: {str(e).splitlines()[0]}"], parsed=False)
+
+    catalog = _column_index(tables)
+    fixes, problems = [], []
+    for scope in traverse_scope(tree):
+        # alias -> catalog entry for base tables; derived tables / CTEs are not checked
+        sources = {}
+        for alias, source in scope.sources.items():
+            if not isinstance(source, exp.Table):
+                continue
+            entry = catalog.get(source.name.lower())
+            if entry is None:
+                if source.name.lower() not in {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}:
+                    problems.append(f"unknown table {source.name}")
+                continue
+            if _set_identifier(source, entry["name"]):
+                fixes.append(f"table {entry['name']}")
+            sources[alias.lower()] = entry
+        has_derived = len(sources) < len(scope.sources)
+        select_aliases = {e.alias.lower() for e in getattr(scope.expression, "expressions", []) if e.alias}
+
+        for column in list(scope.columns):
+            key = column.name.lower()
+            qualifier = column.table.lower()
+            if qualifier and qualifier not in sources:
+                continue  # derived table, CTE or outer reference
+            owners = [alias for alias, entry in sources.items() if key in entry["columns"]]
+            if qualifier and qualifier not in owners:
+                if len(owners) == 1:
+                    column.set("table", exp.to_identifier(owners[0]))
+                    fixes.append(f"{column.name} moved from {qualifier} to {owners[0]}")
+                    qualifier = owners[0]
+                elif key == SOFT_DELETE_COLUMN and not owners and _drop_predicate(column):
+                    fixes.append(f"dropped {SOFT_DELETE_COLUMN} filter on {sources[qualifier]['name']}")
+                    continue
+                else:
+                    problems.append(f"column {column.sql(dialect=dialect)} does not exist")
+                    continue
+            if not qualifier:
+                if not owners:
+                    if key in select_aliases or has_derived:
+                        continue
+                    if key == SOFT_DELETE_COLUMN and sources and _drop_predicate(column):
+                        names = ", ".join(entry["name"] for entry in sources.values())
+                        fixes.append(f"dropped {SOFT_DELETE_COLUMN} filter on {names}")
+                    else:
+                        problems.append(f"column {column.name} does not exist")
+                    continue
+                if len(owners) > 1:
+                    continue  # Ambiguous: the database will say so
+                qualifier = owners[0]
+            name, data_type = sources[qualifier]["columns"][key]
+            if _set_identifier(column, name):
+                fixes.append(f"column {name}")
+            if "TEXT" in data_type or "CHAR" in data_type:
+                if NUMERIC_TEXT_COLUMNS.match(name):
+                    context = _in_numeric_context(column)
+                    if isinstance(context, exp.Expression):
+                        context.set("this", _numeric_text(column).this)
+                        fixes.append(f"NULLIF cast on {name}")
+                    elif context:
+                        column.replace(_numeric_text(column))
+                        fixes.append(f"NULLIF cast on {name}")
+
+    if not fixes:
+        return RepairResult(sql, problems=problems)
+    repaired = tree.sql(dialect=dialect)
+    return RepairResult(repaired if repaired.rstrip().endswith(";") or not sql.rstrip().endswith(";") else repaired + ";",
+                        fixes=fixes, problems=problems)
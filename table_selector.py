@@ -0,0 +1,209 @@
+"""
+AskOGMS local table selector.
+Ranks tables by similarity between the question and each table's description +
+column names, so table selection usually needs no LLM round-trip.
+"""
+import hashlib
+import math
+import os
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from local_embeddings import HashingEmbeddings, tokenize
+
+
+class TfidfBackend:
+    """Offline TF-IDF vectors fitted on the table documents (the default backend)."""
+
+    name = "tfidf"
+
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.idf = np.zeros(0)
+
+    def fit_transform(self, documents: List[str]) -> np.ndarray:
+        tokenized = [tokenize(doc) for doc in documents]
+        document_frequency = Counter(token for tokens in tokenized for token in set(tokens))
+        self.vocabulary = {token: i for i, token in enumerate(sorted(document_frequency))}
+        total = len(documents)
+        self.idf = np.array(
+            [math.log((1 + total) / (1 + document_frequency[token])) + 1 for token in sorted(document_frequency)]
+        )
+        return np.vstack([self._vector(tokens) for tokens in tokenized]) if documents else np.zeros((0, 0))
+
+    def _vector(self, tokens: List[str]) -> np.ndarray:
+        vector = np.zeros(len(self.vocabulary))
+        for token, count in Counter(tokens).items():
+            index = self.vocabulary.get(token)
+            if index is not None:
+                vector[index] = (1 + math.log(count)) * self.idf[index]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def transform_query(self, text: str) -> np.ndarray:
+        return self._vector(tokenize(text))
+
+    def state(self) -> dict:
+        return {"vocabulary": np.array(sorted(self.vocabulary, key=self.vocabulary.get)), "idf": self.idf}
+
+    def load_state(self, state: dict) -> None:
+        self.vocabulary = {token: i for i, token in enumerate(state["vocabulary"].tolist())}
+        self.idf = state["idf"]
+
+
+class EmbeddingsBackend:
+    """Wraps any LangChain Embeddings (HashingEmbeddings, GoogleGenerativeAIEmbeddings, ...)."""
+
+    def __init__(self, embeddings, name: str):
+        self.embeddings = embeddings
+        self.name = name
+
+    def fit_transform(self, documents: List[str]) -> np.ndarray:
+        vectors = np.array(self.embeddings.embed_documents(documents), dtype=float)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def transform_query(self, text: str) -> np.ndarray:
+        vector = np.array(self.embeddings.embed_query(text), dtype=float)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def state(self) -> dict:
+        return {}
+
+    def load_state(self, state: dict) -> None:
+        pass
+
+
+def backend_from_name(name: str):
+    """Build an embedding backend: tfidf (default), hashing or google."""
+    name = (name or "tfidf").lower()
+    if name == "hashing":
+        return EmbeddingsBackend(HashingEmbeddings(), "hashing")
+    if name == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        model = os.getenv("GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+        return EmbeddingsBackend(GoogleGenerativeAIEmbeddings(model=model), f"google:{model}")
+    return TfidfBackend()
+
+
+def table_documents(db, descriptions: Dict[str, str]) -> Dict[str, dict]:
+    """
+    Collect the text and FK neighbours for every usable table.
+
+    Args:
+        db: LangChain SQLDatabase (its reflected MetaData supplies columns and FKs)
+        descriptions (dict): table_name -> description from the CSV
+
+    Returns:
+        Dict[str, dict]: table_name -> {"text": str, "neighbours": set}
+    """
+    usable = set(db.get_usable_table_names())
+    documents = {}
+    for table in db._metadata.sorted_tables:
+        if table.name not in usable:
+            continue
+        neighbours = {fk.column.table.name for fk in table.foreign_keys if fk.column.table.name != table.name}
+        columns = " ".join(column.name for column in table.columns)
+        documents[table.name] = {
+            "text": f"{table.name} {table.name} {descriptions.get(table.name, '')} {columns}",
+            "neighbours": neighbours,
+        }
+    # Make FK links symmetric: a referenced table also reaches its referrers
+    for name, doc in documents.items():
+        for neighbour in list(doc["neighbours"]):
+            if neighbour in documents:
+                documents[neighbour]["neighbours"].add(name)
+    return documents
+
+
+class LocalTableSelector:
+    """
+    Top-k table retrieval with FK-neighbour expansion.
+
+    Vectors are built once and saved to `index_path`; the file is reused on
+    restart as long as the table documents and backend are unchanged.
+    """
+
+    def __init__(self, documents: Dict[str, dict], backend=None, index_path: Optional[str] = None,
+                 top_k: int = 4, min_confidence: float = 0.2):
+        self.documents = documents
+        self.tables = sorted(documents)
+        self.backend = backend or TfidfBackend()
+        self.index_path = index_path
+        self.top_k = top_k
+        self.min_confidence = min_confidence
+        self.vectors = self._load_or_build()
+
+    def _fingerprint(self) -> str:
+        digest = hashlib.sha256(self.backend.name.encode("utf-8"))
+        for name in self.tables:
+            digest.update(f"\x00{name}\x00{self.documents[name]['text']}".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def _load_or_build(self) -> np.ndarray:
+        fingerprint = self._fingerprint()
+        if self.index_path and os.path.exists(self.index_path):
+            try:
+                with np.load(self.index_path, allow_pickle=False) as saved:
+                    if str(saved["fingerprint"]) == fingerprint:
+                        self.backend.load_state({key: saved[key] for key in saved.files})
+                        return saved["vectors"]
+            except Exception as e:
+                print(f"Rebuilding table index ({self.index_path}): {e}")
+        vectors = self.backend.fit_transform([self.documents[name]["text"] for name in self.tables])
+        if self.index_path:
+            try:
+                with open(self.index_path, "wb") as f:
+                    np.savez(f, vectors=vectors, fingerprint=np.array(fingerprint), **self.backend.state())
+            except OSError as e:
+                print(f"Could not save table index ({self.index_path}): {e}")
+        return vectors
+
+    def select(self, question: str) -> dict:
+        """
+        Rank tables for a question.
+
+        Args:
+            question (str): The user's question
+
+        Returns:
+            dict: {"tables": List[str], "confidence": float, "scores": {table: score}}
+        """
+        if not self.tables:
+            return {"tables": [], "confidence": 0.0, "scores": {}}
+        query = self.backend.transform_query(question)
+        scores = self.vectors @ query if query.any() else np.zeros(len(self.tables))
+
+        # Tables named in the question ("student programs" -> student_programs) always win
+        question_tokens = set(tokenize(question))
+        for i, name in enumerate(self.tables):
+            if set(tokenize(name)) <= question_tokens:
+                scores[i] = max(scores[i], 1.0)
+
+        order = np.argsort(-scores)
+        best = float(scores[order[0]])
+        selected = [
+            self.tables[i] for i in order[: self.top_k]
+            if scores[i] > 0 and scores[i] >= 0.5 * best
+        ]
+        score_map = {self.tables[i]: round(float(scores[i]), 4) for i in order if scores[i] > 0}
+
+        # FK expansion: add a table that bridges two selected tables that are not
+        # directly linked, and direct neighbours that also matched the question
+        expanded = list(selected)
+        for i, a in enumerate(selected):
+            for b in selected[i + 1:]:
+                if b in self.documents[a]["neighbours"]:
+                    continue
+                bridges = self.documents[a]["neighbours"] & self.documents[b]["neighbours"]
+                for bridge in sorted(bridges, key=lambda t: -score_map.get(t, 0))[:1]:
+                    if bridge not in expanded:
+                        expanded.append(bridge)
+            for neighbour in self.documents[a]["neighbours"]:
+                if neighbour not in expanded and score_map.get(neighbour, 0) >= 0.5 * best:
+                    expanded.append(neighbour)
+
+        return {"tables": expanded, "confidence": round(best, 4), "scores": score_map}
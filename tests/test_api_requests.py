@@ -0,0 +1,35 @@
+import pytest
+
+from api_requests import BATCH_MAX_QUESTIONS, answer_mode, batch_request
+
+
+def test_batch_request_valid():
+    parsed, error = batch_request({"questions": ["a", "b"], "max_concurrency": 2, "answer_mode": "template"})
+    assert error is None
+    assert parsed == (["a", "b"], 2, "template")
+
+
+def test_batch_request_defaults():
+    assert batch_request({"questions": ["a"]}) == ((["a"], None, None), None)
+
+
+@pytest.mark.parametrize("max_concurrency", [0, -1, "4", 2.5, True])
+def test_batch_request_rejects_bad_max_concurrency(max_concurrency):
+    parsed, error = batch_request({"questions": ["a"], "max_concurrency": max_concurrency})
+    assert parsed is None
+    assert "max_concurrency" in error
+
+
+@pytest.mark.parametrize("data", [None, [], {"questions": []}, {"questions": ["a", " "]}, {"questions": "a"},
+                                  {"questions": ["a"] * (BATCH_MAX_QUESTIONS + 1)}])
+def test_batch_request_rejects_bad_questions(data):
+    parsed, error = batch_request(data)
+    assert parsed is None
+    assert error
+
+
+def test_answer_mode():
+    assert answer_mode({}) == (None, None)
+    assert answer_mode({"answer_mode": "llm"}) == ("llm", None)
+    mode, error = answer_mode({"answer_mode": "poem"})
+    assert mode is None and "answer_mode" in error
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from chat_sessions import SessionStore
+
+
+def test_concurrent_summaries_keep_every_dropped_turn():
+    def summarizer(previous, dropped):
+        time.sleep(0.05)  # both adds would otherwise read the same previous summary
+        return " | ".join(filter(None, [previous] + [message["content"] for message in dropped]))
+
+    store = SessionStore(window_tokens=3, summarizer=summarizer, background=False)
+    store.add("s", "user", "aaaa")
+    store.add("s", "assistant", "bbbb")  # drops "aaaa" (summarized before the threads start)
+    threads = [threading.Thread(target=store.add, args=("s", "user", text)) for text in ("cccc", "dddd")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary, last = store.messages("s")
+    # Each thread dropped one turn; whichever finished second is the one still in the window
+    for text in ("aaaa", "bbbb", "cccc", "dddd"):
+        assert (text in summary["content"]) != (text == last["content"])
+    assert store.stats()["summaries"] == 3
+
+
+def test_failed_summary_keeps_previous_summary():
+    def summarizer(previous, dropped):
+        raise RuntimeError("LLM down")
+
+    store = SessionStore(window_tokens=3, summarizer=summarizer, background=False)
+    store.add("s", "user", "aaaa")
+    store.add("s", "assistant", "bbbb")
+    assert store.messages("s") == [{"role": "assistant", "content": "bbbb"}]
+
+
+def test_background_summary_does_not_block_add():
+    release = threading.Event()
+
+    def summarizer(previous, dropped):
+        release.wait(5)
+        return "summary"
+
+    store = SessionStore(window_tokens=3, summarizer=summarizer)
+    store.add("s", "user", "aaaa")
+    started = time.monotonic()
+    store.add("s", "assistant", "bbbb")
+    assert time.monotonic() - started < 1
+    assert store.messages("s") == [{"role": "assistant", "content": "bbbb"}]
+    release.set()
+    for _ in range(100):
+        if store.stats()["summaries"]:
+            break
+        time.sleep(0.01)
+    assert store.messages("s")[0]["content"] == "Earlier in this conversation: summary"
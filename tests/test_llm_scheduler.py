@@ -0,0 +1,92 @@
+import pytest
+
+from llm_scheduler import LLMQueueTimeout, LLMScheduler, llm_priority
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_request_bucket_denies_when_empty_and_refills(clock):
+    scheduler = LLMScheduler(requests_per_minute=60, clock=clock)  # 1/s, 10s burst
+    assert all(scheduler.acquire(blocking=False) for _ in range(10))
+    assert scheduler.acquire(blocking=False) is False
+    clock.advance(1)
+    assert scheduler.acquire(blocking=False) is True
+    assert scheduler.acquire(blocking=False) is False
+    assert scheduler.granted["interactive"] == 11
+
+
+def test_token_debt_delays_the_next_call(clock):
+    scheduler = LLMScheduler(tokens_per_minute=600, clock=clock)  # 10 tokens/s, 100 burst
+    assert scheduler.acquire(blocking=False)
+    scheduler.charge(150)  # a long answer leaves the bucket 50 tokens in debt
+    assert scheduler.acquire(blocking=False) is False
+    clock.advance(5)
+    assert scheduler.acquire(blocking=False) is False
+    clock.advance(0.2)
+    assert scheduler.acquire(blocking=False) is True
+
+
+def test_higher_priority_is_served_first(clock):
+    scheduler = LLMScheduler(requests_per_minute=6, clock=clock)  # one request per 10s
+    assert scheduler.acquire(blocking=False)
+    with scheduler._cond:
+        batch = scheduler._enqueue("batch")
+        interactive = scheduler._enqueue("interactive")
+        clock.advance(10)
+        # The batch call arrived first, but the interactive one is at the head of the queue
+        assert scheduler._poll(batch, "batch", clock.now, blocking=True) is not True
+        assert scheduler._poll(interactive, "interactive", clock.now, blocking=True) is True
+        assert scheduler._waiting == [batch]
+        clock.advance(10)
+        assert scheduler._poll(batch, "batch", clock.now, blocking=True) is True
+    assert scheduler.granted == {"interactive": 2, "batch": 1}
+
+
+def test_deadline_expires_in_the_queue(clock):
+    scheduler = LLMScheduler(requests_per_minute=1, deadlines={"batch": 30}, clock=clock)
+    assert scheduler.acquire(blocking=False)
+    enqueued = clock.now
+    with scheduler._cond:
+        ticket = scheduler._enqueue("batch")
+        wait = scheduler._poll(ticket, "batch", enqueued, blocking=True)
+        assert 0 < wait <= 30
+        clock.advance(31)  # still 29s short of the next request
+        with pytest.raises(LLMQueueTimeout, match="30s in the batch queue"):
+            scheduler._poll(ticket, "batch", enqueued, blocking=True)
+        scheduler._leave(ticket, "batch")
+    assert scheduler.timeouts["batch"] == 1
+    assert scheduler.stats()["priorities"]["batch"]["waiting"] == 0
+
+
+def test_throttle_holds_calls_after_a_429(clock):
+    scheduler = LLMScheduler(throttle_backoff=5, clock=clock)
+    scheduler.callback.on_llm_error(RuntimeError("500 internal error"))
+    assert scheduler.acquire(blocking=False) is True
+    scheduler.callback.on_llm_error(RuntimeError("429 RESOURCE_EXHAUSTED: quota exceeded"))
+    assert scheduler.throttled == 1
+    assert scheduler.acquire(blocking=False) is False
+    clock.advance(4.9)
+    assert scheduler.acquire(blocking=False) is False
+    clock.advance(0.1)
+    assert scheduler.acquire(blocking=False) is True
+
+
+def test_priority_context_never_raises_a_batch_job():
+    scheduler = LLMScheduler()
+    with llm_priority("batch"), llm_priority("correction"):
+        assert scheduler.acquire(blocking=False)
+    assert scheduler.granted == {"batch": 1}
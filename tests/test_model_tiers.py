@@ -0,0 +1,75 @@
+import pytest
+
+from model_tiers import ModelTiers, question_difficulty
+
+
+@pytest.mark.parametrize("question", [
+    "How many leads by status?",
+    "Show the number of cases per state",
+    "List accounts not in California",
+    "Which contacts have no email?",
+    "Top 5 products by revenue",
+    "What is the total revenue for each region by month?",
+    "Show every open case for the Acme account",
+])
+def test_ordinary_questions_score_zero(question):
+    assert question_difficulty(question) == (0, [])
+
+
+@pytest.mark.parametrize("question, signals", [
+    ("Running total of revenue by month", ["window"]),
+    ("Top 3 sales reps per region by revenue compared to last year", ["window", "comparison"]),
+    ("Which accounts have never placed an order?", ["subquery"]),
+    ("Show customers whose spend is above the average for their region", ["subquery"]),
+    ("What is the ratio of closed to open cases, compared with last quarter?", ["comparison", "ratio"]),
+    ("Month over month growth in signups", ["window", "change"]),
+    ("Average deal size and total count of deals by owner", ["multi_metric"]),
+])
+def test_hard_question_signals(question, signals):
+    assert question_difficulty(question) == (len(signals), signals)
+
+
+def test_long_questions_get_a_point():
+    question = " ".join(["word"] * 25)
+    assert question_difficulty(question) == (1, ["long"])
+
+
+@pytest.fixture
+def tiers():
+    return ModelTiers("gemini-default", stage_models={"answer": "gemini-fast"}, strong_model="gemini-strong")
+
+
+def test_ordinary_question_keeps_the_default_model(tiers):
+    assert tiers.sql_model("How many leads by status per owner?", llm_routed=True) == ("gemini-default", None)
+
+
+def test_hard_question_escalates(tiers):
+    assert tiers.sql_model("Month over month growth in signups") == ("gemini-strong", "hard_question")
+
+
+def test_llm_routing_adds_a_point(tiers):
+    question = "Which accounts have never placed an order?"
+    assert tiers.sql_model(question) == ("gemini-default", None)
+    assert tiers.sql_model(question, llm_routed=True) == ("gemini-strong", "hard_question")
+
+
+def test_no_escalation_without_a_strong_model():
+    tiers = ModelTiers("gemini-default")
+    assert tiers.sql_model("Month over month growth in signups") == ("gemini-default", None)
+    assert tiers.correction_model() == ("gemini-default", None)
+
+
+def test_escalation_switches(tiers):
+    assert tiers.correction_model() == ("gemini-strong", "failed_execution")
+    quiet = ModelTiers("gemini-default", strong_model="gemini-strong", escalate_hard=False, escalate_on_failure=False)
+    assert quiet.sql_model("Month over month growth in signups") == ("gemini-default", None)
+    assert quiet.correction_model() == ("gemini-default", None)
+
+
+def test_stage_models_and_escalation_stats(tiers):
+    assert tiers.model_for("answer") == "gemini-fast"
+    assert tiers.model_for("table_selection") == "gemini-default"
+    tiers.sql_model("How many leads?")
+    tiers.sql_model("Running total of revenue compared to last year")
+    escalation = tiers.stats()["escalation"]["sql_generation"]
+    assert escalation == {"decisions": 2, "escalated": 1, "reasons": {"hard_question": 1}, "rate": 0.5}
@@ -0,0 +1,27 @@
+from prompt_budget import PromptBudget
+
+
+def _table(name, rows):
+    sample = "\n".join(f"{i}\tvalue {i}" for i in range(rows))
+    return (f"\nCREATE TABLE {name} (\n\tid INTEGER NOT NULL, \n\tlabel TEXT, \n\tPRIMARY KEY (id)\n)\n\n"
+            f"/*\n{rows} rows from {name} table:\nid\tlabel\n{sample}\n*/")
+
+
+def test_table_info_keeps_relevance_order():
+    tables = {"zones": _table("zones", 1), "accounts": _table("accounts", 1)}
+    text, compactions = PromptBudget().fit_table_info("zones per account", tables, None)
+    assert compactions == {}
+    assert text.index("CREATE TABLE zones") < text.index("CREATE TABLE accounts")
+
+
+def test_compacted_table_info_keeps_relevance_order():
+    tables = {"zones": _table("zones", 3), "accounts": _table("accounts", 3)}
+    text, compactions = PromptBudget().fit_table_info("zones per account", tables, 60)
+    assert compactions["sample_rows"] == "3->0"
+    assert text.index("CREATE TABLE zones") < text.index("CREATE TABLE accounts")
+
+
+def test_history_text_is_empty_without_a_history_budget():
+    messages = [{"role": "user", "content": "how many leads in 2024?"}, {"role": "assistant", "content": "12"}]
+    assert PromptBudget(history=0).history_text("what about last year?", messages) == ""
+    assert "how many leads in 2024?" in PromptBudget(history=200).history_text("what about last year?", messages)
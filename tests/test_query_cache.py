@@ -0,0 +1,57 @@
+import pytest
+
+import query_cache
+from query_cache import QuestionCache, normalize_question
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_history_context_is_part_of_the_key():
+    cache = QuestionCache(":memory:")
+    cache.put("what about last year?", "fp", "SELECT 1", ["leads"], context="user: leads in 2024?")
+    assert cache.get("what about last year?", "fp") is None
+    assert cache.get("what about last year?", "fp", context="user: cases in 2024?") is None
+    assert cache.get("What about last year", "fp", context="user: leads in 2024?") == {
+        "query": "SELECT 1", "tables": ["leads"]}
+
+
+def test_normalize_question_keeps_quoted_literals():
+    assert normalize_question("How many  cases in 'CA'?") == "how many cases in 'CA'"
+
+
+def test_entries_are_keyed_on_the_schema_fingerprint():
+    cache = QuestionCache(":memory:")
+    cache.put("how many leads?", "fp1", "SELECT COUNT(*) FROM leads")
+    assert cache.get("How many leads", "fp1") == {"query": "SELECT COUNT(*) FROM leads", "tables": []}
+    assert cache.get("how many leads?", "fp2") is None
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = QuestionCache(":memory:", ttl_seconds=60)
+    cache.put("how many leads?", "fp", "SELECT COUNT(*) FROM leads")
+    clock[0] += 59
+    assert cache.get("how many leads?", "fp") is not None
+    clock[0] += 2  # the TTL counts from when the entry was stored, not from its last hit
+    assert cache.get("how many leads?", "fp") is None
+    assert cache.stats() == {"entries": 0, "hits": 1, "misses": 1, "evictions": 1, "hit_rate": 0.5}
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = QuestionCache(":memory:", ttl_seconds=0, max_entries=2)
+    cache.put("first", "fp", "SELECT 1")
+    clock[0] += 1
+    cache.put("second", "fp", "SELECT 2")
+    clock[0] += 1
+    assert cache.get("first", "fp")  # now more recently used than "second"
+    clock[0] += 1
+    cache.put("third", "fp", "SELECT 3")
+    assert cache.get("second", "fp") is None
+    assert cache.get("first", "fp") == {"query": "SELECT 1", "tables": []}
+    assert cache.get("third", "fp") == {"query": "SELECT 3", "tables": []}
+    assert cache.stats()["entries"] == 2
+    assert cache.evictions == 1
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from query_guard import ExecutionPolicy, QueryRejected
+
+
+def test_mysql_session_is_read_only_and_reset():
+    policy = ExecutionPolicy(read_only=True, statement_timeout_ms=5000)
+    assert policy.session_statements("mysql") == ["SET SESSION TRANSACTION READ ONLY",
+                                                  "SET SESSION max_execution_time = 5000"]
+    assert policy.reset_statements("mysql") == ["SET SESSION TRANSACTION READ WRITE",
+                                                "SET SESSION max_execution_time = 0"]
+
+
+def test_mysql_without_read_only():
+    policy = ExecutionPolicy(read_only=False, statement_timeout_ms=0)
+    assert policy.session_statements("mysql") == []
+    assert policy.reset_statements("mysql") == []
+
+
+def test_postgres_statements_are_transaction_scoped():
+    policy = ExecutionPolicy(read_only=True, statement_timeout_ms=1000)
+    assert policy.session_statements("postgresql") == ["SET TRANSACTION READ ONLY",
+                                                       "SET LOCAL statement_timeout = 1000"]
+    assert policy.reset_statements("postgresql") == []
+
+
+@pytest.fixture
+def policy():
+    return ExecutionPolicy(read_only=True, auto_limit=1001, max_cost=1000, max_plan_rows=50000)
+
+
+def test_prepare_adds_a_limit(policy):
+    assert policy.prepare("SELECT id FROM leads;") == "SELECT id FROM leads\nLIMIT 1001"
+    assert policy.prepare("WITH t AS (SELECT id FROM leads LIMIT 5) SELECT * FROM t") == (
+        "WITH t AS (SELECT id FROM leads LIMIT 5) SELECT * FROM t\nLIMIT 1001")
+
+
+@pytest.mark.parametrize("sql", ["SELECT id FROM leads LIMIT 10;", "SELECT id FROM leads LIMIT 10 OFFSET 20",
+                                 "SELECT id FROM leads FETCH FIRST 5 ROWS ONLY"])
+def test_prepare_keeps_a_smaller_trailing_limit(policy, sql):
+    assert policy.prepare(sql) is sql
+
+
+def test_prepare_clamps_a_larger_trailing_limit(policy):
+    assert policy.prepare("SELECT id FROM leads LIMIT 1000000;") == "SELECT id FROM leads LIMIT 1001"
+    assert policy.prepare("SELECT id FROM leads limit 50000 offset 10") == "SELECT id FROM leads limit 1001 offset 10"
+
+
+def test_prepare_without_auto_limit():
+    sql = "SELECT id FROM leads"
+    assert ExecutionPolicy(auto_limit=0).prepare(sql) is sql
+
+
+@pytest.mark.parametrize("sql", ["DELETE FROM leads", "UPDATE leads SET status = 'x'", "DROP TABLE leads",
+                                 "INSERT INTO leads VALUES (1)", "  -- comment\nTRUNCATE leads"])
+def test_prepare_rejects_writes(policy, sql):
+    with pytest.raises(QueryRejected, match="read-only"):
+        policy.prepare(sql)
+
+
+@pytest.mark.parametrize("sql", ["SELECT 1; DROP TABLE leads", "SELECT 1;\nDELETE FROM leads;",
+                                 "SELECT 1 /* ; */; SELECT 2"])
+def test_prepare_rejects_multiple_statements(policy, sql):
+    with pytest.raises(QueryRejected, match="single SQL statement"):
+        policy.prepare(sql)
+
+
+@pytest.mark.parametrize("sql", ["SELECT 'a;b' FROM leads;", 'SELECT "odd;name" FROM leads', "SELECT 1; -- done;",
+                                 "SELECT $$a;b$$ FROM leads", "SELECT 1 /* x; y */ FROM leads"])
+def test_prepare_allows_semicolons_inside_literals_and_comments(policy, sql):
+    policy.prepare(sql)
+
+
+def _postgres_plan(cost, rows, child_rows=None, limit=False):
+    child = {"Node Type": "Seq Scan", "Plan Rows": child_rows if child_rows is not None else rows}
+    root = {"Node Type": "Limit" if limit else "Hash Join", "Total Cost": cost, "Plan Rows": rows, "Plans": [child]}
+    return [{"Plan": root}]
+
+
+def test_check_plan_accepts_cheap_plans(policy):
+    assert policy.check_plan("postgresql", _postgres_plan(10.5, 100)) == {"cost": 10.5, "rows": 100.0}
+
+
+def test_check_plan_rejects_expensive_plans(policy):
+    with pytest.raises(QueryRejected, match="estimated cost 5000"):
+        policy.check_plan("postgresql", json.dumps(_postgres_plan(5000, 10)))
+
+
+def test_check_plan_rejects_row_explosions(policy):
+    with pytest.raises(QueryRejected, match="100000 rows"):
+        policy.check_plan("postgresql", _postgres_plan(10, 10, child_rows=100000))
+
+
+def test_check_plan_ignores_rows_under_a_limit(policy):
+    assert policy.check_plan("postgresql", _postgres_plan(10, 100, child_rows=100000, limit=True))["rows"] == 100
+
+
+def test_check_plan_mysql_cost(policy):
+    plan = {"query_block": {"cost_info": {"query_cost": "2500.00"}}}
+    with pytest.raises(QueryRejected, match="estimated cost"):
+        policy.check_plan("mysql", plan)
+    assert ExecutionPolicy(max_cost=0).check_plan("mysql", plan) == {"cost": 2500.0, "rows": 0.0}
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from query_router import QueryRouter, RouteDecision, router_from_env
+
+
+def test_router_log_is_opt_in(monkeypatch):
+    monkeypatch.delenv("ROUTER_LOG", raising=False)
+    assert router_from_env("llm").log_path is None
+    monkeypatch.setenv("ROUTER_LOG", "off")
+    assert router_from_env("llm").log_path is None
+    monkeypatch.setenv("ROUTER_LOG", "routes.jsonl")
+    assert router_from_env("llm").log_path == "routes.jsonl"
+
+
+def test_record_writes_the_log_outside_the_router_lock(tmp_path, monkeypatch):
+    router = QueryRouter([], log_path=str(tmp_path / "routes.jsonl"))
+    lock_held = []
+    real_open = open
+
+    def spy_open(*args, **kwargs):
+        lock_held.append(router._lock.locked())
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", spy_open)
+    router.record("how many leads?", RouteDecision("llm", 0.0, "fallback", None), ["leads"], None, ["leads"],
+                  True, 1, 0.5)
+    assert lock_held == [False]
+    record = json.loads((tmp_path / "routes.jsonl").read_text())
+    assert record["question"] == "how many leads?" and record["ok"] is True
+    assert router.stats()["routes"]["llm"]["count"] == 1
+
+
+def test_record_route_skips_log_only_work_without_a_log(monkeypatch):
+    import query_engine
+    engine = query_engine.QueryEngine()
+    engine._router = QueryRouter([], log_path=None)
+    monkeypatch.setattr(query_engine, "referenced_tables", lambda *args: pytest.fail("SQL parsed without a log"))
+    monkeypatch.setattr(query_engine.QueryEngine, "table_selector",
+                        property(lambda self: pytest.fail("index queried without a log")))
+    engine._record_route("how many leads?", RouteDecision("llm", 0.0, "fallback", None),
+                         {"table_names_to_use": ["leads"]}, {"query": "SELECT COUNT(*) FROM leads"}, 0.0)
+    assert engine.router.stats()["routes"]["llm"]["count"] == 1
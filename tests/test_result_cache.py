@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import pytest
+
+import result_cache
+from query_results import QueryResult
+from result_cache import ResultCache, canonical_sql
+
+
+@pytest.mark.parametrize("dialect, sql", [
+    ("postgresql", "SELECT COUNT(*) FROM orders WHERE created_at > CURRENT_DATE - 7"),
+    ("postgresql", "SELECT id, now() FROM orders"),
+    ("postgresql", "SELECT * FROM orders WHERE created_at > CURRENT_TIMESTAMP - INTERVAL '1 day'"),
+    ("postgresql", "SELECT * FROM orders ORDER BY random() LIMIT 1"),
+    ("postgresql", "SELECT * FROM orders WHERE created_at > 'now'::date"),
+    ("mysql", "SELECT * FROM orders ORDER BY RAND() LIMIT 1"),
+    ("sqlite", "SELECT * FROM orders WHERE created_at > date('now', '-7 day')"),
+])
+def test_canonical_sql_skips_volatile_queries(dialect, sql):
+    assert canonical_sql(sql, dialect) is None
+
+
+def test_canonical_sql_normalizes_stable_queries():
+    assert canonical_sql("select  id from Orders where status = 'now';", "postgresql") == (
+        "SELECT id FROM orders WHERE status = 'now'", ["orders"])
+
+
+def test_version_check_runs_outside_the_lock(monkeypatch):
+    cache = ResultCache(SimpleNamespace(dialect=SimpleNamespace(name="postgresql")), check_interval=0)
+    lock_held = []
+    versions = iter([{"orders": "1:0:0:1"}, {"orders": "2:0:0:2"}])
+
+    def fake_versions(sql_engine):
+        lock_held.append(cache._lock.locked())
+        return next(versions)
+
+    monkeypatch.setattr(result_cache, "table_versions", fake_versions)
+    cache.put("k", ["orders"], QueryResult(columns=["id"], rows=[(1,)], byte_count=10))
+    assert cache.get("k") is not None
+    assert cache.get("k") is None  # orders changed between the two checks
+    assert lock_held == [False, False]
+    assert cache.stats()["invalidations"] == 1
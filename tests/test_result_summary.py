@@ -0,0 +1,31 @@
+from decimal import Decimal
+
+import pytest
+
+from query_results import QueryResult
+from result_summary import format_value, scalar_answer, template_answer
+
+
+@pytest.mark.parametrize("value, expected", [
+    (0.0042, "0.0042"),
+    (-0.001, "-0.001"),
+    (1e-7, "1e-07"),
+    (Decimal("0.00042"), "0.00042"),
+    (-0.5, "-0.5"),
+    (-1234.5, "-1,234.5"),
+    (1234567.891, "1,234,567.89"),
+    (0.0, "0"),
+    (12, "12"),
+])
+def test_format_value_keeps_small_and_negative_numbers(value, expected):
+    assert format_value(value) == expected
+
+
+def test_scalar_answer_small_average():
+    result = QueryResult(columns=["avg_rate"], rows=[(0.0042,)])
+    assert scalar_answer("What is the average rate?", result) == "**Avg rate**: 0.0042"
+
+
+def test_template_answer_negative_change():
+    result = QueryResult(columns=["change"], rows=[(-0.001,)])
+    assert "-0.001" in template_answer("How much did it change?", result)
@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from schema_cache import SchemaInfoCache
+
+
+@pytest.fixture
+def sql_database():
+    from langchain_community.utilities.sql_database import SQLDatabase
+    sql_engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    with sql_engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE leads (id INTEGER PRIMARY KEY, status TEXT)")
+        conn.exec_driver_sql("CREATE TABLE accounts (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.exec_driver_sql("INSERT INTO leads VALUES (1, 'New')")
+    return SQLDatabase(sql_engine)
+
+
+def test_table_infos_render_outside_the_lock(sql_database, monkeypatch):
+    cache = SchemaInfoCache(sql_database)
+    lock_held = []
+    render = cache._render
+
+    def spy_render(*args, **kwargs):
+        lock_held.append(cache._lock.locked())
+        return render(*args, **kwargs)
+
+    monkeypatch.setattr(cache, "_render", spy_render)
+    tables = cache.table_infos(["leads", "accounts"])
+    assert list(tables) == ["leads", "accounts"]
+    assert "CREATE TABLE leads" in tables["leads"]
+    assert lock_held == [False, False]
+    cache.table_infos(["accounts"])
+    assert cache.stats() == {"tables_cached": 2, "renders": 2, "hits": 1}
+
+
+def test_table_infos_rerender_after_ddl(sql_database):
+    cache = SchemaInfoCache(sql_database, check_interval=0)
+    assert "owner" not in cache.table_infos(["leads"])["leads"]
+    with sql_database._engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE leads ADD COLUMN owner TEXT")
+    assert "owner" in cache.table_infos(["leads"])["leads"]
@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+import schema_catalog
+from schema_catalog import SchemaCatalog
+
+
+@pytest.fixture
+def sql_engine():
+    sql_engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    with sql_engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE accounts (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.exec_driver_sql("CREATE TABLE leads (id INTEGER PRIMARY KEY, account_id INTEGER REFERENCES accounts(id))")
+    return sql_engine
+
+
+def test_catalog_is_read_outside_the_lock(sql_engine, monkeypatch):
+    catalog = SchemaCatalog(sql_engine)
+    lock_held = []
+    read_catalog = schema_catalog.read_catalog
+
+    def spy_read_catalog(*args, **kwargs):
+        lock_held.append(catalog._lock.locked())
+        return read_catalog(*args, **kwargs)
+
+    monkeypatch.setattr(schema_catalog, "read_catalog", spy_read_catalog)
+    assert set(catalog.tables()) == {"accounts", "leads"}
+    assert lock_held == [False]
+
+
+def test_read_catalog_columns_and_keys(sql_engine):
+    tables = schema_catalog.read_catalog(sql_engine)
+    leads = {column["name"]: column for column in tables["leads"]["columns"]}
+    assert leads["id"]["pk"] is True
+    assert leads["account_id"]["fk"] == {"table": "accounts", "column": "id"}
+    assert leads["id"]["fk"] is None
+
+
+def test_etag_is_stable_without_ddl(sql_engine):
+    catalog = SchemaCatalog(sql_engine, check_interval=0)
+    payload, etag = catalog.payload()
+    with sql_engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO accounts VALUES (1, 'Acme')")  # data, not schema
+    assert catalog.payload() == (payload, etag)
+    assert catalog.stats()["builds"] == 1
+
+
+def test_etag_changes_after_ddl(sql_engine):
+    catalog = SchemaCatalog(sql_engine, check_interval=0)
+    _, etag = catalog.payload()
+    with sql_engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE accounts ADD COLUMN region TEXT")
+    payload, new_etag = catalog.payload()
+    assert new_etag != etag
+    assert b'"region"' in payload
+    assert catalog.stats()["builds"] == 2
+
+
+def test_version_is_rechecked_only_after_the_interval(sql_engine):
+    catalog = SchemaCatalog(sql_engine, check_interval=3600)
+    _, etag = catalog.payload()
+    with sql_engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE notes (id INTEGER PRIMARY KEY)")
+    assert catalog.payload()[1] == etag
+    catalog.invalidate()
+    assert catalog.payload()[1] != etag
+    assert "notes" in catalog.tables()
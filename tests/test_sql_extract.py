@@ -0,0 +1,23 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from benchmark import DEFAULT_EXTRACT_CORPUS, _fuzz_variants
+from sql_extract import extract_sql
+
+with open(Path(__file__).resolve().parent.parent / DEFAULT_EXTRACT_CORPUS, encoding="utf-8") as f:
+    CORPUS = [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=lambda case: case["input"][:40])
+def test_corpus_case(case):
+    assert extract_sql(case["input"]) == case["expected"]
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=lambda case: case["input"][:40])
+def test_fuzzed_wrappings_extract_unchanged(case):
+    rng = random.Random(f"fuzz:{case['input']}")
+    for variant in _fuzz_variants(case["expected"], rng, 20):
+        assert extract_sql(variant) == case["expected"], variant
@@ -0,0 +1,31 @@
+from sql_repair import validate_and_repair
+
+TABLES = {
+    "contacts": {"columns": [{"name": "id", "type": "TEXT"}, {"name": "lead_status", "type": "TEXT"}]},
+    "cases": {"columns": [{"name": "case_id", "type": "INTEGER"}, {"name": "deleted_status", "type": "BOOLEAN"}]},
+}
+
+
+def test_unqualified_soft_delete_filter_is_dropped():
+    result = validate_and_repair(
+        "SELECT COUNT(*) FROM contacts WHERE deleted_status = false AND lead_status = 'New';", TABLES)
+    assert result.ok
+    assert result.sql == "SELECT COUNT(*) FROM contacts WHERE lead_status = 'New';"
+    assert result.fixes == ["dropped deleted_status filter on contacts"]
+
+
+def test_qualified_soft_delete_filter_is_dropped():
+    result = validate_and_repair("SELECT COUNT(*) FROM contacts AS c WHERE c.deleted_status = false", TABLES)
+    assert result.ok
+    assert "deleted_status" not in result.sql
+
+
+def test_soft_delete_filter_in_or_is_reported():
+    result = validate_and_repair("SELECT id FROM contacts WHERE deleted_status = false OR id = '1'", TABLES)
+    assert result.problems == ["column deleted_status does not exist"]
+
+
+def test_soft_delete_filter_kept_where_column_exists():
+    sql = "SELECT COUNT(*) FROM cases WHERE deleted_status = false"
+    result = validate_and_repair(sql, TABLES)
+    assert result.ok and result.sql == sql